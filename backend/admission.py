@@ -0,0 +1,259 @@
+"""
+Admission control for the /upload pipeline. Each stage (analysis, explanation)
+gets a StageScheduler that caps the jobs running at once and the jobs allowed to
+wait, so bursts are turned away with a Retry-After instead of piling up latency
+for everyone.
+
+Waiting jobs sit in one of two lanes: 'fast' (images and interactive requests)
+is always served before 'bulk' (videos and batch uploads), and bulk jobs may only
+occupy part of the stage's slots, so a queue of videos never blocks an image.
+Within a lane, clients share the stage by weighted fair queuing: each job gets a
+virtual finish time of max(virtual clock, the client's previous finish) plus
+cost / weight, and the smallest finish time runs next. A client submitting a
+burst only delays its own later jobs.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+from instrumentation import histogram_samples
+from tracing import span
+
+LANES = ('fast', 'bulk')
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class QueueFull(Exception):
+    """Raised when a lane's queue is at capacity; retry_after estimates when a slot frees up."""
+
+    def __init__(self, stage: str, lane: str, retry_after: int):
+        super().__init__(f"{stage} queue is full ({lane} lane); retry in {retry_after}s")
+        self.stage = stage
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('client', 'lane', 'start_tag', 'finish_tag', 'future', 'cancelled')
+
+    def __init__(self, client, lane, start_tag, finish_tag):
+        self.client = client
+        self.lane = lane
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.future = None
+        self.cancelled = False
+
+
+class StageScheduler:
+    """
+    Bounded, fair admission to one pipeline stage. Use from the event loop only:
+
+        async with scheduler.slot(client_id, lane='bulk', cost=5):
+            ...
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queued: int = 32, bulk_concurrency: int = None,
+                 client_weights: Dict[str, float] = None):
+        """
+        Args:
+            name (str): Stage name used in errors and stats
+            concurrency (int): Jobs allowed to run at once
+            max_queued (int): Jobs allowed to wait per lane before QueueFull is raised
+            bulk_concurrency (int, optional): Running slots bulk jobs may take (default: half, at least one)
+            client_weights (dict, optional): Client id -> share weight (default 1.0)
+        """
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.max_queued = max_queued
+        self.bulk_concurrency = bulk_concurrency or max(self.concurrency // 2, 1)
+        self.client_weights = client_weights or {}
+
+        self._queues = {lane: [] for lane in LANES}
+        self._queued = {lane: 0 for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._seq = itertools.count()
+
+        self.admitted = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        self.wait_buckets = {lane: [0] * len(WAIT_BUCKETS) for lane in LANES}
+        self.wait_sum = {lane: 0.0 for lane in LANES}
+        self.wait_count = {lane: 0 for lane in LANES}
+        # Moving average of time in the stage, for Retry-After estimates
+        self._service_time = {lane: 1.0 for lane in LANES}
+
+    @classmethod
+    def from_env(cls, name: str, default_concurrency: int) -> 'StageScheduler':
+        """
+        Build a scheduler from <NAME>_CONCURRENCY, <NAME>_MAX_QUEUED and
+        <NAME>_BULK_CONCURRENCY, with per-client weights from CLIENT_WEIGHTS
+        ("client=weight,client=weight").
+        """
+        prefix = name.upper()
+        bulk = os.getenv(f'{prefix}_BULK_CONCURRENCY')
+        return cls(
+            name,
+            concurrency=int(os.getenv(f'{prefix}_CONCURRENCY', default_concurrency)),
+            max_queued=int(os.getenv(f'{prefix}_MAX_QUEUED', 32)),
+            bulk_concurrency=int(bulk) if bulk else None,
+            client_weights=parse_weights(os.getenv('CLIENT_WEIGHTS', ''))
+        )
+
+    @asynccontextmanager
+    async def slot(self, client: str, lane: str = 'fast', cost: float = 1.0):
+        """
+        Wait for a running slot in this stage.
+
+        Raises:
+            QueueFull: The lane already has max_queued jobs waiting
+        """
+        waiter = self._admit(client, lane, cost)
+        enqueued = time.monotonic()
+        if waiter.future is not None:
+            try:
+                with span(f'{self.name}.queue_wait', lane=lane):
+                    await waiter.future
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+        started = time.monotonic()
+        self._record_wait(lane, started - enqueued)
+        try:
+            yield
+        finally:
+            self._release(lane, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'stage': self.name,
+            'concurrency': self.concurrency,
+            'bulk_concurrency': self.bulk_concurrency,
+            'max_queued': self.max_queued,
+            'lanes': {
+                lane: {
+                    'queued': self._queued[lane],
+                    'running': self._running[lane],
+                    'admitted': self.admitted[lane],
+                    'rejected': self.rejected[lane],
+                    'wait_seconds_avg': self.wait_sum[lane] / self.wait_count[lane] if self.wait_count[lane] else 0.0,
+                    'wait_seconds_sum': self.wait_sum[lane],
+                    'wait_count': self.wait_count[lane],
+                    'wait_buckets': dict(zip(WAIT_BUCKETS, self.wait_buckets[lane])),
+                }
+                for lane in LANES
+            },
+        }
+
+    def collect(self):
+        """Queue metrics in the instrumentation collector format, for GET /metrics."""
+        labels = [(lane, {'stage': self.name, 'lane': lane}) for lane in LANES]
+        wait_samples = []
+        for lane, lane_labels in labels:
+            wait_samples += histogram_samples(lane_labels, WAIT_BUCKETS, self.wait_buckets[lane],
+                                              self.wait_sum[lane], self.wait_count[lane])
+        return [
+            ('trueview_queue_depth', 'gauge', 'Jobs waiting for a slot',
+             [('', l, self._queued[lane]) for lane, l in labels]),
+            ('trueview_queue_running', 'gauge', 'Jobs holding a slot',
+             [('', l, self._running[lane]) for lane, l in labels]),
+            ('trueview_queue_admitted_total', 'counter', 'Jobs given a slot',
+             [('', l, self.admitted[lane]) for lane, l in labels]),
+            ('trueview_queue_rejected_total', 'counter', 'Jobs turned away because the lane was full',
+             [('', l, self.rejected[lane]) for lane, l in labels]),
+            ('trueview_queue_wait_seconds', 'histogram', 'Time jobs waited for a slot', wait_samples),
+        ]
+
+    def _admit(self, client: str, lane: str, cost: float) -> _Waiter:
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+        start = max(self._virtual_time, self._last_finish.get(client, 0.0))
+        waiter = _Waiter(client, lane, start, start + cost / self.client_weights.get(client, 1.0))
+
+        if not self._queued[lane] and self._can_run(lane):
+            self._last_finish[client] = waiter.finish_tag
+            self._start(waiter)
+            return waiter
+        if self._queued[lane] >= self.max_queued:
+            self.rejected[lane] += 1
+            raise QueueFull(self.name, lane, self._retry_after(lane))
+
+        self._last_finish[client] = waiter.finish_tag
+        waiter.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[lane], (waiter.finish_tag, next(self._seq), waiter))
+        self._queued[lane] += 1
+        return waiter
+
+    def _can_run(self, lane: str) -> bool:
+        if sum(self._running.values()) >= self.concurrency:
+            return False
+        return lane != 'bulk' or self._running['bulk'] < self.bulk_concurrency
+
+    def _start(self, waiter: _Waiter):
+        self._running[waiter.lane] += 1
+        self.admitted[waiter.lane] += 1
+        self._virtual_time = max(self._virtual_time, waiter.start_tag)
+
+    def _dispatch(self):
+        """Hand free slots to the next waiters: fast lane first, lowest finish tag first."""
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self._can_run(lane):
+                _, _, waiter = heapq.heappop(queue)
+                if waiter.cancelled:
+                    continue
+                self._queued[lane] -= 1
+                if waiter.future.cancelled():
+                    # The caller is being cancelled; _abandon has nothing left to undo
+                    waiter.cancelled = True
+                    continue
+                self._start(waiter)
+                waiter.future.set_result(None)
+        if len(self._last_finish) > 10_000:
+            # Clients whose last job is behind the virtual clock carry no state worth keeping
+            self._last_finish = {c: f for c, f in self._last_finish.items() if f > self._virtual_time}
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter.future.done() and not waiter.future.cancelled():
+            # The slot was granted just as the caller went away
+            self._release(waiter.lane, 0.0)
+        elif not waiter.cancelled:
+            waiter.cancelled = True
+            self._queued[waiter.lane] -= 1
+
+    def _release(self, lane: str, service_time: float):
+        self._running[lane] -= 1
+        if service_time:
+            self._service_time[lane] = 0.8 * self._service_time[lane] + 0.2 * service_time
+        self._dispatch()
+
+    def _record_wait(self, lane: str, wait: float):
+        self.wait_sum[lane] += wait
+        self.wait_count[lane] += 1
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if wait <= bound:
+                self.wait_buckets[lane][i] += 1
+                break
+
+    def _retry_after(self, lane: str) -> int:
+        slots = self.bulk_concurrency if lane == 'bulk' else self.concurrency
+        return max(1, math.ceil((self._queued[lane] + 1) * self._service_time[lane] / slots))
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "client=weight,client=weight" into a dict."""
+    weights = {}
+    for item in spec.split(','):
+        client, _, weight = item.strip().partition('=')
+        if client and weight:
+            weights[client] = float(weight)
+    return weights
@@ -0,0 +1,317 @@
+import json
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from serialization import dumps_str
+
+
+class AnalysisStore:
+    """
+    Persistent history of /upload results in SQLite (WAL mode), so dashboards can
+    be reloaded or shared by id without re-running the detector, the analyzer or
+    Gemini. The response JSON is stored without raw_data; the per-frame series are
+    packed into a float32 blob that listing queries never read. Indexed on content
+    hash (to find earlier analyses of the same bytes), created_at and verdict.
+    Under a retention policy old analyses give up their media (see release_media)
+    while the results themselves are kept.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        """
+        Args:
+            path (str): SQLite file to persist to (':memory:' for a process-local store)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                filename TEXT,
+                media_type TEXT,
+                verdict TEXT,
+                ai_confidence REAL,
+                deepfake_confidence REAL,
+                result TEXT NOT NULL,
+                raw_data BLOB,
+                media_released INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(analyses)")}
+        if 'media_released' not in columns:
+            # Stores created before media retention
+            self._conn.execute("ALTER TABLE analyses ADD COLUMN media_released INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_content_hash ON analyses (content_hash, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_created_at ON analyses (created_at, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_verdict ON analyses (verdict, created_at, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_media ON analyses (media_released, created_at)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['AnalysisStore']:
+        """Build a store from ANALYSIS_STORE_PATH; returns None when it is set to an empty string."""
+        path = os.getenv('ANALYSIS_STORE_PATH', 'analyses.db')
+        if not path:
+            return None
+        return cls(path)
+
+    def save(self, response: Dict[str, Any], content_hash: str, analysis_id: str = None) -> str:
+        """
+        Store an /upload response.
+
+        Args:
+            response (dict): The response body, including analysis_result with its raw_data
+            content_hash (str): Hex digest of the uploaded bytes
+            analysis_id (str, optional): Id to store under (a new one is generated if omitted)
+
+        Returns:
+            str: The analysis id
+        """
+        analysis_id = analysis_id or uuid.uuid4().hex
+        analysis = response.get('analysis_result') or {}
+        stored = dict(response, analysis_result={k: v for k, v in analysis.items() if k != 'raw_data'})
+
+        with self._lock:
+            # Saving again (a deadline-cut analysis completed later) keeps the row's place in the history
+            self._conn.execute(
+                "INSERT INTO analyses (id, content_hash, created_at, filename, media_type, verdict, "
+                "ai_confidence, deepfake_confidence, result, raw_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET content_hash = excluded.content_hash, filename = excluded.filename, "
+                "media_type = excluded.media_type, verdict = excluded.verdict, ai_confidence = excluded.ai_confidence, "
+                "deepfake_confidence = excluded.deepfake_confidence, result = excluded.result, raw_data = excluded.raw_data",
+                (
+                    analysis_id, content_hash, time.time(), response.get('filename'), response.get('type'),
+                    verdict(response), response.get('ai_confidence'), response.get('deepfake_confidence'),
+                    dumps_str(stored), pack_series(analysis.get('raw_data') or {})
+                )
+            )
+            self._conn.commit()
+        return analysis_id
+
+    def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """The stored response with raw_data restored, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, raw_data, created_at FROM analyses WHERE id = ?", (analysis_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        response = json.loads(row[0])
+        if isinstance(response.get('analysis_result'), dict):
+            response['analysis_result']['raw_data'] = unpack_series(row[1])
+        response['id'] = analysis_id
+        response['created_at'] = row[2]
+        return response
+
+    def find_by_hash(self, content_hash: str) -> Optional[str]:
+        """Id of the most recent analysis of the same content, or None."""
+        found = self.find_all_by_hash(content_hash, 1)
+        return found[0] if found else None
+
+    def find_all_by_hash(self, content_hash: str, limit: int = 10) -> List[str]:
+        """Ids of the most recent analyses of the same content, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM analyses WHERE content_hash = ? ORDER BY created_at DESC LIMIT ?", (content_hash, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, analysis_id: str) -> Optional[str]:
+        """Remove an analysis; returns its content hash (so the caller can release the media), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
+            self._conn.commit()
+        return row[0]
+
+    def release_media(self, older_than: float = None, keep_latest: int = None, limit: int = 500) -> List[Dict[str, Any]]:
+        """
+        Detach the media from old analyses: their path and previews become None and
+        media_released True, so the blobs they referenced can be released and evicted.
+        Analyses with sections still pending are skipped until they are complete.
+
+        Args:
+            older_than (float, optional): Release analyses created before this epoch time
+            keep_latest (int, optional): Release all but the newest keep_latest analyses
+            limit (int): Most analyses to release in one call (oldest first)
+
+        Returns:
+            list: The released responses as they were, so the caller can drop their blob references
+        """
+        clauses, params = [], []
+        if older_than is not None:
+            clauses.append("created_at < ?")
+            params.append(older_than)
+        if keep_latest is not None and keep_latest <= 0:
+            clauses.append("1")
+        elif keep_latest is not None:
+            # Older than the keep_latest-th newest analysis (NULL, so nothing, while there are fewer)
+            clauses.append("created_at < (SELECT created_at FROM analyses ORDER BY created_at DESC LIMIT 1 OFFSET ?)")
+            params.append(keep_latest - 1)
+        if not clauses:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, result FROM analyses WHERE media_released = 0 AND "
+                "COALESCE(json_array_length(result, '$.pending'), 0) = 0 "
+                f"AND ({' OR '.join(clauses)}) ORDER BY created_at LIMIT ?",
+                params + [limit]
+            ).fetchall()
+            released, updates = [], []
+            for analysis_id, result in rows:
+                response = json.loads(result)
+                released.append(dict(response, id=analysis_id))
+                response.update(path=None, previews=None, media_released=True)
+                updates.append((dumps_str(response), analysis_id))
+            self._conn.executemany("UPDATE analyses SET result = ?, media_released = 1 WHERE id = ?", updates)
+            self._conn.commit()
+        return released
+
+    def update_explanations(self, analysis_id: str, explanations: Dict[str, Any]):
+        """Swap in explanations that arrived after the analysis was stored."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            if row is None:
+                return
+            response = json.loads(row[0])
+            response['briefOverview'] = explanations['overview']
+            response['metricExplanations'] = explanations['metrics']
+            response['explanationSource'] = explanations.get('source')
+            # The upgrade has landed, even if Gemini failed and it is local text again
+            response['explanationId'] = None
+            self._conn.execute(
+                "UPDATE analyses SET result = ? WHERE id = ?",
+                (dumps_str(response), analysis_id)
+            )
+            self._conn.commit()
+
+    def list_results(self, limit: int = 50, cursor: str = None, verdict: str = None, content_hash: str = None) -> Dict[str, Any]:
+        """
+        Newest-first page of summaries, using keyset pagination so deep pages stay
+        as cheap as the first.
+
+        Args:
+            limit (int): Page size
+            cursor (str, optional): next_cursor from the previous page
+            verdict (str, optional): Only 'ai', 'deepfake', 'authentic' or (still waiting for the detector) 'pending' results
+            content_hash (str, optional): Only analyses of this content
+
+        Returns:
+            dict: {'items': [...], 'next_cursor': str | None}
+
+        Raises:
+            ValueError: A cursor that is not one this method returned
+        """
+        clauses, params = [], []
+        if verdict:
+            clauses.append("verdict = ?")
+            params.append(verdict)
+        if content_hash:
+            clauses.append("content_hash = ?")
+            params.append(content_hash)
+        if cursor:
+            created_at, _, last_id = cursor.partition(':')
+            try:
+                created_at = float(created_at)
+            except ValueError:
+                created_at = None
+            if created_at is None or not last_id or not math.isfinite(created_at):
+                raise ValueError(f"Malformed cursor: {cursor!r}")
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, last_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, filename, media_type, verdict, ai_confidence, deepfake_confidence, content_hash "
+                f"FROM analyses {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+
+        items = [
+            {
+                'id': r[0], 'created_at': r[1], 'filename': r[2], 'type': r[3], 'verdict': r[4],
+                'ai_confidence': r[5], 'deepfake_confidence': r[6], 'content_hash': r[7],
+            }
+            for r in rows[:limit]
+        ]
+        next_cursor = f"{items[-1]['created_at']!r}:{items[-1]['id']}" if len(rows) > limit else None
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def iter_features(self, batch_size: int = 1000):
+        """
+        Yield (id, media_type, metrics, verdict, created_at) for every stored analysis,
+        in insertion order, to (re)build a SimilarityIndex.
+        """
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT rowid, id, media_type, verdict, created_at, result FROM analyses WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            for _, analysis_id, media_type, verdict, created_at, result in rows:
+                metrics = (json.loads(result).get('analysis_result') or {}).get('metrics')
+                yield analysis_id, media_type, metrics, verdict, created_at
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT verdict, COUNT(*) FROM analyses GROUP BY verdict").fetchall()
+        return {'entries': sum(count for _, count in rows), 'verdicts': dict(rows)}
+
+
+def verdict(response: Dict[str, Any]) -> Optional[str]:
+    """
+    'deepfake', 'ai' or 'authentic' from the detector's result; 'pending' while it is
+    still to come after a deadline, and None when the detector failed.
+    """
+    if 'ai_scan_result' in response and response['ai_scan_result'] is None:
+        return 'pending' if 'ai_scan_result' in (response.get('pending') or []) else None
+    if response.get('is_deepfake'):
+        return 'deepfake'
+    if response.get('ai_detected'):
+        return 'ai'
+    return 'authentic'
+
+
+def pack_series(series: Dict[str, Any]) -> bytes:
+    """
+    Pack named numeric series into one blob: a little-endian uint32 header length,
+    a JSON header of names and lengths, then every series as float32.
+    """
+    names = list(series)
+    arrays = [np.asarray(series[name], dtype='<f4') for name in names]
+    header = json.dumps({'names': names, 'lengths': [len(a) for a in arrays]}).encode()
+    return struct.pack('<I', len(header)) + header + b''.join(a.tobytes() for a in arrays)
+
+
+def unpack_series(blob: bytes) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    (header_len,) = struct.unpack_from('<I', blob)
+    header = json.loads(blob[4:4 + header_len])
+    values = np.frombuffer(blob, dtype='<f4', offset=4 + header_len)
+    series, start = {}, 0
+    for name, length in zip(header['names'], header['lengths']):
+        series[name] = values[start:start + length].tolist()
+        start += length
+    return series
+
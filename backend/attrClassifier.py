@@ -1,6 +1,35 @@
 import cv2
 import numpy as np
 import os
+import time
+
+from face_roi import FaceTracker
+from instrumentation import stage, inc
+from tracing import traced
+from metric_registry import PRIMITIVES, compute_metrics, required_primitives, validate_metric_names
+import previews
+
+
+def coarse_to_fine(positions):
+    """
+    positions reordered so every prefix is spread across the whole range: the ends
+    first, then the middle, then the middles of the halves, and so on.
+    """
+    positions = list(positions)
+    if len(positions) <= 2:
+        return positions
+    order = [0, len(positions) - 1]
+    intervals = [(0, len(positions) - 1)]
+    while intervals:
+        next_intervals = []
+        for low, high in intervals:
+            if high - low < 2:
+                continue
+            middle = (low + high) // 2
+            order.append(middle)
+            next_intervals += [(low, middle), (middle, high)]
+        intervals = next_intervals
+    return [positions[k] for k in order]
 
 
 class MediaAnalyzer:
@@ -9,8 +38,39 @@ class MediaAnalyzer:
     Extracts features like motion scores, edge consistency, and texture variance.
     """
     
-    def __init__(self):
+    def __init__(self, timeline_seconds=1.0, timeline_frames=None, roi=None, max_dimension=None, metrics=None,
+                 keep_previews=False, sample_frames=10, deadline=None):
+        """
+        Args:
+            timeline_seconds (float, optional): Bucket width of the video timeline in seconds.
+                Videos are sampled at least once per bucket, so long clips decode more than
+                sample_frames frames; None (and no timeline_frames) skips the timeline
+            timeline_frames (int, optional): Bucket the timeline every N source frames instead
+            roi (str, optional): 'face' to compute metrics only inside tracked face crops (256px).
+                They are scored against the whole-frame thresholds: those are heuristic ranges
+                already shared by every working resolution (see max_dimension), and all metrics
+                but edge continuity are per-pixel means or variances. Edge continuity, a contour
+                length in pixels, reads shorter on a crop as it does on a downscaled frame
+            max_dimension (int, optional): Downscale frames so their longer side is at most this
+            metrics (iterable, optional): Only compute these metrics (see metric_registry); primitives
+                no selected metric needs are skipped. Defaults to every metric.
+            keep_previews (bool): Keep small color copies of the decoded frames for build_previews
+            sample_frames (int): Frames sampled evenly across a video; fewer decode faster
+                (a timeline can raise this to one per bucket)
+            deadline (float, optional): Epoch seconds after which no more video frames are
+                decoded; the frames sampled by then (at least two) are analysed
+        """
+        if roi not in (None, 'face'):
+            raise ValueError(f"Unsupported roi: {roi}")
+        validate_metric_names(metrics)
+        self.metric_names = set(metrics) if metrics is not None else None
+        self.roi = roi
+        self.max_dimension = max_dimension
+        self.face_tracker = FaceTracker() if roi == 'face' else None
+        self.timeline_seconds = timeline_seconds
+        self.timeline_frames = timeline_frames
         self.frames = []
+        self.frame_indices = []
         self.motion_scores = []
         self.edge_consistency = []
         self.texture_variances = []
@@ -18,13 +78,21 @@ class MediaAnalyzer:
         self.color_variance = 0
         self.edge_continuity = 0
         self.metadata = {}
+        self.keep_previews = keep_previews
+        self.sample_frames = max(int(sample_frames), 2)
+        self.deadline = deadline
+        self.preview_poster = None
+        self.preview_frames = []
     
-    def analyze_video(self, file_path):
+    @traced()
+    def analyze_video(self, file_path, probe=None):
         """
         Analyze a video file.
         
         Args:
             file_path (str): Path to the video file
+            probe (dict, optional): Header info from probe.probe_media, used when the
+                container doesn't report a frame count and to pick the working scale
             
         Returns:
             dict: Video analysis results
@@ -38,6 +106,15 @@ class MediaAnalyzer:
         fps = cap.get(cv2.CAP_PROP_FPS)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        if probe:
+            if frame_count <= 0 and probe.get('frame_count'):
+                frame_count = probe['frame_count']
+            if fps <= 0 and probe.get('fps'):
+                fps = probe['fps']
+            width, height = width or probe['width'], height or probe['height']
+
+        scale = self.working_scale(width, height)
         
         self.metadata = {
             'type': 'video',
@@ -48,74 +125,248 @@ class MediaAnalyzer:
             'duration': frame_count / fps if fps > 0 else 0
         }
         
-        sample_rate = max(frame_count // 10, 1)
+        sample_rate = max(frame_count // self.sample_frames, 1)
+        bucket_frames = self.timeline_bucket_frames(fps)
+        if bucket_frames:
+            # At least one sample per timeline bucket, so no bucket of a long clip is empty
+            sample_rate = min(sample_rate, bucket_frames)
+        sample_positions = range(0, frame_count, sample_rate)
+        poster_index = sample_positions[len(sample_positions) // 2] if len(sample_positions) else 0
+        # Against a deadline, visit the samples coarse to fine so any prefix still spans the
+        # whole video (the face tracker needs them in order, so it keeps the plain order)
+        spread = self.deadline is not None and not self.face_tracker
+        visit_order = coarse_to_fine(sample_positions) if spread else sample_positions
         self.frames = []
+        self.frame_indices = []
+        self.preview_poster = None
+        self.preview_frames = []
+        fallback_frames, fallback_indices = [], []
+        if self.face_tracker:
+            self.face_tracker.reset()
         
-        for i in range(0, frame_count, sample_rate):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-            ret, frame = cap.read()
-            if not ret:
-                break
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            self.frames.append(gray)
+        decoded = 0
+        stopped_early = False
+        decode_started = time.time()
+        with stage('decode'):
+            for i in visit_order:
+                # Stop when decoding one more frame, at the average pace so far, would pass the deadline
+                if self.deadline is not None and decoded >= 2:
+                    now = time.time()
+                    if now + (now - decode_started) / decoded >= self.deadline:
+                        stopped_early = True
+                        break
+                cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+                ret, frame = cap.read()
+                if not ret:
+                    if spread:
+                        continue
+                    break
+                decoded += 1
+                if scale < 1.0:
+                    frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                if self.keep_previews:
+                    self.preview_frames.append(previews.fit(frame, previews.CLIP_SIZE))
+                    if i == poster_index or self.preview_poster is None:
+                        self.preview_poster = previews.fit(frame, previews.POSTER_SIZE)
+
+                if self.face_tracker:
+                    box = self.face_tracker.update(frame)
+                    if box is not None:
+                        self.frames.append(cv2.cvtColor(self.face_tracker.crop(frame, box), cv2.COLOR_BGR2GRAY))
+                        self.frame_indices.append(i)
+                        continue
+                    if self.frames:
+                        continue
+                    # No face yet: keep the full frame in case none ever shows up
+                    fallback_frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+                    fallback_indices.append(i)
+                    continue
+
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                self.frames.append(gray)
+                self.frame_indices.append(i)
         
         cap.release()
+        inc('trueview_frames_decoded_total', decoded, media_type='video')
+
+        if spread:
+            order = sorted(range(len(self.frame_indices)), key=self.frame_indices.__getitem__)
+            self.frames = [self.frames[k] for k in order]
+            self.preview_frames = [self.preview_frames[k] for k in order] if self.keep_previews else []
+            self.frame_indices = [self.frame_indices[k] for k in order]
+        if stopped_early:
+            self.metadata['partial'] = {'reason': 'deadline', 'frames_sampled': decoded, 'frames_planned': len(sample_positions)}
+
+        if scale < 1.0:
+            self.metadata['analysis_scale'] = scale
+
+        if self.face_tracker:
+            self.metadata['roi'] = dict(self.face_tracker.stats(), applied=bool(self.frames))
+            if not self.frames:
+                self.frames, self.frame_indices = fallback_frames, fallback_indices
         
-        self.calculate_motion_and_edges()
-        self.calculate_texture_variance()
+        needed = required_primitives('video', self.metric_names)
+        with stage('analyze.motion_edges'):
+            self.calculate_motion_and_edges(motion='motion_scores' in needed, edges='edge_consistency' in needed)
+        if 'texture_variances' in needed:
+            with stage('analyze.texture'):
+                self.calculate_texture_variance()
+        else:
+            self.texture_variances = []
         
         return self.compile_results()
     
-    def analyze_image(self, file_path):
+    @traced()
+    def analyze_image(self, file_path, probe=None):
         """
         Analyze a single image file.
         
         Args:
             file_path (str): Path to the image file
+            probe (dict, optional): Header info from probe.probe_media; lets the decoder
+                skip straight to a reduced resolution when max_dimension is set
             
         Returns:
             dict: Image analysis results
         """
-        image = cv2.imread(file_path)
+        with stage('decode'):
+            image = cv2.imread(file_path, self.image_read_flag(probe))
         
         if image is None:
             raise ValueError(f"Could not read image file: {file_path}")
         
+        return self.analyze_decoded_image(image, probe)
+
+    @traced()
+    def analyze_image_buffer(self, buffer, probe=None):
+        """
+        Analyze an image that is already in memory, without touching disk.
+        
+        Args:
+            buffer (bytes-like): Encoded image bytes (decoded in place, not copied)
+            probe (dict, optional): Header info from probe.probe_media
+            
+        Returns:
+            dict: Image analysis results
+        """
+        with stage('decode', nbytes=len(buffer)):
+            image = cv2.imdecode(np.frombuffer(memoryview(buffer), dtype=np.uint8), self.image_read_flag(probe))
+        
+        if image is None:
+            raise ValueError("Could not decode image buffer")
+        
+        return self.analyze_decoded_image(image, probe)
+
+    @traced()
+    def analyze_decoded_image(self, image, probe=None):
+        inc('trueview_frames_decoded_total', media_type='image')
         height, width = image.shape[:2]
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if probe:
+            # Report full-size dimensions in decoded orientation (imread applies EXIF rotation)
+            reduction = max(probe['width'], probe['height']) / max(width, height)
+            height, width = round(height * reduction), round(width * reduction)
         
         self.metadata = {
             'type': 'image',
             'width': width,
             'height': height
         }
-        
+
+        scale = self.working_scale(image.shape[1], image.shape[0])
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if image.shape[1] != width:
+            self.metadata['analysis_scale'] = image.shape[1] / width
+
+        self.preview_frames = []
+        self.preview_poster = previews.fit(image, previews.POSTER_SIZE) if self.keep_previews else None
+
+        if self.face_tracker:
+            self.face_tracker.reset()
+            box = self.face_tracker.update(image)
+            if box is not None:
+                image = self.face_tracker.crop(image, box)
+            self.metadata['roi'] = dict(self.face_tracker.stats(), applied=box is not None)
+
+        needed = required_primitives('image', self.metric_names)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         self.frames = [gray]
-        
 
         self.motion_scores = []
         self.edge_consistency = []
-        self.calculate_texture_variance()
+        self.texture_variances = []
+        if 'texture_variances' in needed:
+            with stage('analyze.texture'):
+                self.calculate_texture_variance()
         
-        self.edge_density = self.calculate_edge_density(gray)
-        self.color_variance = self.calculate_color_variance(image)
-        self.edge_continuity = self.calculate_edge_continuity(image)
+        self.edge_density = self.color_variance = self.edge_continuity = 0
+        if 'edge_density' in needed:
+            with stage('analyze.edge_density'):
+                self.edge_density = self.calculate_edge_density(gray)
+        if 'color_variance' in needed:
+            with stage('analyze.color_variance'):
+                self.color_variance = self.calculate_color_variance(image)
+        if 'edge_continuity' in needed:
+            with stage('analyze.edge_continuity'):
+                self.edge_continuity = self.calculate_edge_continuity(image)
         
         return self.compile_results()
     
-    def calculate_motion_and_edges(self):
+    @traced()
+    def build_previews(self, clip=True):
+        """
+        Encode a WebP thumbnail, poster frame and (for videos) an animated preview clip
+        from the frames kept during the last analysis, so nothing is decoded twice.
+
+        Returns:
+            dict or None: See previews.build_previews; None unless keep_previews was set
+        """
+        if self.preview_poster is None:
+            return None
+        return previews.build_previews(self.preview_poster, self.preview_frames if clip else None)
+
+    def timeline_bucket_frames(self, fps):
+        """Source frames per timeline bucket, or None without a timeline (or a known fps)."""
+        if self.timeline_frames:
+            return int(self.timeline_frames)
+        if self.timeline_seconds and fps > 0:
+            return max(int(fps * self.timeline_seconds), 1)
+        return None
+
+    def working_scale(self, width, height):
+        """Scale factor that brings the longer side down to max_dimension (1.0 if unset)."""
+        longest = max(width, height)
+        if not self.max_dimension or longest <= self.max_dimension:
+            return 1.0
+        return self.max_dimension / longest
+
+    def image_read_flag(self, probe=None):
+        """Pick the largest IMREAD_REDUCED_* factor that still leaves max_dimension pixels."""
+        if not probe or not self.max_dimension:
+            return cv2.IMREAD_COLOR
+        longest = max(probe['width'], probe['height'])
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if longest / factor >= self.max_dimension:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def calculate_motion_and_edges(self, motion=True, edges=True):
         self.motion_scores = []
         self.edge_consistency = []
         
+        # Each frame's edge map is reused as the previous one for the next pair
+        prev_edges = cv2.Canny(self.frames[0], 100, 200) if edges and self.frames else None
         for i in range(1, len(self.frames)):
 
-            diff = cv2.absdiff(self.frames[i], self.frames[i-1])
-            self.motion_scores.append(np.mean(diff))
+            if motion:
+                diff = cv2.absdiff(self.frames[i], self.frames[i-1])
+                self.motion_scores.append(np.mean(diff))
             
-            edges1 = cv2.Canny(self.frames[i-1], 100, 200)
-            edges2 = cv2.Canny(self.frames[i], 100, 200)
-            edge_diff = np.mean(cv2.absdiff(edges1, edges2))
-            self.edge_consistency.append(edge_diff)
+            if edges:
+                cur_edges = cv2.Canny(self.frames[i], 100, 200)
+                edge_diff = np.mean(cv2.absdiff(prev_edges, cur_edges))
+                self.edge_consistency.append(edge_diff)
+                prev_edges = cur_edges
     
     def calculate_texture_variance(self):
         self.texture_variances = [
@@ -138,7 +389,53 @@ class MediaAnalyzer:
         avg_len = np.mean([len(c) for c in contours]) if contours else 0
         return avg_len
 
+    def build_timeline(self):
+        """
+        Aggregate the per-sample scores into time buckets, in columnar form.
+        Motion and edge scores belong to the later frame of each pair.
+
+        Returns:
+            dict: Bucket start times plus one mean value per bucket for each metric
+        """
+        fps = self.metadata.get('fps') or 0
+        if self.timeline_frames:
+            bucket_of = lambda idx: idx // self.timeline_frames
+            bucket_start = lambda b: b * self.timeline_frames / fps if fps > 0 else 0
+            interval = {'frames': self.timeline_frames}
+        else:
+            width = self.timeline_seconds
+            bucket_of = lambda idx: int((idx / fps) // width) if fps > 0 else 0
+            bucket_start = lambda b: b * width
+            interval = {'seconds': width}
+
+        # Series skipped by a metric selection are empty and come out as None
+        buckets = {}
+        for n, idx in enumerate(self.frame_indices):
+            sums = buckets.setdefault(bucket_of(idx), [0.0, 0, 0.0, 0, 0.0, 0, 0])
+            sums[6] += 1
+            if self.texture_variances:
+                sums[4] += self.texture_variances[n]
+                sums[5] += 1
+            if n > 0 and self.motion_scores:
+                sums[0] += self.motion_scores[n - 1]
+                sums[1] += 1
+            if n > 0 and self.edge_consistency:
+                sums[2] += self.edge_consistency[n - 1]
+                sums[3] += 1
+
+        mean = lambda total, count: float(total / count) if count else None
+        order = sorted(buckets)
+        return {
+            'interval': interval,
+            'time': [round(bucket_start(b), 3) for b in order],
+            'samples': [buckets[b][6] for b in order],
+            'motion': [mean(buckets[b][0], buckets[b][1]) for b in order],
+            'edge_consistency': [mean(buckets[b][2], buckets[b][3]) for b in order],
+            'texture_variance': [mean(buckets[b][4], buckets[b][5]) for b in order],
+        }
+
 
+    @traced()
     def compile_results(self):
         """
         Compile all analysis results into a dictionary.
@@ -146,37 +443,28 @@ class MediaAnalyzer:
         Returns:
             dict: Complete analysis results
         """
-        if self.metadata["type"] == 'video':
-            results = {
-                'metadata': self.metadata,
-                'metrics': {
-                    'avg_motion': np.mean(self.motion_scores) if self.motion_scores else 0,
-                    'avg_edge_consistency': np.mean(self.edge_consistency) if self.edge_consistency else 0,
-                    'avg_texture_variance': np.mean(self.texture_variances) if self.texture_variances else 0,
-                    'motion_std': np.std(self.motion_scores) if self.motion_scores else 0,
-                    'edge_std': np.std(self.edge_consistency) if self.edge_consistency else 0,
-                    'texture_std': np.std(self.texture_variances) if self.texture_variances else 0,
-                },
-                'raw_data': {
-                    'motion_scores': self.motion_scores,
-                    'edge_consistency': self.edge_consistency,
-                    'texture_variances': self.texture_variances,
-                }
-            }
-        else:
-            results = {
-                'metadata': self.metadata,
-                'metrics': {
-                    'avg_texture_variance': np.mean(self.texture_variances) if self.texture_variances else 0,
-                    'texture_std': np.std(self.texture_variances) if self.texture_variances else 0,
-                    'edge_density': self.edge_density,
-                    'color_variance': self.color_variance,
-                    'edge_continuity': self.edge_continuity
-                },
-                'raw_data': {
-                    'texture_variances': self.texture_variances,
-                }
+        media_type = self.metadata["type"]
+        primitives = {
+            'motion_scores': self.motion_scores,
+            'edge_consistency': self.edge_consistency,
+            'texture_variances': self.texture_variances,
+            'edge_density': self.edge_density,
+            'color_variance': self.color_variance,
+            'edge_continuity': self.edge_continuity,
+        }
+        needed = required_primitives(media_type, self.metric_names)
+        
+        results = {
+            'metadata': self.metadata,
+            'metrics': compute_metrics(media_type, primitives, self.metric_names),
+            'raw_data': {
+                name: primitives[name]
+                for name, primitive in PRIMITIVES[media_type].items()
+                if primitive['series'] and name in needed
             }
+        }
+        if media_type == 'video' and (self.timeline_seconds or self.timeline_frames):
+            results['timeline'] = self.build_timeline()
         
         return results
 
@@ -185,4 +473,4 @@ if __name__ == "__main__":
     result = analyzer.analyze_image('../media/ai_cow.png')
     result1 = analyzer.analyze_video('../media/lion_ai_video.mp4')
     print(result)
-    print(result1)
\ No newline at end of file
+    print(result1)
@@ -0,0 +1,427 @@
+"""
+MediaAnalyzer benchmarks: per-stage time, frames/sec and peak RSS over the
+media/ corpus and synthetic images and videos at 480p, 1080p and 4K, reported as
+scaling curves. Saved results act as a baseline; runs that regress past the
+threshold exit non-zero, so the suite can gate optimization work in CI.
+
+    python benchmark.py --save baseline.json          # record a baseline
+    python benchmark.py --compare baseline.json       # fail on >20% regressions
+    python benchmark.py --quick --sizes 480p,1080p    # smaller, faster grid
+    python benchmark.py --startup --save startup.json # process start-up times
+    python benchmark.py --similarity                  # similarity search up to 1M entries
+
+Each case runs in a fresh process, so peak RSS is the case's own and no decoder
+state leaks between cases. Stage times come from the tracing spans.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+RESOLUTIONS = {'480p': (854, 480), '1080p': (1920, 1080), '4k': (3840, 2160)}
+DURATIONS = (2, 10)
+QUICK_DURATIONS = (2,)
+VIDEO_FPS = 30
+CORPUS_DIR = '../media'
+
+
+def synthetic_frame(width, height, seed):
+    """A deterministic frame with texture, edges and color, so every metric has work to do."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+    gradient = np.linspace(0, 160, width, dtype=np.uint8)
+    frame += gradient[None, :, None]
+    for _ in range(12):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        radius = int(rng.integers(height // 20, height // 5))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(frame, (x, y), radius, color, -1)
+    return frame
+
+
+def make_image(directory, name, width, height):
+    path = os.path.join(directory, f'{name}.png')
+    if not os.path.exists(path):
+        cv2.imwrite(path, synthetic_frame(width, height, seed=width))
+    return path
+
+
+def make_video(directory, name, width, height, seconds):
+    """Synthetic video with moving shapes (so motion metrics vary), cached between runs."""
+    path = os.path.join(directory, f'{name}.mp4')
+    if os.path.exists(path):
+        return path
+    base = synthetic_frame(width, height, seed=width)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), VIDEO_FPS, (width, height))
+    for i in range(int(seconds * VIDEO_FPS)):
+        frame = np.roll(base, shift=i * max(width // 200, 1), axis=1)
+        cv2.putText(frame, str(i), (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, height / 200, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def build_cases(sizes, durations, corpus=True, cache_dir=None):
+    """
+    Returns:
+        list: {'name', 'kind', 'path', 'pixels', 'duration'} per benchmark case
+    """
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'trueview-bench')
+    os.makedirs(cache_dir, exist_ok=True)
+    cases = []
+    for size in sizes:
+        width, height = RESOLUTIONS[size]
+        cases.append({'name': f'synthetic-image-{size}', 'kind': 'image', 'size': size,
+                      'path': make_image(cache_dir, f'image-{size}', width, height), 'pixels': width * height})
+        for seconds in durations:
+            cases.append({'name': f'synthetic-video-{size}-{seconds}s', 'kind': 'video', 'size': size, 'duration': seconds,
+                          'path': make_video(cache_dir, f'video-{size}-{seconds}s', width, height, seconds),
+                          'pixels': width * height})
+
+    if corpus and os.path.isdir(CORPUS_DIR):
+        from probe import probe_media, ProbeError
+        for filename in sorted(os.listdir(CORPUS_DIR)):
+            path = os.path.join(CORPUS_DIR, filename)
+            try:
+                probe = probe_media(path)
+            except (ProbeError, OSError):
+                continue
+            cases.append({'name': f'media/{filename}', 'kind': probe['type'], 'path': path,
+                          'pixels': probe['width'] * probe['height'], 'duration': probe.get('duration')})
+    return cases
+
+
+def run_case(case, repeat, metrics=None):
+    """Runs in a child process: analyze the case `repeat` times and report medians and peak RSS."""
+    from attrClassifier import MediaAnalyzer
+    from probe import probe_media
+    import tracing
+
+    probe = probe_media(case['path'])
+    runs = []
+    for _ in range(repeat):
+        analyzer = MediaAnalyzer(metrics=metrics)
+        trace, token = tracing.begin(case['name'])
+        start = time.perf_counter()
+        if case['kind'] == 'video':
+            analyzer.analyze_video(case['path'], probe)
+        else:
+            analyzer.analyze_image(case['path'], probe)
+        elapsed = time.perf_counter() - start
+        tracing.end(trace, token)
+
+        stages = {}
+        for span in trace.spans:
+            if not span['name'].startswith('MediaAnalyzer.'):
+                stages[span['name']] = stages.get(span['name'], 0.0) + span['duration']
+        runs.append({'seconds': elapsed, 'frames': len(analyzer.frames), 'stages': stages,
+                     'source_frames': analyzer.metadata.get('frame_count', 1)})
+
+    seconds = statistics.median(r['seconds'] for r in runs)
+    stage_names = {name for r in runs for name in r['stages']}
+    rss = peak_rss()
+    return {
+        'seconds': seconds,
+        'seconds_min': min(r['seconds'] for r in runs),
+        'frames_decoded': runs[0]['frames'],
+        'fps': runs[0]['frames'] / seconds if seconds else 0.0,
+        'source_fps': runs[0]['source_frames'] / seconds if seconds else 0.0,
+        'peak_rss_bytes': rss,
+        'stages': {name: statistics.median(r['stages'].get(name, 0.0) for r in runs) for name in sorted(stage_names)},
+    }
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    # VmHWM belongs to this address space; ru_maxrss on Linux also carries the parent's peak across fork/exec
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _run_isolated(args):
+    case, repeat, metrics = args
+    return run_case(case, repeat, metrics)
+
+
+def run_suite(cases, repeat=3, metrics=None):
+    """Run every case in its own spawned process (one at a time, so timings don't contend)."""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for case in cases:
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            result = pool.apply(_run_isolated, ((case, repeat, metrics),))
+        results[case['name']] = dict(result, kind=case['kind'], size=case.get('size'),
+                                     pixels=case['pixels'], duration=case.get('duration'))
+        print(f"{case['name']:<48} {result['seconds'] * 1000:9.1f} ms  {result['fps']:8.1f} fps  "
+              f"{result['peak_rss_bytes'] / 2**20:7.1f} MiB", flush=True)
+    return results
+
+
+def print_curves(results):
+    """Scaling curves: time and throughput against resolution (images) and resolution x duration (videos)."""
+    for kind in ('image', 'video'):
+        rows = sorted((r for r in results.values() if r['kind'] == kind and r['size']),
+                      key=lambda r: (r['pixels'], r['duration'] or 0))
+        if not rows:
+            continue
+        print(f"\n{kind} scaling")
+        print(f"{'size':<7}{'duration':>9}{'ms':>10}{'ms/MP':>9}{'fps':>9}{'MiB':>8}  slowest stages")
+        for r in rows:
+            stages = sorted(r['stages'].items(), key=lambda s: -s[1])[:3]
+            print(f"{r['size']:<7}{(r['duration'] or 0):>8}s{r['seconds'] * 1000:>10.1f}"
+                  f"{r['seconds'] * 1000 / (r['pixels'] / 1e6):>9.2f}{r['fps']:>9.1f}{r['peak_rss_bytes'] / 2**20:>8.1f}  "
+                  + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in stages))
+
+
+def compare(results, baseline, threshold, rss_threshold):
+    """
+    Returns:
+        list: Human-readable regressions (empty when within thresholds)
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        if result['seconds'] > before['seconds'] * (1 + threshold):
+            regressions.append(f"{name}: {before['seconds'] * 1000:.1f} ms -> {result['seconds'] * 1000:.1f} ms "
+                               f"(+{(result['seconds'] / before['seconds'] - 1) * 100:.0f}%)")
+        if result['peak_rss_bytes'] > before['peak_rss_bytes'] * (1 + rss_threshold):
+            regressions.append(f"{name}: peak RSS {before['peak_rss_bytes'] / 2**20:.1f} MiB -> "
+                               f"{result['peak_rss_bytes'] / 2**20:.1f} MiB")
+    return regressions
+
+
+def measure_startup(repeat=5):
+    """
+    Start-up cost of fresh processes (page cache warm; median of `repeat` runs):
+    importing the API module, the API becoming ready with and without warm-up and
+    its first upload in each case, and CLI runs that skip the network stages.
+
+    Returns:
+        dict: name -> {'seconds', 'seconds_min'}
+    """
+    backend = os.path.dirname(os.path.abspath(__file__))
+    cache_dir = os.path.join(tempfile.gettempdir(), 'trueview-bench')
+    os.makedirs(cache_dir, exist_ok=True)
+    width, height = RESOLUTIONS['480p']
+    image = make_image(cache_dir, 'image-480p', width, height)
+
+    commands = {
+        'import save_file': [sys.executable, '-c', 'import save_file'],
+        'cli --help': [sys.executable, 'main.py', '--help'],
+        'cli one image (local only)': [sys.executable, 'main.py', image, '--no-detector', '--no-explain',
+                                       '--workers', '1', '--quiet'],
+    }
+    timings = {}
+    for name, command in commands.items():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=backend, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            timings.setdefault(name, []).append(time.perf_counter() - start)
+    for warmup in ('0', '1'):
+        for _ in range(repeat):
+            ready, first_upload = _api_startup(backend, image, warmup)
+            timings.setdefault(f'api ready (WARMUP={warmup})', []).append(ready)
+            timings.setdefault(f'api ready + first upload (WARMUP={warmup})', []).append(ready + first_upload)
+    return {name: {'seconds': statistics.median(values), 'seconds_min': min(values)} for name, values in timings.items()}
+
+
+def _api_startup(backend, image, warmup):
+    """Seconds until a fresh API process answers, and the latency of its first upload (against the load-test fakes)."""
+    import httpx
+    from loadtest import FakeServices, _free_port
+
+    fakes = FakeServices(detector_latency=0, video_detector_latency=0, gemini_latency=0, jitter=0).start()
+    workdir = tempfile.mkdtemp(prefix='trueview-startup-')
+    port = _free_port()
+    env = dict(os.environ, WARMUP=warmup, AIORNOT_BASE_URL=fakes.url, AIORNOT_API_KEY='bench',
+               GEMINI_API_ENDPOINT=fakes.url, GEMINI_API_KEY='bench', EXPLANATION_CACHE_PATH='',
+               BLOB_STORE_DIR=os.path.join(workdir, 'blobs'), ANALYSIS_STORE_PATH=os.path.join(workdir, 'analyses.db'))
+    env.pop('BROKER_URL', None)
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'save_file:app', '--port', str(port), '--log-level', 'warning'],
+                              cwd=backend, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}') as client:
+            while True:
+                try:
+                    if client.get('/queues', timeout=1).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    if server.poll() is not None:
+                        raise RuntimeError('API process exited during start-up')
+                    time.sleep(0.01)
+            ready = time.perf_counter() - start
+            with open(image, 'rb') as f:
+                data = f.read()
+            upload_start = time.perf_counter()
+            client.post('/upload', files={'file': ('bench.png', data, 'image/png')}, timeout=60).raise_for_status()
+            return ready, time.perf_counter() - upload_start
+    finally:
+        server.terminate()
+        server.wait()
+        fakes.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_startup(startup):
+    print(f"\nstart-up{'':<42}{'median':>10}{'min':>10}")
+    for name, timing in startup.items():
+        print(f"{name:<50}{timing['seconds'] * 1000:>8.0f}ms{timing['seconds_min'] * 1000:>8.0f}ms")
+
+
+def measure_similarity(sizes=(10_000, 100_000, 1_000_000), queries=200, seed=0):
+    """
+    SimilarityIndex query latency and recall@10 (against an exact scan) on synthetic,
+    clustered image signatures, at each index size.
+
+    Returns:
+        dict: name -> {'seconds' (median query), 'seconds_p99', 'recall', 'load_seconds'}
+    """
+    from metric_registry import IMAGE_METRICS
+    from similarity_index import SimilarityIndex, feature_vector
+
+    rng = np.random.default_rng(seed)
+    names = list(IMAGE_METRICS)
+    scale = np.array([IMAGE_METRICS[name]['high_threshold'] for name in names])
+    # Metric values around 500 campaign-like centres
+    centres = rng.uniform(0.1, 2.0, (500, len(names))) * scale
+    results = {}
+    for size in sizes:
+        values = centres[rng.integers(0, len(centres), size)] * rng.lognormal(0, 0.2, (size, len(names)))
+        index = SimilarityIndex()
+        start = time.perf_counter()
+        for offset in range(0, size, 50_000):
+            index.add_many((f'{i}', 'image', dict(zip(names, values[i])), 'ai', 0.0)
+                           for i in range(offset, min(offset + 50_000, size)))
+        load_seconds = time.perf_counter() - start
+
+        matrix = np.stack([feature_vector('image', dict(zip(names, row))) for row in values])
+        picks = rng.integers(0, size, queries)
+        timings, found = [], 0
+        for i in picks:
+            query = matrix[i] + rng.normal(0, 0.02, len(names)).astype(np.float32)
+            start = time.perf_counter()
+            neighbors = index.search('image', query, 10)
+            timings.append(time.perf_counter() - start)
+            exact = np.argpartition(((matrix - query) ** 2).sum(axis=1), 10)[:10]
+            found += len({int(n['id']) for n in neighbors} & set(exact.tolist()))
+        results[f'similarity {size:,} entries'] = {
+            'seconds': statistics.median(timings),
+            'seconds_p99': float(np.percentile(timings, 99)),
+            'recall': found / (10 * queries),
+            'load_seconds': load_seconds,
+        }
+    return results
+
+
+def print_similarity(similarity):
+    print(f"\n{'similarity search':<32}{'median':>10}{'p99':>10}{'recall@10':>11}{'load':>9}")
+    for name, timing in similarity.items():
+        print(f"{name:<32}{timing['seconds'] * 1000:>8.2f}ms{timing['seconds_p99'] * 1000:>8.2f}ms"
+              f"{timing['recall']:>11.3f}{timing['load_seconds']:>8.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MediaAnalyzer benchmark suite")
+    parser.add_argument("--sizes", default="480p,1080p,4k", help="Synthetic resolutions (480p, 1080p, 4k)")
+    parser.add_argument("--durations", help="Synthetic video durations in seconds, e.g. 2,10")
+    parser.add_argument("--quick", action="store_true", help="One short video per size and a single repetition")
+    parser.add_argument("--no-corpus", action="store_true", help="Skip the files in media/")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is reported")
+    parser.add_argument("--metrics", help="Comma-separated metric selection passed to MediaAnalyzer")
+    parser.add_argument("--filter", help="Only run cases whose name contains this")
+    parser.add_argument("--startup", action="store_true", help="Measure process start-up instead of analysis")
+    parser.add_argument("--similarity", action="store_true", help="Measure similarity search instead of analysis")
+    parser.add_argument("--save", help="Write results as JSON (e.g. a new baseline)")
+    parser.add_argument("--compare", help="Baseline JSON to gate against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    parser.add_argument("--rss-threshold", type=float, default=0.25, help="Allowed relative peak RSS growth")
+    args = parser.parse_args()
+
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in RESOLUTIONS]
+    if unknown:
+        parser.error(f"Unknown size(s): {', '.join(unknown)}")
+    if args.durations:
+        durations = [float(d) for d in args.durations.split(",")]
+    else:
+        durations = QUICK_DURATIONS if args.quick else DURATIONS
+    repeat = 1 if args.quick else args.repeat
+    metrics = [m.strip() for m in args.metrics.split(",")] if args.metrics else None
+
+    results, startup, similarity = {}, None, None
+    if args.startup:
+        startup = measure_startup(repeat if args.quick else max(args.repeat, 5))
+        print_startup(startup)
+    elif args.similarity:
+        similarity = measure_similarity((10_000, 100_000) if args.quick else (10_000, 100_000, 1_000_000))
+        print_similarity(similarity)
+    else:
+        cases = build_cases(sizes, durations, corpus=not args.no_corpus)
+        if args.filter:
+            cases = [c for c in cases if args.filter in c['name']]
+        results = run_suite(cases, repeat, metrics)
+        print_curves(results)
+
+    report = {
+        'created_at': time.time(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    if startup is not None:
+        report['startup'] = startup
+    if similarity is not None:
+        report['similarity'] = similarity
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {len(results) + len(startup or {}) + len(similarity or {})} results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.rss_threshold)
+        for name, timing in (startup or {}).items():
+            before = baseline.get('startup', {}).get(name)
+            if before and timing['seconds'] > before['seconds'] * (1 + args.threshold):
+                regressions.append(f"start-up {name}: {before['seconds'] * 1000:.0f} ms -> {timing['seconds'] * 1000:.0f} ms")
+        for name, timing in (similarity or {}).items():
+            before = baseline.get('similarity', {}).get(name)
+            if before and timing['seconds'] > before['seconds'] * (1 + args.threshold):
+                regressions.append(f"{name}: {before['seconds'] * 1000:.2f} ms -> {timing['seconds'] * 1000:.2f} ms")
+            if before and timing['recall'] < before['recall'] - 0.02:
+                regressions.append(f"{name}: recall@10 {before['recall']:.3f} -> {timing['recall']:.3f}")
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond the threshold:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%} time / {args.rss_threshold:.0%} RSS")
+
+
+if __name__ == "__main__":
+    main()
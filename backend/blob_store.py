@@ -0,0 +1,223 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class BlobStore:
+    """
+    Content-addressed storage for uploaded media. Each blob lives at
+    <root>/<h[:2]>/<h[2:4]>/<sha256><ext>, so identical uploads share one file
+    and client filenames never collide. Writes land in a temp file and are
+    renamed into place atomically. A SQLite index tracks size, reference count
+    and last access; unreferenced blobs past max_age_seconds are removed, and
+    past quota_bytes unreferenced blobs are evicted least-recently-used. Blobs
+    still referenced by an analysis or a queued job are never evicted, so the
+    store can stay over quota until references are released. A put can take its
+    reference in the same transaction that indexes the blob, so a concurrent
+    eviction never sees it unreferenced.
+    """
+
+    def __init__(self, root: str = '../blobs', quota_bytes: int = None, max_age_seconds: float = None):
+        """
+        Args:
+            root (str): Directory holding the shards, temp files and the index
+            quota_bytes (int, optional): Total size to keep blobs under
+            max_age_seconds (float, optional): Unreferenced blobs not accessed for this long are removed
+        """
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self.tmp_dir = os.path.join(root, 'tmp')
+        # Bytes still over quota after the last eviction, all held by referenced blobs
+        self.over_quota_bytes = 0
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_eviction ON blobs (refcount, last_access)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> 'BlobStore':
+        """Build a store from BLOB_STORE_DIR, BLOB_STORE_QUOTA_BYTES and BLOB_STORE_MAX_AGE."""
+        quota = os.getenv('BLOB_STORE_QUOTA_BYTES')
+        max_age = os.getenv('BLOB_STORE_MAX_AGE')
+        return cls(
+            os.getenv('BLOB_STORE_DIR', '../blobs'),
+            quota_bytes=int(quota) if quota else None,
+            max_age_seconds=float(max_age) if max_age else None
+        )
+
+    def path(self, digest: str, ext: str = '') -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + ext)
+
+    def put_bytes(self, data, ext: str = '', digest: str = None, ref: bool = False) -> str:
+        """
+        Store an in-memory upload.
+
+        Args:
+            data (bytes-like): File contents
+            ext (str): Extension to keep on disk (e.g. '.png'), so decoders can sniff by name
+            digest (str, optional): SHA-256 hex digest if the caller already computed it
+            ref (bool): Take a reference (released with decref) before eviction can see the blob
+
+        Returns:
+            str: The content hash
+        """
+        digest = digest or hashlib.sha256(data).hexdigest()
+        if self._touch(digest, ref):
+            return digest
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        self._commit(tmp_path, digest, ext, len(data), ref)
+        return digest
+
+    def put_file(self, source, ext: str = '', chunk_size: int = 1024 * 1024, ref: bool = False) -> str:
+        """
+        Stream a file object into the store, hashing it on the way (ref as for put_bytes).
+
+        Returns:
+            str: The content hash
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+
+        digest = digest.hexdigest()
+        if self._touch(digest, ref):
+            os.remove(tmp_path)
+            return digest
+        self._commit(tmp_path, digest, ext, size, ref)
+        return digest
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Index entry plus on-disk path for a blob, marking it as recently used; None if absent."""
+        with self._lock:
+            row = self._conn.execute("SELECT ext, size, refcount FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), digest))
+            self._conn.commit()
+        return {'hash': digest, 'ext': row[0], 'size': row[1], 'refcount': row[2], 'path': self.path(digest, row[0])}
+
+    def incref(self, digest: str):
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (digest,))
+            self._conn.commit()
+
+    def decref(self, *digests: str):
+        """Drop one reference to each blob; they stay until eviction needs their space."""
+        with self._lock:
+            self._conn.executemany("UPDATE blobs SET refcount = MAX(refcount - 1, 0) WHERE hash = ?",
+                                   [(digest,) for digest in digests])
+            self._conn.commit()
+
+    def evict(self, keep: str = None) -> int:
+        """
+        Apply the age limit to unreferenced blobs, then evict least-recently-used
+        unreferenced blobs until the store is within quota. Referenced blobs are
+        kept; if they alone exceed the quota, the shortfall is logged and reported
+        as over_quota_bytes in stats().
+
+        Args:
+            keep (str, optional): Hash that must survive (the blob just written)
+
+        Returns:
+            int: Number of blobs removed
+        """
+        removed = []
+        with self._lock:
+            if self.max_age_seconds:
+                removed += self._conn.execute(
+                    "SELECT hash, ext, size FROM blobs WHERE refcount = 0 AND last_access < ? AND hash != ?",
+                    (time.time() - self.max_age_seconds, keep or '')
+                ).fetchall()
+            if self.quota_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+                total -= sum(size for _, _, size in removed)
+                gone = {digest for digest, _, _ in removed}
+                candidates = self._conn.execute(
+                    "SELECT hash, ext, size FROM blobs WHERE refcount = 0 AND hash != ? ORDER BY last_access",
+                    (keep or '',)
+                ).fetchall()
+                for digest, ext, size in candidates:
+                    if total <= self.quota_bytes:
+                        break
+                    if digest in gone:
+                        continue
+                    removed.append((digest, ext, size))
+                    total -= size
+                over_quota = max(total - self.quota_bytes, 0)
+                if over_quota and not self.over_quota_bytes:
+                    print(f"Blob store is {over_quota} bytes over quota; the rest is referenced and cannot be evicted")
+                self.over_quota_bytes = over_quota
+            self._conn.executemany("DELETE FROM blobs WHERE hash = ?", [(digest,) for digest, _, _ in removed])
+            self._conn.commit()
+            # Still under the lock, so a put of the same bytes can't land its file in between
+            for digest, ext, _ in removed:
+                try:
+                    os.remove(self.path(digest, ext))
+                except FileNotFoundError:
+                    pass
+        return len(removed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total, referenced = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount > 0), 0) FROM blobs"
+            ).fetchone()
+        return {'blobs': count, 'bytes': total, 'referenced': referenced, 'quota_bytes': self.quota_bytes,
+                'over_quota_bytes': self.over_quota_bytes}
+
+    def _touch(self, digest: str, ref: bool = False) -> bool:
+        """Mark an existing blob as used (and referenced); False if it isn't stored (or its file went missing)."""
+        with self._lock:
+            row = self._conn.execute("SELECT ext FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                return False
+            if not os.path.exists(self.path(digest, row[0])):
+                self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+                self._conn.commit()
+                return False
+            self._conn.execute("UPDATE blobs SET last_access = ?, refcount = refcount + ? WHERE hash = ?",
+                               (time.time(), int(ref), digest))
+            self._conn.commit()
+            return True
+
+    def _commit(self, tmp_path: str, digest: str, ext: str, size: int, ref: bool = False):
+        final_path = self.path(digest, ext)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        now = time.time()
+        with self._lock:
+            os.replace(tmp_path, final_path)
+            # Another put of the same bytes may have indexed it first; its reference is kept
+            self._conn.execute(
+                "INSERT INTO blobs (hash, ext, size, refcount, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + excluded.refcount, last_access = excluded.last_access",
+                (digest, ext, size, int(ref), now, now)
+            )
+            self._conn.commit()
+        if self.quota_bytes or self.max_age_seconds:
+            self.evict(keep=digest)
@@ -0,0 +1,332 @@
+"""
+Job broker shared by the API and worker processes. The API enqueues analysis
+jobs and waits for their results; any number of workers, on this host or others,
+claim and run them. SQLiteBroker needs nothing beyond a shared file; RedisBroker
+works against any Redis-compatible server.
+"""
+
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Tuple
+
+from serialization import dumps_str
+
+
+class Broker(ABC):
+    """
+    Interface and shared polling helpers; see SQLiteBroker and RedisBroker. A
+    claimed job is leased for lease_seconds; workers renew the lease while the
+    job runs, so only the jobs of workers that stopped are handed out again.
+    """
+
+    lease_seconds: float
+
+    @abstractmethod
+    def enqueue(self, queue: str, payload: Dict[str, Any]) -> str:
+        ...
+
+    @abstractmethod
+    def claim(self, queue: str, worker_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Take the oldest queued job, or return None straight away if there is none."""
+
+    @abstractmethod
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        """Restart a running job's lease; False once the job is no longer this worker's."""
+
+    @abstractmethod
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def fail(self, job_id: str, error: str, status_code: int = 500):
+        ...
+
+    @abstractmethod
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """{'id', 'queue', 'state', 'result', 'error', 'status_code', ...} or None for unknown jobs."""
+
+    @abstractmethod
+    def depth(self, queue: str) -> int:
+        ...
+
+    def claim_blocking(self, queue: str, worker_id: str, timeout: float = 5.0, poll_interval: float = 0.2):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.claim(queue, worker_id)
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    async def wait(self, job_id: str, timeout: float, poll_interval: float = 0.05, max_interval: float = 1.0):
+        """
+        Poll until a job is done or failed, backing off between polls.
+
+        Returns:
+            dict or None: The final status, or None if the timeout passed first
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            status = await asyncio.to_thread(self.status, job_id)
+            if status is not None and status['state'] in ('done', 'failed'):
+                return status
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, max_interval)
+
+
+class SQLiteBroker(Broker):
+    """
+    Job queue in a SQLite file (WAL mode) that every process on the host opens.
+    Claims take the write lock, so a job goes to exactly one worker. Jobs whose
+    worker stops renewing the lease for lease_seconds are handed out again, up to
+    max_attempts times.
+    """
+
+    def __init__(self, path: str = 'broker.db', lease_seconds: float = 600, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                queue TEXT NOT NULL,
+                state TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                status_code INTEGER,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                claimed_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (queue, state, created_at)")
+
+    def enqueue(self, queue: str, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, queue, state, payload, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, queue, dumps_str(payload), time.time())
+            )
+        return job_id
+
+    def claim(self, queue: str, worker_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            return self._claim(queue, worker_id, now)
+
+    def _claim(self, queue: str, worker_id: str, now: float):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs of workers that died mid-run go back on the queue (or fail for good)
+            self._conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "error = CASE WHEN attempts >= ? THEN 'Worker lease expired' ELSE error END, "
+                "status_code = CASE WHEN attempts >= ? THEN 500 ELSE status_code END "
+                "WHERE queue = ? AND state = 'running' AND claimed_at < ?",
+                (self.max_attempts, self.max_attempts, self.max_attempts, queue, now - self.lease_seconds)
+            )
+            row = self._conn.execute(
+                "SELECT id, payload FROM jobs WHERE queue = ? AND state = 'queued' ORDER BY created_at LIMIT 1",
+                (queue,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker_id, now, row[0])
+                )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return (row[0], json.loads(row[1])) if row else None
+
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET claimed_at = ? WHERE id = ? AND state = 'running' AND worker = ?",
+                (time.time(), job_id, worker_id)
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, finished_at = ? WHERE id = ?",
+                (dumps_str(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str, status_code: int = 500):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, status_code = ?, finished_at = ? WHERE id = ?",
+                (error, status_code, time.time(), job_id)
+            )
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT queue, state, result, error, status_code, worker, attempts, created_at, claimed_at, finished_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': job_id, 'queue': row[0], 'state': row[1], 'result': json.loads(row[2]) if row[2] else None,
+            'error': row[3], 'status_code': row[4], 'worker': row[5], 'attempts': row[6],
+            'created_at': row[7], 'claimed_at': row[8], 'finished_at': row[9],
+        }
+
+    def depth(self, queue: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE queue = ? AND state = 'queued'", (queue,)
+            ).fetchone()[0]
+
+
+class RedisBroker(Broker):
+    """
+    Job queue on a Redis-compatible server: one list per queue plus a hash per job.
+    Claims move the job id atomically onto a per-queue processing list and record
+    the claim (or last renewal) time in a per-queue lease set. As with
+    SQLiteBroker, jobs whose lease is not renewed for lease_seconds are handed
+    out again, up to max_attempts times. Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str, result_ttl_seconds: int = 24 * 3600, prefix: str = 'trueview',
+                 lease_seconds: float = 600, max_attempts: int = 3):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("RedisBroker needs the redis package: pip install redis") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.result_ttl_seconds = result_ttl_seconds
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _queue_key(self, queue: str) -> str:
+        return f"{self.prefix}:queue:{queue}"
+
+    def enqueue(self, queue: str, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        pipe = self.client.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={
+            'queue': queue, 'state': 'queued', 'payload': dumps_str(payload),
+            'attempts': 0, 'created_at': time.time(),
+        })
+        pipe.lpush(self._queue_key(queue), job_id)
+        pipe.execute()
+        return job_id
+
+    def claim(self, queue: str, worker_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        self._requeue_expired(queue)
+        job_id = self.client.lmove(self._queue_key(queue), self._queue_key(queue) + ':processing', 'RIGHT', 'LEFT')
+        return self._start(queue, job_id, worker_id)
+
+    def claim_blocking(self, queue: str, worker_id: str, timeout: float = 5.0, poll_interval: float = 0.2):
+        self._requeue_expired(queue)
+        job_id = self.client.blmove(self._queue_key(queue), self._queue_key(queue) + ':processing', timeout, 'RIGHT', 'LEFT')
+        return self._start(queue, job_id, worker_id)
+
+    def _start(self, queue, job_id, worker_id):
+        if job_id is None:
+            return None
+        key = self._job_key(job_id)
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={'state': 'running', 'worker': worker_id, 'claimed_at': now})
+        pipe.hincrby(key, 'attempts', 1)
+        pipe.zadd(self._queue_key(queue) + ':leases', {job_id: now})
+        pipe.hget(key, 'payload')
+        return job_id, json.loads(pipe.execute()[-1])
+
+    def _requeue_expired(self, queue: str):
+        """Put jobs of workers that died mid-run back on the queue (or fail them for good)."""
+        leases = self._queue_key(queue) + ':leases'
+        for job_id in self.client.zrangebyscore(leases, '-inf', time.time() - self.lease_seconds):
+            # Whoever removes the lease owns the job; concurrent claimers skip it
+            if not self.client.zrem(leases, job_id):
+                continue
+            key = self._job_key(job_id)
+            pipe = self.client.pipeline()
+            pipe.lrem(self._queue_key(queue) + ':processing', 1, job_id)
+            if int(self.client.hget(key, 'attempts') or 0) >= self.max_attempts:
+                pipe.hset(key, mapping={'state': 'failed', 'error': 'Worker lease expired', 'status_code': 500,
+                                        'finished_at': time.time()})
+                pipe.expire(key, self.result_ttl_seconds)
+            else:
+                # The right end is claimed next, so the job keeps its place ahead of newer ones
+                pipe.hset(key, 'state', 'queued')
+                pipe.rpush(self._queue_key(queue), job_id)
+            pipe.execute()
+
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        key = self._job_key(job_id)
+        state, worker, queue = self.client.hmget(key, 'state', 'worker', 'queue')
+        if state != 'running' or worker != worker_id:
+            return False
+        # xx: only a lease that still exists, so an expired one that was already requeued stays gone
+        return self.client.zadd(self._queue_key(queue) + ':leases', {job_id: time.time()}, xx=True, ch=True) > 0
+
+    def _finish(self, job_id: str, fields: Dict[str, Any]):
+        key = self._job_key(job_id)
+        queue = self.client.hget(key, 'queue')
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=dict(fields, finished_at=time.time()))
+        pipe.expire(key, self.result_ttl_seconds)
+        pipe.lrem(self._queue_key(queue) + ':processing', 1, job_id)
+        pipe.zrem(self._queue_key(queue) + ':leases', job_id)
+        pipe.execute()
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        self._finish(job_id, {'state': 'done', 'result': dumps_str(result)})
+
+    def fail(self, job_id: str, error: str, status_code: int = 500):
+        self._finish(job_id, {'state': 'failed', 'error': error, 'status_code': status_code})
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        fields = self.client.hgetall(self._job_key(job_id))
+        if not fields:
+            return None
+        number = lambda name: float(fields[name]) if fields.get(name) else None
+        return {
+            'id': job_id, 'queue': fields.get('queue'), 'state': fields.get('state'),
+            'result': json.loads(fields['result']) if fields.get('result') else None,
+            'error': fields.get('error'), 'status_code': int(fields['status_code']) if fields.get('status_code') else None,
+            'worker': fields.get('worker'), 'attempts': int(fields.get('attempts', 0)),
+            'created_at': number('created_at'), 'claimed_at': number('claimed_at'), 'finished_at': number('finished_at'),
+        }
+
+    def depth(self, queue: str) -> int:
+        return self.client.llen(self._queue_key(queue))
+
+
+def get_broker() -> Optional[Broker]:
+    """
+    Broker selected by BROKER_URL: redis://... (or rediss://) for RedisBroker,
+    sqlite:///path or a plain path for SQLiteBroker. None (unset) means the API
+    runs analyses in-process.
+    """
+    url = os.getenv('BROKER_URL')
+    if not url:
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url)
+    return SQLiteBroker(url[len('sqlite:///'):] if url.startswith('sqlite:///') else url)
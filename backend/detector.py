@@ -1,47 +1,85 @@
 from dotenv import load_dotenv
-import os, requests
+import io, os, threading, uuid
 
 load_dotenv()
 
 API_KEY = os.getenv("AIORNOT_API_KEY")  
-IMAGE_ENDPOINT = "https://api.aiornot.com/v2/image/sync"
-VIDEO_ENDPOINT = "https://api.aiornot.com/v2/video/sync"
-
-def scan_image(img_path):
-    with open(img_path, "rb") as image_file:
-        files = {"image": image_file}
-        resp = requests.post(
-            IMAGE_ENDPOINT,
-            headers={"Authorization": f"Bearer {API_KEY}"}, 
-            files=files
-        )
+# Point AIORNOT_BASE_URL at a stand-in (e.g. the load-test fake) to run without the real API
+AIORNOT_BASE_URL = os.getenv("AIORNOT_BASE_URL", "https://api.aiornot.com").rstrip("/")
+IMAGE_ENDPOINT = f"{AIORNOT_BASE_URL}/v2/image/sync"
+VIDEO_ENDPOINT = f"{AIORNOT_BASE_URL}/v2/video/sync"
+# Keep-alive connections shared by concurrent scans
+POOL_SIZE = int(os.getenv("DETECTOR_POOL_SIZE", 16))
 
-        if resp.status_code != 200:
-            raise Exception(f"Failed to analyze image: {resp.status_code} {resp.text}")
+_session = None
+_session_lock = threading.Lock()
 
-        data = resp.json()
-        report = data["report"]
+def session():
+    """The shared requests session (created on first use), so scans reuse TLS connections instead of a handshake each."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                shared = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+                shared.mount("https://", adapter)
+                shared.mount("http://", adapter)
+                _session = shared
+    return _session
 
-        ai_detected = report["ai_generated"]["ai"]["is_detected"]
-        ai_confidence = report["ai_generated"]["ai"]["confidence"]
-        deepfake_detected = report["deepfake"]["is_detected"]
-        deepfake_confidence = report["deepfake"]["confidence"]
+def warm_up():
+    """Open a pooled connection to the detector API before the first scan needs one."""
+    session().head(AIORNOT_BASE_URL, timeout=5)
 
-        return {
-            "ai_detected": ai_detected,
-            "ai_confidence": ai_confidence,
-            "deepfake_detected": deepfake_detected,
-            "deepfake_confidence": deepfake_confidence,
-        }
+def scan_image(image, filename="image", timeout=None):
+    """
+    Args:
+        image: Path to the image, or a bytes-like buffer already held in memory
+        filename (str): Name sent with an in-memory buffer
+        timeout (float, optional): HTTP timeout in seconds (none by default)
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return _post_image({"image": (filename, image)}, timeout)
+    with open(image, "rb") as image_file:
+        return _post_image({"image": image_file}, timeout)
+
+def _post_image(files, timeout=None):
+    resp = session().post(
+        IMAGE_ENDPOINT,
+        headers={"Authorization": f"Bearer {API_KEY}"}, 
+        files=files,
+        timeout=timeout,
+    )
+
+    if resp.status_code != 200:
+        raise Exception(f"Failed to analyze image: {resp.status_code} {resp.text}")
 
-def scan_video(video_path):
+    data = resp.json()
+    report = data["report"]
+
+    ai_detected = report["ai_generated"]["ai"]["is_detected"]
+    ai_confidence = report["ai_generated"]["ai"]["confidence"]
+    deepfake_detected = report["deepfake"]["is_detected"]
+    deepfake_confidence = report["deepfake"]["confidence"]
+
+    return {
+        "ai_detected": ai_detected,
+        "ai_confidence": ai_confidence,
+        "deepfake_detected": deepfake_detected,
+        "deepfake_confidence": deepfake_confidence,
+    }
+
+def scan_video(video_path, timeout=120):
+    # Stream the file in the request body instead of building the whole multipart payload in memory
     with open(video_path, "rb") as video_file:
-        files = {"video": video_file}
-        resp = requests.post(
+        body = MultipartFile("video", os.path.basename(video_path), video_file)
+        resp = session().post(
             VIDEO_ENDPOINT,
-            headers={"Authorization": f"Bearer {API_KEY}"},
-            files=files,
-            timeout=120,
+            headers={"Authorization": f"Bearer {API_KEY}", "Content-Type": body.content_type},
+            data=body,
+            timeout=timeout,
             params={"only": ["ai_video", "deepfake_video"]},
         )
 
@@ -61,4 +99,38 @@ def scan_video(video_path):
             "ai_confidence": ai_confidence,
             "deepfake_detected": deep_fake_detected,
             "deepfake_confidence": deep_fake_confidence,
-        }
\ No newline at end of file
+        }
+
+
+class MultipartFile:
+    """
+    A single-file multipart/form-data body read in chunks from an open file. It has
+    a length, so requests sends it with Content-Length and urllib3 streams it
+    block by block rather than holding the upload in memory.
+    """
+
+    def __init__(self, field, filename, file, content_type="application/octet-stream"):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n').encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        file.seek(0, os.SEEK_END)
+        self._length = len(head) + file.tell() + len(tail)
+        file.seek(0)
+        self._parts = [io.BytesIO(head), file, io.BytesIO(tail)]
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
@@ -0,0 +1,305 @@
+"""
+Speed-versus-accuracy evaluation of MediaAnalyzer configurations. Runs a labeled
+corpus through a grid of the knobs that make analysis cheaper (frames sampled
+per video, working resolution, face ROI, metric subsets) and compares each
+configuration with a full-quality reference: runtime, metric drift, metric
+status flips, agreement with the reference verdict, and accuracy against the
+labels. Configurations not beaten on runtime, agreement and drift at once form
+the Pareto frontier that production defaults should be picked from.
+
+    python evaluate.py                                      # media/ with the default grid
+    python evaluate.py --corpus ~/sets/faces --save eval.json
+    python evaluate.py --sample-frames 5,10 --max-dimensions full,720 --rois full \\
+        --metric-sets "all;avg_texture_variance,edge_density,color_variance"
+
+Labels come from a labels.json in a corpus directory ({"relative/path": "ai" or
+"real"}), else from a parent directory named ai/fake/generated or real/authentic,
+else from the file name (e.g. ai_cow.png, Real_Cruise.webp). Unlabeled files
+still count towards drift and agreement.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+
+from attrClassifier import MediaAnalyzer
+from metric_registry import metric_status, metric_verdict, METRICS
+from probe import probe_media, ProbeError
+
+CORPUS_DIR = '../media'
+SAMPLE_FRAMES = (5, 10, 20)
+MAX_DIMENSIONS = (None, 1280, 720, 480)
+ROIS = (None, 'face')
+
+AI_LABELS = {'ai', 'fake', 'generated', 'generation', 'gemini', 'synthetic', 'deepfake'}
+REAL_LABELS = {'real', 'authentic', 'genuine'}
+
+# Keeps relative drift finite for metrics whose reference value is ~0
+DRIFT_FLOOR = 1e-6
+
+
+def label_for(root, path, labels):
+    """'ai', 'real' or None for a corpus file."""
+    relative = os.path.relpath(path, root)
+    if relative in labels:
+        return labels[relative]
+    for directory in reversed(os.path.dirname(relative).lower().split(os.sep)):
+        if directory in AI_LABELS:
+            return 'ai'
+        if directory in REAL_LABELS:
+            return 'real'
+    tokens = set(re.split(r'[^a-z]+', os.path.splitext(os.path.basename(path))[0].lower()))
+    if tokens & AI_LABELS:
+        return 'ai'
+    if tokens & REAL_LABELS:
+        return 'real'
+    return None
+
+
+def load_corpus(directories):
+    """
+    Returns:
+        list: {'name', 'path', 'kind', 'label', 'probe'} per readable media file
+    """
+    items = []
+    for root in directories:
+        labels = {}
+        labels_path = os.path.join(root, 'labels.json')
+        if os.path.exists(labels_path):
+            with open(labels_path) as f:
+                labels = json.load(f)
+        for directory, _, filenames in sorted(os.walk(root)):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                try:
+                    probe = probe_media(path)
+                except (ProbeError, OSError):
+                    continue
+                items.append({
+                    'name': os.path.relpath(path, os.path.dirname(os.path.abspath(root))),
+                    'path': path, 'kind': probe['type'], 'label': label_for(root, path, labels), 'probe': probe,
+                })
+    return items
+
+
+def build_grid(sample_frames, max_dimensions, rois, metric_sets):
+    """Every combination of the knobs, as MediaAnalyzer keyword arguments."""
+    return [
+        {'sample_frames': frames, 'max_dimension': dimension, 'roi': roi, 'metrics': metrics}
+        for metrics in metric_sets
+        for roi in rois
+        for dimension in max_dimensions
+        for frames in sample_frames
+    ]
+
+
+def config_name(config):
+    metrics = 'all' if config['metrics'] is None else '+'.join(config['metrics'])
+    return (f"frames={config['sample_frames']} dim={config['max_dimension'] or 'full'} "
+            f"roi={config['roi'] or 'full'} metrics={metrics}")
+
+
+def effective_key(config, kind):
+    """Knobs that change the result for a media type; images ignore sample_frames."""
+    return (config['sample_frames'] if kind == 'video' else None, config['max_dimension'], config['roi'],
+            tuple(config['metrics']) if config['metrics'] is not None else None)
+
+
+def analyze(item, config, repeat):
+    """
+    Returns:
+        dict: {'seconds' (median of `repeat` runs), 'metrics'}, or {'error'}
+    """
+    times, results = [], None
+    for _ in range(repeat):
+        # No timeline, so sample_frames alone decides how many frames a video decodes
+        analyzer = MediaAnalyzer(timeline_seconds=None, **config)
+        start = time.perf_counter()
+        try:
+            if item['kind'] == 'video':
+                results = analyzer.analyze_video(item['path'], item['probe'])
+            else:
+                results = analyzer.analyze_image(item['path'], item['probe'])
+        except Exception as e:
+            return {'error': str(e)}
+        times.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(times), 'metrics': results['metrics']}
+
+
+def compare_to_reference(item, result, reference):
+    """Per-file drift, status flips and verdicts of one configuration against the reference."""
+    specs = METRICS[item['kind']]
+    drifts, flips = [], 0
+    for name, value in result['metrics'].items():
+        if name not in reference['metrics'] or name not in specs:
+            continue
+        expected = reference['metrics'][name]
+        drifts.append(abs(value - expected) / max(abs(expected), DRIFT_FLOOR))
+        if metric_status(specs[name], value) != metric_status(specs[name], expected):
+            flips += 1
+    # The reference verdict is taken over the same metrics, so a subset is judged on what it computes
+    shared = {name: reference['metrics'][name] for name in result['metrics'] if name in reference['metrics']}
+    return {
+        'drifts': drifts,
+        'flips': flips,
+        'verdict': metric_verdict(item['kind'], result['metrics']),
+        'reference_verdict': metric_verdict(item['kind'], shared),
+    }
+
+
+def evaluate(corpus, grid, reference_config, repeat=1, progress=True):
+    """
+    Returns:
+        tuple: (reference summary, list of per-configuration summaries)
+    """
+    reference, cache = {}, {}
+    for item in corpus:
+        reference[item['name']] = analyze(item, reference_config, repeat)
+        # Grid points that match the reference for this file reuse its run
+        cache[(item['name'], effective_key(reference_config, item['kind']))] = reference[item['name']]
+    reference_seconds = sum(r['seconds'] for r in reference.values() if 'error' not in r)
+
+    summaries = []
+    for config in grid:
+        seconds, drifts, flips, agreements, correct, labeled, errors = 0.0, [], 0, [], 0, 0, 0
+        files = {}
+        for item in corpus:
+            ref = reference[item['name']]
+            key = (item['name'], effective_key(config, item['kind']))
+            if key not in cache:
+                cache[key] = analyze(item, config, repeat)
+            result = cache[key]
+            if 'error' in result or 'error' in ref:
+                errors += 1
+                continue
+            comparison = compare_to_reference(item, result, ref)
+            seconds += result['seconds']
+            drifts += comparison['drifts']
+            flips += comparison['flips']
+            agreements.append(comparison['verdict'] == comparison['reference_verdict'])
+            if item['label'] is not None:
+                labeled += 1
+                correct += (comparison['verdict'] == 'ai') == (item['label'] == 'ai')
+            files[item['name']] = {'seconds': result['seconds'], 'verdict': comparison['verdict'],
+                                   'reference_verdict': comparison['reference_verdict'],
+                                   'max_drift': max(comparison['drifts'], default=0.0),
+                                   'flips': comparison['flips']}
+
+        summary = {
+            'name': config_name(config),
+            'config': config,
+            'seconds': seconds,
+            'speedup': reference_seconds / seconds if seconds else None,
+            'drift_mean': statistics.fmean(drifts) if drifts else 0.0,
+            'drift_max': max(drifts, default=0.0),
+            'status_flips': flips,
+            'verdict_agreement': sum(agreements) / len(agreements) if agreements else None,
+            'label_accuracy': correct / labeled if labeled else None,
+            'labeled': labeled,
+            'errors': errors,
+            'files': files,
+        }
+        summaries.append(summary)
+        if progress:
+            print(f"{summary['name']:<60} {seconds:8.2f}s  x{summary['speedup'] or 0:5.2f}  "
+                  f"drift {summary['drift_mean']:6.1%}  agree {_pct(summary['verdict_agreement'])}", flush=True)
+
+    mark_pareto(summaries)
+    return {'config': reference_config, 'seconds': reference_seconds,
+            'files': {name: r for name, r in reference.items()}}, summaries
+
+
+def mark_pareto(summaries):
+    """Flag configurations no other one beats on runtime, verdict agreement and mean drift at once."""
+    def objectives(s):
+        # Fewer failed files is an objective too, so a configuration can't win by skipping hard ones
+        return (s['seconds'], -(s['verdict_agreement'] or 0.0), s['drift_mean'], s['errors'])
+
+    for summary in summaries:
+        mine = objectives(summary)
+        summary['pareto'] = not any(
+            all(a <= b for a, b in zip(objectives(other), mine)) and objectives(other) != mine
+            for other in summaries if other is not summary
+        )
+
+
+def print_report(reference, summaries):
+    print(f"\nReference: {config_name(reference['config'])} ({reference['seconds']:.2f}s)")
+    print(f"{'':2}{'configuration':<60}{'seconds':>9}{'speedup':>9}{'drift':>8}{'max':>8}"
+          f"{'flips':>7}{'agree':>8}{'labels':>8}")
+    for s in sorted(summaries, key=lambda s: s['seconds']):
+        print(f"{'*' if s['pareto'] else ' ':2}{s['name']:<60}{s['seconds']:>9.2f}{s['speedup'] or 0:>8.2f}x"
+              f"{s['drift_mean']:>8.1%}{s['drift_max']:>8.1%}{s['status_flips']:>7}"
+              f"{_pct(s['verdict_agreement']):>8}{_pct(s['label_accuracy']):>8}"
+              + (f"  ({s['errors']} errors)" if s['errors'] else ""))
+    print("\n* Pareto frontier: no other configuration is faster, as faithful to the reference verdicts and as close on the metrics")
+
+
+def _pct(value):
+    return f"{value:.0%}" if value is not None else "-"
+
+
+def _list(spec, cast):
+    return [None if v.strip() in ('full', 'none') else cast(v.strip()) for v in spec.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed/accuracy evaluation of MediaAnalyzer configurations")
+    parser.add_argument("--corpus", action="append", help="Directory of media (repeatable); defaults to media/")
+    parser.add_argument("--no-default-corpus", action="store_true", help="Only use the --corpus directories")
+    parser.add_argument("--sample-frames", default=",".join(map(str, SAMPLE_FRAMES)), help="Frames sampled per video")
+    parser.add_argument("--max-dimensions", default="full,1280,720,480", help="Working resolutions ('full' = no downscale)")
+    parser.add_argument("--rois", default="full,face", help="Regions of interest ('full' or 'face')")
+    parser.add_argument("--metric-sets", default="all", help="Semicolon-separated metric selections ('all' = every metric)")
+    parser.add_argument("--reference-frames", type=int, help="Frames per video for the reference (default: the largest in the grid)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per file and configuration; the median time is used")
+    parser.add_argument("--filter", help="Only use corpus files whose name contains this")
+    parser.add_argument("--save", help="Write the full report as JSON")
+    args = parser.parse_args()
+
+    directories = [] if args.no_default_corpus else [CORPUS_DIR]
+    directories += args.corpus or []
+    corpus = load_corpus(d for d in directories if os.path.isdir(d))
+    if args.filter:
+        corpus = [item for item in corpus if args.filter in item['name']]
+    if not corpus:
+        parser.error("No readable media in the corpus")
+
+    metric_sets = []
+    for spec in args.metric_sets.split(';'):
+        names = [m.strip() for m in spec.split(',') if m.strip()]
+        metric_sets.append(None if names in ([], ['all']) else names)
+    try:
+        grid = build_grid(_list(args.sample_frames, int), _list(args.max_dimensions, int),
+                          [None if r in (None, 'full') else r for r in _list(args.rois, str)], metric_sets)
+        reference_config = {'sample_frames': args.reference_frames or max(_list(args.sample_frames, int)),
+                            'max_dimension': None, 'roi': None, 'metrics': None}
+        MediaAnalyzer(**reference_config)
+        for config in grid:
+            MediaAnalyzer(**config)
+    except ValueError as e:
+        parser.error(str(e))
+
+    labeled = sum(1 for item in corpus if item['label'])
+    print(f"{len(corpus)} files ({labeled} labeled), {len(grid)} configurations")
+    reference, summaries = evaluate(corpus, grid, reference_config, args.repeat)
+    print_report(reference, summaries)
+
+    if args.save:
+        report = {
+            'created_at': time.time(),
+            'corpus': [{k: item[k] for k in ('name', 'kind', 'label')} for item in corpus],
+            'reference': reference,
+            'configurations': summaries,
+            'pareto': [s['name'] for s in summaries if s['pareto']],
+        }
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2, default=float)
+        print(f"Saved report to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
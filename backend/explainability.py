@@ -1,20 +1,151 @@
 import os
-import google.generativeai as genai
-from typing import Dict, Any
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List
+
+from explanation_cache import ExplanationCache
+from metric_registry import METRICS, metric_status, metric_record, metric_lines
+from local_explainer import LocalExplainer
+from instrumentation import stage, inc
+from tracing import traced
+
+# 429s that still get through the limiter are retried with exponential backoff
+GEMINI_MAX_RETRIES = 3
+
+class GeminiRateLimiter:
+    """
+    Keeps async Gemini traffic inside the project's quota: a semaphore caps requests
+    in flight, and token buckets refilled per minute cap requests and tokens.
+    Waiters are served in arrival order.
+    """
+    
+    def __init__(self, max_concurrency: int = 8, rpm: int = 60, tpm: int = 1_000_000):
+        """
+        Args:
+            max_concurrency (int): Requests allowed in flight at once
+            rpm (int): Requests per minute quota
+            tpm (int): Tokens per minute quota (prompt + expected output)
+        """
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self._semaphore = None
+        self._lock = None
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+    
+    @asynccontextmanager
+    async def limit(self, tokens: int):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._lock = asyncio.Lock()
+        async with self._semaphore:
+            await self._take(min(tokens, self.tpm))
+            yield
+    
+    async def _take(self, tokens: int):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self._updated
+                self._updated = now
+                self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+                self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                
+                wait = max((1 - self._requests) * 60 / self.rpm, (tokens - self._tokens) * 60 / self.tpm)
+                await asyncio.sleep(wait)
+
+
+_shared_engine = None
+
+
+def combined_source(records: List[Dict[str, Any]], overview_source: str = None) -> str:
+    """'gemini' or 'local' when every text came from one of them, 'mixed' otherwise."""
+    sources = {record['source'] for record in records if 'source' in record}
+    if overview_source:
+        sources.add(overview_source)
+    if len(sources) == 1:
+        return sources.pop()
+    return 'mixed' if sources else 'local'
+
+
+def _parse_batch(text: str) -> Dict[str, Any]:
+    """A batched explanation response; raises ValueError unless it is a JSON object."""
+    parsed = json.loads(text)
+    if not isinstance(parsed, dict):
+        raise ValueError(f"expected a JSON object, got {type(parsed).__name__}")
+    return parsed
+
+
+def _genai():
+    """google.generativeai, imported on first use: it is the slowest import in the backend."""
+    import google.generativeai as genai
+    return genai
+
+
+def get_engine(api_key: str = None):
+    """
+    Returns the process-wide explainer, creating it on first use, so every request
+    shares one model client, one rate limiter and one explanation cache.
+    
+    EXPLAIN_MODE=local, or no Gemini key at all, selects the template-based
+    LocalExplainer instead, which needs no network access.
+    """
+    global _shared_engine
+    if _shared_engine is None:
+        mode = os.getenv('EXPLAIN_MODE', 'auto')
+        if mode == 'local' or (mode == 'auto' and not (api_key or os.getenv('GEMINI_API_KEY'))):
+            _shared_engine = LocalExplainer()
+        else:
+            _shared_engine = ExplainabilityEngine(api_key, cache=ExplanationCache.from_env())
+    return _shared_engine
+
 
 class ExplainabilityEngine:
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, limiter: GeminiRateLimiter = None, cache: ExplanationCache = None,
+                 deadline: float = None):
         """
         Initialize the ExplainabilityEngine.
         
         Args:
             api_key (str, optional): Gemini API key. If not provided, reads from GEMINI_API_KEY env variable.
+            limiter (GeminiRateLimiter, optional): Quota limiter for the async methods. Defaults to one
+                sized from GEMINI_MAX_CONCURRENCY, GEMINI_RPM and GEMINI_TPM.
+            cache (ExplanationCache, optional): Reuse explanations for near-identical metric signatures
+            deadline (float, optional): Seconds explain_all_metrics_async waits for Gemini before answering
+                with local text instead. Defaults to GEMINI_DEADLINE_SECONDS; unset means wait.
         """
         self.api_key = api_key or os.getenv('GEMINI_API_KEY')
-        genai.configure(api_key=self.api_key)
+        # GEMINI_API_ENDPOINT redirects calls to a stand-in (e.g. the load-test fake) over REST
+        self.endpoint = os.getenv('GEMINI_API_ENDPOINT')
+        genai = _genai()
+        if self.endpoint:
+            genai.configure(api_key=self.api_key, transport='rest', client_options={'api_endpoint': self.endpoint})
+        else:
+            genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel('gemini-flash-latest')
+        self.limiter = limiter or GeminiRateLimiter(
+            max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', 8)),
+            rpm=int(os.getenv('GEMINI_RPM', 60)),
+            tpm=int(os.getenv('GEMINI_TPM', 1_000_000))
+        )
+        self.cache = cache
+        self.local = LocalExplainer()
+        if deadline is None and os.getenv('GEMINI_DEADLINE_SECONDS'):
+            deadline = float(os.getenv('GEMINI_DEADLINE_SECONDS'))
+        self.deadline = deadline
+        self._background = set()
     
+    @traced()
     def explain_overall_analysis(self, results: Dict[str, Any]) -> str:
         """
         Provides a comprehensive natural language explanation of the entire analysis,
@@ -26,20 +157,41 @@ class ExplainabilityEngine:
         Returns:
             str: Natural language explanation of the overall analysis
         """
-        media_type = results['metadata']['type']
-        metrics = results['metrics']
-        metadata = results['metadata']
+        return self._overall(results)[0]
+    
+    def _overall(self, results: Dict[str, Any]):
+        """Returns (overview text, 'gemini' or 'local')."""
+        key = self._overall_cache_key(results)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached, 'gemini'
         
-        if media_type == 'video':
-            prompt = self._build_video_overall_prompt(metadata, metrics)
-        else:
-            prompt = self._build_image_overall_prompt(metadata, metrics)
+        try:
+            text = self._generate(self._overall_prompt(results))
+        except Exception as e:
+            print(f"Gemini overview failed, using local explanation: {e}")
+            return self.local.explain_overall_analysis(results), 'local'
+        self._cache_set(key, text)
+        return text, 'gemini'
+    
+    @traced()
+    async def explain_overall_analysis_async(self, results: Dict[str, Any]) -> str:
+        """Async, rate-limited variant of explain_overall_analysis."""
+        return (await self._overall_async(results))[0]
+    
+    async def _overall_async(self, results: Dict[str, Any]):
+        key = self._overall_cache_key(results)
+        cached = await self._off_loop(self._cache_get, key)
+        if cached is not None:
+            return cached, 'gemini'
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            text = await self._generate_async(self._overall_prompt(results))
         except Exception as e:
-            return f"Error generating explanation: {str(e)}"
+            print(f"Gemini overview failed, using local explanation: {e}")
+            return self.local.explain_overall_analysis(results), 'local'
+        await self._off_loop(self._cache_set, key, text)
+        return text, 'gemini'
     
     def explain_specific_metrics(self, results: Dict[str, Any]) -> str:
         """
@@ -52,20 +204,21 @@ class ExplainabilityEngine:
         Returns:
             str: Concise metric-focused explanation
         """
-        media_type = results['metadata']['type']
-        metrics = results['metrics']
-        
-        if media_type == 'video':
-            prompt = self._build_video_metrics_prompt(metrics)
-        else:
-            prompt = self._build_image_metrics_prompt(metrics)
-        
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self._generate(self._metrics_prompt(results))
+        except Exception as e:
+            print(f"Gemini metric summary failed, using local explanation: {e}")
+            return self.local.explain_specific_metrics(results)
+    
+    async def explain_specific_metrics_async(self, results: Dict[str, Any]) -> str:
+        """Async, rate-limited variant of explain_specific_metrics."""
+        try:
+            return await self._generate_async(self._metrics_prompt(results))
         except Exception as e:
-            return f"Error generating metric explanation: {str(e)}"
+            print(f"Gemini metric summary failed, using local explanation: {e}")
+            return self.local.explain_specific_metrics(results)
     
+    @traced()
     def explain_individual_metric(self, results: Dict[str, Any], metric_name: str) -> Dict[str, Any]:
         """
         Provides analysis for a single specific metric.
@@ -81,16 +234,303 @@ class ExplainabilityEngine:
                 'actual_value': float,
                 'expected_range': str,
                 'analysis': str,
-                'status': str  # 'normal', 'suspicious_low', 'suspicious_high'
+                'status': str,  # 'normal', 'suspicious_low', 'suspicious_high'
+                'source': str   # 'gemini', or 'local' when Gemini failed
             }
         """
-        media_type = results['metadata']['type']
-        metrics = results['metrics']
+        record, prompt = self._metric_request(results, metric_name)
+        if prompt is None:
+            return record
         
-        if media_type == 'video':
-            return self._analyze_video_metric(metrics, metric_name)
+        key = self._metric_cache_key(results, record)
+        record['analysis'] = self._cache_get(key)
+        if record['analysis'] is None:
+            self._complete_metric(results, key, record, prompt)
         else:
-            return self._analyze_image_metric(metrics, metric_name)
+            record['source'] = 'gemini'
+        return record
+    
+    def _complete_metric(self, results: Dict[str, Any], key: str, record: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        try:
+            record['analysis'] = self._generate(prompt)
+            record['source'] = 'gemini'
+            self._cache_set(key, record['analysis'])
+        except Exception as e:
+            print(f"Gemini analysis of {record['metric_name']} failed, using local explanation: {e}")
+            record['analysis'] = self.local.explain_individual_metric(results, record['metric_name'])['analysis']
+            record['source'] = 'local'
+        return record
+    
+    @traced()
+    async def explain_individual_metric_async(self, results: Dict[str, Any], metric_name: str) -> Dict[str, Any]:
+        """Async, rate-limited variant of explain_individual_metric."""
+        record, prompt = self._metric_request(results, metric_name)
+        if prompt is None:
+            return record
+        
+        key = self._metric_cache_key(results, record)
+        record['analysis'] = await self._off_loop(self._cache_get, key)
+        if record['analysis'] is None:
+            await self._complete_metric_async(results, key, record, prompt)
+        else:
+            record['source'] = 'gemini'
+        return record
+    
+    async def _complete_metric_async(self, results: Dict[str, Any], key: str, record: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        try:
+            record['analysis'] = await self._generate_async(prompt)
+            record['source'] = 'gemini'
+            await self._off_loop(self._cache_set, key, record['analysis'])
+        except Exception as e:
+            print(f"Gemini analysis of {record['metric_name']} failed, using local explanation: {e}")
+            record['analysis'] = self.local.explain_individual_metric(results, record['metric_name'])['analysis']
+            record['source'] = 'local'
+        return record
+    
+    @traced()
+    def explain_all_metrics(self, results: Dict[str, Any], include_overview: bool = True) -> Dict[str, Any]:
+        """
+        Explains every metric, and optionally the overall verdict, with a single
+        Gemini call that returns structured JSON. Only entries missing from or
+        malformed in the response fall back to explain_individual_metric.
+        
+        Args:
+            results (dict): Analysis results from MediaAnalyzer containing metadata, metrics, and raw_data
+            include_overview (bool): Also produce the overall explanation in the same call
+            
+        Returns:
+            dict: {
+                'overview': str | None,
+                'metrics': list,  # same records as explain_individual_metric, in metric order
+                'source': str     # 'gemini', 'local' or 'mixed', from what produced the texts
+            }
+        """
+        records, overview, overview_key = self._batch_from_cache(results, include_overview)
+        pending = [r for r in records if 'error' not in r and r['analysis'] is None]
+        need_overview = include_overview and overview is None
+        overview_source = 'gemini' if overview is not None else None
+        if not pending and not need_overview:
+            return {'overview': overview, 'metrics': records, 'source': combined_source(records, overview_source)}
+        
+        prompt, generation_config = self._batch_request(results['metadata']['type'], pending, need_overview)
+        try:
+            parsed = _parse_batch(self._generate(prompt, generation_config))
+        except Exception as e:
+            print(f"Batched explanation failed, falling back per metric: {e}")
+            parsed = {}
+        
+        for record in self._apply_batch(results, pending, parsed):
+            request, prompt = self._metric_request(results, record['metric_name'])
+            completed = self._complete_metric(results, self._metric_cache_key(results, request), request, prompt)
+            record.update(analysis=completed['analysis'], source=completed['source'])
+        
+        if need_overview:
+            overview = parsed.get('overview')
+            if isinstance(overview, str) and overview.strip():
+                overview_source = 'gemini'
+                self._cache_set(overview_key, overview)
+            else:
+                overview, overview_source = self._overall(results)
+        
+        return {'overview': overview, 'metrics': records, 'source': combined_source(records, overview_source)}
+    
+    @traced()
+    async def explain_all_metrics_async(self, results: Dict[str, Any], include_overview: bool = True,
+                                        deadline: float = None, on_upgrade=None) -> Dict[str, Any]:
+        """
+        Async, rate-limited variant of explain_all_metrics, hedged against a slow Gemini.
+        If Gemini hasn't answered within the deadline, the local explanation is returned
+        straight away and the Gemini call keeps running in the background, so its answer
+        still lands in the cache and can be handed to on_upgrade.
+        
+        Args:
+            results (dict): Analysis results from MediaAnalyzer containing metadata, metrics, and raw_data
+            include_overview (bool): Also produce the overall explanation
+            deadline (float, optional): Seconds to wait for Gemini (defaults to the engine's deadline)
+            on_upgrade (callable, optional): Called with the Gemini result once it arrives late
+            
+        Returns:
+            dict: As explain_all_metrics; local answers given while Gemini is still
+                working carry 'source': 'local' and 'upgrade_pending': True
+        """
+        deadline = self.deadline if deadline is None else deadline
+        task = asyncio.ensure_future(self._explain_all_metrics_async(results, include_overview))
+        if not deadline:
+            return await task
+        
+        done, _ = await asyncio.wait({task}, timeout=deadline)
+        if done:
+            return task.result()
+        
+        print(f"Gemini missed the {deadline}s deadline, answering with local explanations")
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        if on_upgrade is not None:
+            task.add_done_callback(lambda t: on_upgrade(t.result()) if not t.cancelled() and t.exception() is None else None)
+        explanations = self.local.explain_all_metrics(results, include_overview)
+        explanations['upgrade_pending'] = True
+        return explanations
+    
+    async def _explain_all_metrics_async(self, results: Dict[str, Any], include_overview: bool) -> Dict[str, Any]:
+        records, overview, overview_key = await self._off_loop(self._batch_from_cache, results, include_overview)
+        pending = [r for r in records if 'error' not in r and r['analysis'] is None]
+        need_overview = include_overview and overview is None
+        overview_source = 'gemini' if overview is not None else None
+        if not pending and not need_overview:
+            return {'overview': overview, 'metrics': records, 'source': combined_source(records, overview_source)}
+        
+        prompt, generation_config = self._batch_request(results['metadata']['type'], pending, need_overview)
+        try:
+            parsed = _parse_batch(await self._generate_async(prompt, generation_config))
+        except Exception as e:
+            print(f"Batched explanation failed, falling back per metric: {e}")
+            parsed = {}
+        
+        fallback = await self._off_loop(self._apply_batch, results, pending, parsed)
+        if need_overview:
+            overview = parsed.get('overview')
+            if isinstance(overview, str) and overview.strip():
+                overview_source = 'gemini'
+                await self._off_loop(self._cache_set, overview_key, overview)
+                need_overview = False
+        
+        tasks = []
+        for record in fallback:
+            request, prompt = self._metric_request(results, record['metric_name'])
+            tasks.append(self._complete_metric_async(results, self._metric_cache_key(results, request), request, prompt))
+        if need_overview:
+            tasks.append(self._overall_async(results))
+        done = await asyncio.gather(*tasks)
+        
+        if need_overview:
+            overview, overview_source = done.pop()
+        for record, completed in zip(fallback, done):
+            record.update(analysis=completed['analysis'], source=completed['source'])
+        
+        return {'overview': overview, 'metrics': records, 'source': combined_source(records, overview_source)}
+    
+    def _generate(self, prompt: str, generation_config=None) -> str:
+        with stage('gemini', nbytes=len(prompt)):
+            response = self.model.generate_content(prompt, generation_config=generation_config)
+        return response.text
+    
+    def warm_up(self):
+        """Open the connection to Gemini (channel, auth, TLS) with a metadata call, before the first request needs it."""
+        _genai().get_model(self.model.model_name)
+    
+    async def _generate_async(self, prompt: str, generation_config=None) -> str:
+        from google.api_core.exceptions import ResourceExhausted
+        
+        # Rough token estimate: ~4 characters per token plus room for the answer
+        tokens = len(prompt) // 4 + 1024
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            try:
+                async with self.limiter.limit(tokens):
+                    with stage('gemini', nbytes=len(prompt)):
+                        if self.endpoint:
+                            # The library's async client has no REST transport
+                            response = await asyncio.to_thread(self.model.generate_content, prompt,
+                                                               generation_config=generation_config)
+                        else:
+                            response = await self.model.generate_content_async(prompt, generation_config=generation_config)
+                return response.text
+            except ResourceExhausted:
+                if attempt == GEMINI_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+    
+    def _overall_prompt(self, results: Dict[str, Any]) -> str:
+        metadata = results['metadata']
+        if metadata['type'] == 'video':
+            return self._build_video_overall_prompt(metadata, results['metrics'])
+        return self._build_image_overall_prompt(metadata, results['metrics'])
+    
+    def _metrics_prompt(self, results: Dict[str, Any]) -> str:
+        if results['metadata']['type'] == 'video':
+            return self._build_video_metrics_prompt(results['metrics'])
+        return self._build_image_metrics_prompt(results['metrics'])
+    
+    def _metric_request(self, results: Dict[str, Any], metric_name: str):
+        """Returns (record without analysis, prompt), or (error record, None) for unknown metrics."""
+        if results['metadata']['type'] == 'video':
+            return self._video_metric_request(results['metrics'], metric_name)
+        return self._image_metric_request(results['metrics'], metric_name)
+    
+    def _batch_from_cache(self, results: Dict[str, Any], include_overview: bool):
+        """Build every metric record, filling analyses (and the overview) already in the cache."""
+        media_type = results['metadata']['type']
+        
+        records = []
+        for metric_name in results['metrics']:
+            record = metric_record(media_type, results['metrics'], metric_name)
+            if 'error' not in record:
+                record['analysis'] = self._cache_get(self._metric_cache_key(results, record))
+                if record['analysis'] is not None:
+                    record['source'] = 'gemini'
+            records.append(record)
+        
+        overview, overview_key = None, None
+        if include_overview:
+            overview_key = self._overall_cache_key(results)
+            overview = self._cache_get(overview_key)
+        return records, overview, overview_key
+    
+    def _batch_request(self, media_type: str, records: List[Dict[str, Any]], include_overview: bool):
+        prompt = self._build_batch_prompt(media_type, records, include_overview)
+        generation_config = _genai().GenerationConfig(
+            response_mime_type='application/json',
+            response_schema=self._batch_response_schema(include_overview)
+        )
+        return prompt, generation_config
+    
+    def _apply_batch(self, results: Dict[str, Any], records: List[Dict[str, Any]], parsed: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Fill analyses from a parsed batch response; returns the records that still need one."""
+        analyses = {}
+        entries = parsed.get('metrics') if isinstance(parsed, dict) else None
+        for entry in entries if isinstance(entries, list) else []:
+            if isinstance(entry, dict) and isinstance(entry.get('analysis'), str) and entry['analysis'].strip():
+                analyses[entry.get('metric_name')] = entry['analysis'].strip()
+        
+        missing = []
+        for record in records:
+            if record['metric_name'] in analyses:
+                record['analysis'] = analyses[record['metric_name']]
+                record['source'] = 'gemini'
+                self._cache_set(self._metric_cache_key(results, record), record['analysis'])
+            else:
+                missing.append(record)
+        return missing
+    
+    def _metric_cache_key(self, results: Dict[str, Any], record: Dict[str, Any]) -> str:
+        if self.cache is None:
+            return None
+        return self.cache.metric_key(results['metadata']['type'], record['metric_name'], record['status'], record['actual_value'])
+    
+    def _overall_cache_key(self, results: Dict[str, Any]) -> str:
+        if self.cache is None:
+            return None
+        media_type = results['metadata']['type']
+        configs = METRICS[media_type]
+        metrics = results['metrics']
+        statuses = {name: metric_status(configs[name], value) for name, value in metrics.items() if name in configs}
+        return self.cache.overall_key(media_type, metrics, statuses)
+    
+    def _cache_get(self, key: str):
+        if self.cache is None or key is None:
+            return None
+        text = self.cache.get(key)
+        inc('trueview_cache_lookups_total', cache='explanation', result='miss' if text is None else 'hit')
+        return text
+    
+    def _cache_set(self, key: str, text: str):
+        if self.cache is not None and key is not None:
+            self.cache.set(key, text)
+    
+    async def _off_loop(self, fn, *args):
+        """Run a cache-touching helper in a worker thread, so SQLite/Redis I/O never blocks the event loop."""
+        if self.cache is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
     
     def _build_video_overall_prompt(self, metadata: Dict[str, Any], metrics: Dict[str, Any]) -> str:
         prompt = f"""You are an AI deepfake detection expert explaining analysis results to a non-technical user.
@@ -104,10 +544,7 @@ class ExplainabilityEngine:
 - FPS: {metadata['fps']:.2f}
 
 **Analysis Metrics:**
-- Average Motion: {metrics['avg_motion']:.2f}
-- Motion Standard Deviation: {metrics['motion_std']:.2f}
-- Average Edge Consistency: {metrics['avg_edge_consistency']:.2f} (std: {metrics['edge_std']:.2f})
-- Average Texture Variance: {metrics['avg_texture_variance']:.2f} (std: {metrics['texture_std']:.2f})
+{metric_lines('video', metrics)}
 
 | **Metric**                    | **Description**                                                                                                       |                             **Reference Range (Authentic Video)**                            |                                             **Suspicious Range (Possible AI / Interpolated)**                                             
 | :---------------------------- | :-------------------------------------------------------------------------------------------------------------------- | :------------------------------------------------------------------------------------------: | :---------------------------------------------------------------------------------------------------------------------------------------: 
@@ -138,10 +575,7 @@ Make it into short bullet points, maximum bullet points = 5. ABSOLUTELY NO FORMA
 - Resolution: {metadata['width']}x{metadata['height']}
 
 **Analysis Metrics:**
-- Texture Variance: {metrics['avg_texture_variance']:.2f} (std: {metrics['texture_std']:.2f})
-- Edge Density: {metrics['edge_density']:.4f}
-- Color Variance: {metrics['color_variance']:.2f}
-- Edge Continuity: {metrics['edge_continuity']:.2f}
+{metric_lines('image', metrics)}
 
 | **Metric**           | **Description**                                                                               | **Typical Range (Authentic Frame)** |                    **Suspicious Range (AI/Generated)**                    
 | :------------------- | :-------------------------------------------------------------------------------------------- | :---------------------------------: | :----------------------------------------------------------------------: 
@@ -167,10 +601,7 @@ Make it into short bullet points, maximum bullet points = 5. ABSOLUTELY NO FORMA
         prompt = f"""You are an AI deepfake detection expert. Provide a SHORT, metric-focused analysis.
 
 **Video Metrics:**
-- Average Motion: {metrics['avg_motion']:.2f}
-- Motion Standard Deviation: {metrics['motion_std']:.2f}
-- Average Edge Consistency: {metrics['avg_edge_consistency']:.2f} (std: {metrics['edge_std']:.2f})
-- Average Texture Variance: {metrics['avg_texture_variance']:.2f} (std: {metrics['texture_std']:.2f})
+{metric_lines('video', metrics)}
 
 **Normal Ranges:**
 - Motion: 10-50
@@ -192,10 +623,7 @@ Be concise and technical. Focus on the numbers.ABSOLUTELY NO FORMATTING ANYWHERE
         prompt = f"""You are an AI deepfake detection expert. Provide a SHORT, metric-focused analysis.
 
 **Image Metrics:**
-- Texture Variance: {metrics['avg_texture_variance']:.2f} (std: {metrics['texture_std']:.2f})
-- Edge Density: {metrics['edge_density']:.4f}
-- Color Variance: {metrics['color_variance']:.2f}
-- Edge Continuity: {metrics['edge_continuity']:.2f}
+{metric_lines('image', metrics)}
 
 **Normal Ranges:**
 - Texture Variance: 100-10000
@@ -212,71 +640,71 @@ Be concise and technical. Focus on the numbers.ABSOLUTELY NO FORMATTING ANYWHERE
 
         return prompt
     
-    def _analyze_video_metric(self, metrics: Dict[str, Any], metric_name: str) -> Dict[str, Any]:
-        """Analyze a single video metric and return structured data."""
-        
-        # Define metric configurations
-        metric_configs = {
-            'avg_motion': {
-                'display_name': 'Average Motion',
-                'expected_range': '10-50',
-                'low_threshold': 10,
-                'high_threshold': 50,
-                'description': 'Measures overall pixel intensity change between consecutive frames'
-            },
-            'motion_std': {
-                'display_name': 'Motion Standard Deviation',
-                'expected_range': '5-20',
-                'low_threshold': 5,
-                'high_threshold': 20,
-                'description': 'Captures how varied the motion is across the video sequence'
-            },
-            'avg_edge_consistency': {
-                'display_name': 'Average Edge Consistency',
-                'expected_range': '5-30',
-                'low_threshold': 5,
-                'high_threshold': 30,
-                'description': 'Measures how stable detected edges remain between frames'
-            },
-            'edge_std': {
-                'display_name': 'Edge Standard Deviation',
-                'expected_range': '2-15',
-                'low_threshold': 2,
-                'high_threshold': 15,
-                'description': 'Measures variation in edge consistency across frames'
-            },
-            'avg_texture_variance': {
-                'display_name': 'Average Texture Variance',
-                'expected_range': '100-10000',
-                'low_threshold': 100,
-                'high_threshold': 10000,
-                'description': 'Measures frame-to-frame variation in fine detail'
+    def _build_batch_prompt(self, media_type: str, records: List[Dict[str, Any]], include_overview: bool) -> str:
+        """Build one prompt covering every metric, answered as JSON."""
+        value_format = '.2f' if media_type == 'video' else '.4f'
+        metric_lines = "\n".join(
+            f"- metric_name: {r['metric_name']} | {r['display_name']}: {r['description']}. "
+            f"Actual value: {r['actual_value']:{value_format}}. Expected range: {r['expected_range']}. "
+            f"Status: {'Within normal range' if r['status'] == 'normal' else 'Outside normal range'}"
+            for r in records
+        )
+        example = "natural hand shake" if media_type == 'video' else "natural photo grain"
+        
+        prompt = f"""You are an AI deepfake detection expert explaining analysis results to a non-technical user.
+
+**Context:** A{' video' if media_type == 'video' else 'n image'} file has been analyzed for signs of AI generation{' or manipulation' if media_type == 'video' else ''}.
+
+**Metrics:**
+{metric_lines}
+
+**Task:** For EVERY metric above, write a 2-3 sentence "analysis" explaining:
+1. What this specific value indicates about the {media_type}
+2. Whether it suggests authenticity or AI generation
+3. Use real-world examples to explain (e.g., "like {example}")
+Use the exact metric_name for each entry."""
+        
+        if include_overview:
+            prompt += f"""
+
+Also write an "overview": a comprehensive, easy-to-understand explanation of whether this {media_type} appears authentic or AI-generated, covering the overall conclusion, the main reasoning, the most significant patterns and your confidence level. Make it short bullet points, maximum bullet points = 5."""
+        
+        prompt += "\n\nBe concise, conversational and accessible to non-technical users. ABSOLUTELY NO FORMATTING inside the text values."
+        return prompt
+    
+    def _batch_response_schema(self, include_overview: bool) -> Dict[str, Any]:
+        schema = {
+            'type': 'object',
+            'properties': {
+                'metrics': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'metric_name': {'type': 'string'},
+                            'analysis': {'type': 'string'}
+                        },
+                        'required': ['metric_name', 'analysis']
+                    }
+                }
             },
-            'texture_std': {
-                'display_name': 'Texture Standard Deviation',
-                'expected_range': '50-5000',
-                'low_threshold': 50,
-                'high_threshold': 5000,
-                'description': 'Measures variation in texture across frames'
-            }
+            'required': ['metrics']
         }
+        if include_overview:
+            schema['properties']['overview'] = {'type': 'string'}
+            schema['required'].append('overview')
+        return schema
+    
+    def _video_metric_request(self, metrics: Dict[str, Any], metric_name: str):
+        """Build the structured record and the Gemini prompt for a single video metric."""
         
-        if metric_name not in metric_configs:
-            return {
-                'error': f"Unknown metric: {metric_name}",
-                'metric_name': metric_name
-            }
-        
-        config = metric_configs[metric_name]
-        actual_value = metrics.get(metric_name, 0)
+        record = metric_record('video', metrics, metric_name)
+        if 'error' in record:
+            return record, None
         
-        # Determine status
-        if actual_value < config['low_threshold']:
-            status = 'suspicious_low'
-        elif actual_value > config['high_threshold']:
-            status = 'suspicious_high'
-        else:
-            status = 'normal'
+        config = METRICS['video'][metric_name]
+        actual_value = record['actual_value']
+        status = record['status']
         
         prompt = f"""You are an AI deepfake detection expert. Analyze this single metric from a video.
 
@@ -293,80 +721,18 @@ Be concise and technical. Focus on the numbers.ABSOLUTELY NO FORMATTING ANYWHERE
 
 Be concise, conversational and accessible to non-technical users. ABSOLUTELY NO FORMATTING ANYWHERE"""
 
-        try:
-            response = self.model.generate_content(prompt)
-            analysis = response.text
-        except Exception as e:
-            analysis = f"Error generating analysis: {str(e)}"
-        
-        return {
-            'metric_name': metric_name,
-            'display_name': config['display_name'],
-            'actual_value': actual_value,
-            'expected_range': config['expected_range'],
-            'description': config['description'],
-            'analysis': analysis,
-            'status': status
-        }
+        return record, prompt
     
-    def _analyze_image_metric(self, metrics: Dict[str, Any], metric_name: str) -> Dict[str, Any]:
-        """Analyze a single image metric and return structured data."""
-        
-        # Define metric configurations
-        metric_configs = {
-            'avg_texture_variance': {
-                'display_name': 'Texture Variance',
-                'expected_range': '250-600',
-                'low_threshold': 250,
-                'high_threshold': 600,
-                'description': 'Measures local variance of fine details (fur, grass, skin)'
-            },
-            'texture_std': {
-                'display_name': 'Texture Standard Deviation',
-                'expected_range': '100-10000',
-                'low_threshold': 100,
-                'high_threshold': 10000,
-                'description': 'Measures variation in texture across the image'
-            },
-            'edge_density': {
-                'display_name': 'Edge Density',
-                'expected_range': '0.03-0.10',
-                'low_threshold': 0.03,
-                'high_threshold': 0.10,
-                'description': 'Ratio of detected edges to total pixels'
-            },
-            'color_variance': {
-                'display_name': 'Color Variance',
-                'expected_range': '3000-8000',
-                'low_threshold': 3000,
-                'high_threshold': 8000,
-                'description': 'Measures diversity in color saturation and hue distribution'
-            },
-            'edge_continuity': {
-                'display_name': 'Edge Continuity',
-                'expected_range': '20-80',
-                'low_threshold': 20,
-                'high_threshold': 80,
-                'description': 'Average contour length across all detected edges'
-            }
-        }
-        
-        if metric_name not in metric_configs:
-            return {
-                'error': f"Unknown metric: {metric_name}",
-                'metric_name': metric_name
-            }
+    def _image_metric_request(self, metrics: Dict[str, Any], metric_name: str):
+        """Build the structured record and the Gemini prompt for a single image metric."""
         
-        config = metric_configs[metric_name]
-        actual_value = metrics.get(metric_name, 0)
+        record = metric_record('image', metrics, metric_name)
+        if 'error' in record:
+            return record, None
         
-        # Determine status
-        if actual_value < config['low_threshold']:
-            status = 'suspicious_low'
-        elif actual_value > config['high_threshold']:
-            status = 'suspicious_high'
-        else:
-            status = 'normal'
+        config = METRICS['image'][metric_name]
+        actual_value = record['actual_value']
+        status = record['status']
         
         prompt = f"""You are an AI deepfake detection expert. Analyze this single metric from an image.
 
@@ -383,21 +749,7 @@ Be concise, conversational and accessible to non-technical users. ABSOLUTELY NO
 
 Be concise, conversational and accessible to non-technical users. ABSOLUTELY NO FORMATTING ANYWHERE."""
 
-        try:
-            response = self.model.generate_content(prompt)
-            analysis = response.text
-        except Exception as e:
-            analysis = f"Error generating analysis: {str(e)}"
-        
-        return {
-            'metric_name': metric_name,
-            'display_name': config['display_name'],
-            'actual_value': actual_value,
-            'expected_range': config['expected_range'],
-            'description': config['description'],
-            'analysis': analysis,
-            'status': status
-        }
+        return record, prompt
 
 
 if __name__ == "__main__":
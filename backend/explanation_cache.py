@@ -0,0 +1,180 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class ExplanationCache:
+    """
+    Persistent cache of Gemini explanations keyed on quantized metric signatures.
+    Metric values are bucketed on a log scale, so two uploads whose metrics differ
+    by less than the bucket granularity (and share the same status) reuse the same
+    explanation. Entries are evicted least-recently-used past max_entries and
+    expire after ttl_seconds. The size limit is enforced every prune_interval writes
+    rather than counted on each one, so the table can briefly exceed max_entries.
+    """
+
+    def __init__(self, path: str = ':memory:', granularity: float = 0.1,
+                 max_entries: int = 50_000, ttl_seconds: float = 30 * 24 * 3600, prune_interval: int = None):
+        """
+        Args:
+            path (str): SQLite file to persist to (':memory:' for a process-local cache)
+            granularity (float): Relative bucket width, e.g. 0.1 puts values within ~10% together
+            max_entries (int): Entries kept before least-recently-used ones are evicted
+            ttl_seconds (float): Age after which an entry is treated as a miss and removed
+            prune_interval (int, optional): Writes between size checks (default 1% of max_entries)
+        """
+        self._configure(path, granularity, ttl_seconds)
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval or max(max_entries // 100, 1)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS explanations (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS explanations_last_access ON explanations (last_access)")
+        self._conn.commit()
+
+    def _configure(self, path: str, granularity: float, ttl_seconds: float):
+        """Settings and counters shared by every backend."""
+        self.path = path
+        self.granularity = granularity
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional['ExplanationCache']:
+        """
+        Build a cache from EXPLANATION_CACHE_PATH, EXPLANATION_CACHE_GRANULARITY,
+        EXPLANATION_CACHE_MAX_ENTRIES and EXPLANATION_CACHE_TTL. Returns None when
+        EXPLANATION_CACHE_PATH is set to an empty string.
+        """
+        granularity = float(os.getenv('EXPLANATION_CACHE_GRANULARITY', 0.1))
+        ttl_seconds = float(os.getenv('EXPLANATION_CACHE_TTL', 30 * 24 * 3600))
+        url = os.getenv('EXPLANATION_CACHE_URL')
+        if url:
+            # Shared by API processes on every host
+            return RedisExplanationCache(url, granularity=granularity, ttl_seconds=ttl_seconds)
+
+        path = os.getenv('EXPLANATION_CACHE_PATH', 'explanation_cache.db')
+        if not path:
+            return None
+        return cls(
+            path,
+            granularity=granularity,
+            max_entries=int(os.getenv('EXPLANATION_CACHE_MAX_ENTRIES', 50_000)),
+            ttl_seconds=ttl_seconds
+        )
+
+    def bucket(self, value: float) -> str:
+        """Quantize a metric value onto a log-scale grid of the configured granularity."""
+        value = float(value)
+        if value == 0 or not math.isfinite(value):
+            return str(value)
+        sign = '-' if value < 0 else ''
+        return f"{sign}{round(math.log(abs(value)) / math.log1p(self.granularity))}"
+
+    def metric_key(self, media_type: str, metric_name: str, status: str, value: float) -> str:
+        return f"metric:{media_type}:{metric_name}:{status}:{self.bucket(value)}"
+
+    def overall_key(self, media_type: str, metrics: Dict[str, Any], statuses: Dict[str, str] = None) -> str:
+        statuses = statuses or {}
+        parts = [f"{name}={statuses.get(name, '')}:{self.bucket(metrics[name])}" for name in sorted(metrics)]
+        return f"overall:{media_type}:" + ",".join(parts)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT text, created_at FROM explanations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM explanations WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE explanations SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, text: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO explanations (key, text, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, text, now, now)
+            )
+            self._writes += 1
+            if self._writes % self.prune_interval == 0:
+                # Read from the table rather than tracked here, since other API processes write to the same file
+                count = self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM explanations WHERE key IN "
+                        "(SELECT key FROM explanations ORDER BY last_access LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
+        return self._stats(entries)
+
+    def _stats(self, entries: int) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'granularity': self.granularity,
+        }
+
+
+class RedisExplanationCache(ExplanationCache):
+    """
+    ExplanationCache on a Redis-compatible server, for API processes spread over
+    several hosts. Same keys and bucketing; expiry uses Redis TTLs and size is
+    bounded by the server's maxmemory policy rather than max_entries. Requires the
+    optional `redis` package.
+    """
+
+    def __init__(self, url: str, granularity: float = 0.1, ttl_seconds: float = 30 * 24 * 3600,
+                 prefix: str = 'trueview:explanation:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("RedisExplanationCache needs the redis package: pip install redis") from e
+        self._configure(url, granularity, ttl_seconds)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.client.get(self.prefix + key)
+        if text is None:
+            self.misses += 1
+            return None
+        if self.ttl_seconds:
+            # Keep entries that are still being hit, like last_access in the SQLite cache
+            self.client.expire(self.prefix + key, int(self.ttl_seconds))
+        self.hits += 1
+        return text
+
+    def set(self, key: str, text: str):
+        self.client.set(self.prefix + key, text, ex=int(self.ttl_seconds) if self.ttl_seconds else None)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._stats(sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=1000)))
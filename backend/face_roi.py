@@ -0,0 +1,126 @@
+import cv2
+
+
+class FaceTracker:
+    """
+    Finds the dominant face in a sequence of frames and keeps its box between
+    samples, so the detector only runs every few frames and on a downscaled copy.
+    Uses OpenCV's bundled Haar cascade, or the YuNet DNN detector when a model
+    file is supplied.
+    """
+
+    def __init__(self, detect_every=5, detect_width=480, crop_size=256, margin=0.25, max_misses=2, model_path=None):
+        """
+        Args:
+            detect_every (int): Run the detector on every Nth frame, reuse the tracked box in between
+            detect_width (int): Width the frame is downscaled to before detection
+            crop_size (int): Side length face crops are resized to, so crops are comparable across frames
+            margin (float): Fraction of the box size added around the face (hairline, jaw, ears)
+            max_misses (int): Detection rounds a face may go missing before the track is dropped
+            model_path (str, optional): Path to a YuNet .onnx model to use instead of the cascade
+        """
+        self.detect_every = max(detect_every, 1)
+        self.detect_width = detect_width
+        self.crop_size = crop_size
+        self.margin = margin
+        self.max_misses = max_misses
+
+        if model_path:
+            self.dnn = cv2.FaceDetectorYN.create(model_path, "", (detect_width, detect_width))
+            self.cascade = None
+        else:
+            self.dnn = None
+            self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+        self.reset()
+
+    def reset(self):
+        self.box = None
+        self.frames_seen = 0
+        self.misses = 0
+        self.detections_run = 0
+        self.frames_with_face = 0
+
+    def update(self, frame):
+        """
+        Advance the tracker by one frame.
+
+        Args:
+            frame (ndarray): Full-resolution grayscale or BGR frame
+
+        Returns:
+            tuple or None: (x, y, w, h) of the tracked face in full-resolution coordinates
+        """
+        if self.box is None or self.frames_seen % self.detect_every == 0:
+            faces = self._detect(frame)
+            self.detections_run += 1
+            if faces:
+                self.box = self._match(faces)
+                self.misses = 0
+            elif self.box is not None:
+                self.misses += 1
+                if self.misses > self.max_misses:
+                    self.box = None
+
+        self.frames_seen += 1
+        if self.box is not None:
+            self.frames_with_face += 1
+        return self.box
+
+    def crop(self, image, box):
+        """
+        Cut the face region (plus margin) out of an image and resize it to crop_size.
+        """
+        height, width = image.shape[:2]
+        x, y, w, h = box
+        pad_w, pad_h = int(w * self.margin), int(h * self.margin)
+        x0, y0 = max(x - pad_w, 0), max(y - pad_h, 0)
+        x1, y1 = min(x + w + pad_w, width), min(y + h + pad_h, height)
+        return cv2.resize(image[y0:y1, x0:x1], (self.crop_size, self.crop_size), interpolation=cv2.INTER_AREA)
+
+    def stats(self):
+        return {
+            'type': 'face',
+            'frames': self.frames_seen,
+            'frames_with_face': self.frames_with_face,
+            'detections_run': self.detections_run,
+        }
+
+    def _detect(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(self.detect_width / width, 1.0)
+        small = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+
+        if self.dnn is not None:
+            if small.ndim == 2:
+                small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+            self.dnn.setInputSize((small.shape[1], small.shape[0]))
+            _, found = self.dnn.detect(small)
+            boxes = [tuple(f[:4]) for f in found] if found is not None else []
+        else:
+            if small.ndim == 3:
+                small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            boxes = self.cascade.detectMultiScale(small, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+
+        return [tuple(int(v / scale) for v in b) for b in boxes]
+
+    def _match(self, faces):
+        if self.box is None:
+            return max(faces, key=lambda b: b[2] * b[3])
+
+        best = max(faces, key=lambda b: _iou(b, self.box))
+        if _iou(best, self.box) < 0.3:
+            return max(faces, key=lambda b: b[2] * b[3])
+
+        # Smooth the box so detector jitter doesn't show up as motion inside the crop
+        return tuple(int((a + b) / 2) for a, b in zip(self.box, best))
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0
@@ -0,0 +1,150 @@
+"""
+Per-stage instrumentation for the analysis pipeline, exported in the Prometheus
+text format at GET /metrics.
+
+Wrap a stage in `with stage('probe', nbytes=size):` to record its latency
+histogram, error count and bytes processed. Other components (admission queues,
+the explanation cache) register collectors that are read at scrape time. Metrics
+are per process: with several uvicorn or worker processes, scrape each one.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+from tracing import span
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help); every metric recorded here must be declared
+METRICS = {
+    'trueview_stage_seconds': ('histogram', 'Time spent in each pipeline stage'),
+    'trueview_stage_errors_total': ('counter', 'Pipeline stage invocations that raised'),
+    'trueview_stage_bytes_total': ('counter', 'Bytes processed by each pipeline stage'),
+    'trueview_frames_decoded_total': ('counter', 'Frames decoded by MediaAnalyzer'),
+    'trueview_cache_lookups_total': ('counter', 'Cache lookups by cache and result (hit or miss)'),
+    'trueview_http_request_seconds': ('histogram', 'HTTP request latency by route, method and status'),
+}
+
+_lock = threading.Lock()
+# name -> {label tuple: value} for counters, {label tuple: [bucket counts, sum, count]} for histograms
+_series = {name: {} for name in METRICS}
+_collectors: List[Callable[[], List[Tuple[str, str, str, list]]]] = []
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        series = _series[name]
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        series = _series[name]
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+
+@contextmanager
+def stage(name: str, nbytes: int = None):
+    """Time a pipeline stage (also a span of the current trace); exceptions are counted against it and re-raised."""
+    start = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    except BaseException:
+        inc('trueview_stage_errors_total', stage=name)
+        raise
+    finally:
+        observe('trueview_stage_seconds', time.perf_counter() - start, stage=name)
+    if nbytes:
+        inc('trueview_stage_bytes_total', nbytes, stage=name)
+
+
+def timed(name: str, fn, *args, nbytes: int = None, **kwargs):
+    """Call fn(*args, **kwargs) as a stage; for work handed to asyncio.to_thread or an executor."""
+    with stage(name, nbytes=nbytes):
+        return fn(*args, **kwargs)
+
+
+def add_collector(collector: Callable[[], List[Tuple[str, str, str, list]]]):
+    """
+    Register a callable read at scrape time. It returns metric families as
+    (name, type, help, samples), where samples are (suffix, labels dict, value).
+    """
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    with _lock:
+        snapshot = {name: {k: (list(v[0]), v[1], v[2]) if isinstance(v, list) else v for k, v in series.items()}
+                    for name, series in _series.items()}
+
+    for name, series in snapshot.items():
+        kind, help_text = METRICS[name]
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in sorted(series.items()):
+            labels = dict(key)
+            if kind == 'histogram':
+                lines.extend(_histogram_lines(name, labels, LATENCY_BUCKETS, *value))
+            else:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    # Collectors may report the same family (e.g. one per queue); each is emitted once
+    families = {}
+    for collector in _collectors:
+        for name, kind, help_text, samples in collector():
+            families.setdefault(name, (kind, help_text, []))[2].extend(samples)
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def histogram_samples(labels: Dict[str, str], bounds, counts, total: float, count: int) -> list:
+    """Collector samples for a histogram kept as per-bucket (non-cumulative) counts."""
+    samples, cumulative = [], 0
+    for bound, bucket in zip(bounds, counts):
+        cumulative += bucket
+        samples.append(('_bucket', dict(labels, le=_number(bound)), cumulative))
+    samples.append(('_bucket', dict(labels, le='+Inf'), count))
+    samples.append(('_sum', labels, total))
+    samples.append(('_count', labels, count))
+    return samples
+
+
+def _histogram_lines(name, labels, bounds, counts, total, count):
+    return [f"{name}{suffix}{_labels(sample_labels)} {_number(value)}"
+            for suffix, sample_labels, value in histogram_samples(labels, bounds, counts, total, count)]
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
@@ -0,0 +1,582 @@
+"""
+End-to-end load test for the upload service. Starts local stand-ins for AIorNot
+and Gemini with configurable latency, launches the API (optionally with broker
+workers), and drives POST /upload with a weighted mix of image and video sizes at
+one or more Poisson arrival rates. Each step reports throughput, p50/p95/p99
+latency, the error and 429 rates, CPU and peak RSS per server process, and the
+latency of a cheap probe endpoint: when that climbs with load, something is
+blocking the event loop.
+
+    python loadtest.py --rates 1,2,4,8 --duration 30
+    python loadtest.py --mix image-1080p=4,video-480p-2s=1 --workers 2 --analysis-workers 2
+    python loadtest.py --url http://localhost:8000 --pid 1234      # an already running server
+
+Against --url the server must be configured by hand (AIORNOT_BASE_URL and
+GEMINI_API_ENDPOINT pointing at `python loadtest.py --fakes-only`, or real keys).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from benchmark import RESOLUTIONS, make_image, make_video
+
+DEFAULT_MIX = "image-480p=6,image-1080p=3,video-480p-2s=1"
+# Cheap route answered on the event loop; its latency under load measures loop blocking
+PROBE_PATH = "/queues"
+PROBE_INTERVAL = 0.1
+STALL_SECONDS = 0.1
+SAMPLE_INTERVAL = 0.5
+
+_METRIC_NAME = re.compile(r"metric_name: (\w+)")
+
+
+class FakeServices:
+    """
+    AIorNot and Gemini stand-ins on one local port. Each call sleeps for its
+    configured latency (+/- jitter) and fails with a 503 at fault_rate.
+    """
+
+    def __init__(self, detector_latency=0.3, video_detector_latency=2.0, gemini_latency=1.5,
+                 jitter=0.25, fault_rate=0.0, port=0):
+        self.latency = {'image': detector_latency, 'video': video_detector_latency, 'gemini': gemini_latency}
+        self.jitter = jitter
+        self.fault_rate = fault_rate
+        self.calls = {'image': 0, 'video': 0, 'gemini': 0}
+        self.faults = 0
+        self._lock = threading.Lock()
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?", 1)[0]
+                if path == "/v2/image/sync":
+                    self._answer(*services.respond('image', body))
+                elif path == "/v2/video/sync":
+                    self._answer(*services.respond('video', body))
+                elif path.endswith(":generateContent"):
+                    self._answer(*services.respond('gemini', body))
+                else:
+                    self._answer(404, {"error": "not found"})
+
+            def do_GET(self):
+                # Model metadata, as fetched by the API's warm-up
+                name = self.path.split("?", 1)[0].split("/v1beta/", 1)[-1]
+                self._answer(200, {"name": name, "version": "001", "displayName": "Load-test model",
+                                   "inputTokenLimit": 1048576, "outputTokenLimit": 8192,
+                                   "supportedGenerationMethods": ["generateContent"]})
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _answer(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def respond(self, service, body):
+        with self._lock:
+            self.calls[service] += 1
+        latency = self.latency[service] * (1 + random.uniform(-self.jitter, self.jitter))
+        time.sleep(max(latency, 0.0))
+        if random.random() < self.fault_rate:
+            with self._lock:
+                self.faults += 1
+            return 503, {"error": "injected fault"}
+        confidence = round(random.uniform(0.01, 0.99), 3)
+        if service == 'image':
+            return 200, {"report": {"ai_generated": {"ai": {"is_detected": confidence > 0.5, "confidence": confidence}},
+                                    "deepfake": {"is_detected": False, "confidence": 0.02}}}
+        if service == 'video':
+            return 200, {"report": {"ai_video": {"is_detected": confidence > 0.5, "confidence": confidence},
+                                    "deepfake_video": {"is_detected": False, "confidence": 0.02}}}
+        return 200, self._gemini_answer(body)
+
+    @staticmethod
+    def _gemini_answer(body):
+        """A generateContent response; batched prompts get one analysis per metric they list."""
+        prompt = ""
+        try:
+            request = json.loads(body)
+            prompt = " ".join(part.get("text", "") for content in request.get("contents", [])
+                              for part in content.get("parts", []))
+            structured = "responseSchema" in request.get("generationConfig", request.get("generation_config", {}))
+        except (ValueError, AttributeError):
+            structured = False
+        if structured:
+            text = json.dumps({
+                "overview": "Load-test overview.",
+                "metrics": [{"metric_name": name, "analysis": "Load-test analysis."}
+                            for name in _METRIC_NAME.findall(prompt)],
+            })
+        else:
+            text = "Load-test explanation."
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+        }
+
+
+def parse_mix(spec):
+    """
+    Parse "image-1080p=3,video-480p-2s=1" into weighted upload classes.
+
+    Returns:
+        list: {'name', 'kind', 'size', 'duration', 'weight'} per class
+    """
+    classes = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        parts = name.split("-")
+        if len(parts) < 2 or parts[0] not in ("image", "video") or parts[1] not in RESOLUTIONS:
+            raise ValueError(f"Bad mix entry {item!r}; expected image-<size>=w or video-<size>-<N>s=w")
+        duration = None
+        if parts[0] == "video":
+            duration = float(parts[2].rstrip("s")) if len(parts) > 2 else 2.0
+        classes.append({'name': name, 'kind': parts[0], 'size': parts[1], 'duration': duration,
+                        'weight': float(weight or 1)})
+    return classes
+
+
+def load_payloads(classes, cache_dir=None):
+    """Read each class's synthetic file (generated and cached by the benchmark helpers)."""
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'trueview-bench')
+    os.makedirs(cache_dir, exist_ok=True)
+    for upload in classes:
+        width, height = RESOLUTIONS[upload['size']]
+        if upload['kind'] == 'image':
+            path = make_image(cache_dir, f"image-{upload['size']}", width, height)
+        else:
+            seconds = upload['duration']
+            path = make_video(cache_dir, f"video-{upload['size']}-{seconds:g}s", width, height, seconds)
+        with open(path, "rb") as f:
+            upload['data'] = f.read()
+        upload['filename'] = os.path.basename(path)
+        upload['content_type'] = "image/png" if upload['kind'] == 'image' else "video/mp4"
+    return classes
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process tree from /proc (Linux) while the load runs."""
+
+    def __init__(self, root_pids, labels=None):
+        self.root_pids = list(root_pids)
+        self.labels = labels or {}
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def window(self, start, end):
+        """Average and peak CPU (% of one core) and peak RSS of every process between two times."""
+        report = {}
+        for pid, samples in self.samples.items():
+            inside = [s for s in samples if start <= s[0] <= end]
+            if len(inside) < 2:
+                continue
+            rates = [(b[1] - a[1]) / (b[0] - a[0]) * 100 for a, b in zip(inside, inside[1:]) if b[0] > a[0]]
+            report[str(pid)] = {
+                'role': self.labels.get(pid) or _cmdline(pid),
+                'cpu_percent_avg': (inside[-1][1] - inside[0][1]) / (inside[-1][0] - inside[0][0]) * 100,
+                'cpu_percent_max': max(rates) if rates else 0.0,
+                'rss_bytes_max': max(s[2] for s in inside),
+            }
+        return report
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for pid in self._tree():
+                usage = _proc_usage(pid, self.ticks)
+                if usage is not None:
+                    self.samples.setdefault(pid, []).append((now,) + usage)
+            self._stop.wait(SAMPLE_INTERVAL)
+
+    def _tree(self):
+        pids, frontier = [], list(self.root_pids)
+        while frontier:
+            pid = frontier.pop()
+            pids.append(pid)
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as f:
+                    children = [int(child) for child in f.read().split()]
+            except OSError:
+                continue
+            for child in children:
+                # e.g. uvicorn's worker processes are labelled after the server that forked them
+                if child not in self.labels and pid in self.labels:
+                    self.labels[child] = f"{self.labels[pid]}: child"
+                frontier.append(child)
+        return pids
+
+
+def _proc_usage(pid, ticks):
+    """(cpu seconds, rss bytes) of a process, or None once it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat (11 and 12 after the command name)
+    return (int(fields[11]) + int(fields[12])) / ticks, rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()[:60]
+    except OSError:
+        return "?"
+
+
+async def run_step(client, url, classes, rate, duration, batch_fraction, unique, timeout):
+    """
+    Open-loop Poisson arrivals at `rate` uploads/second for `duration` seconds. Requests are
+    sent on schedule whether or not earlier ones have finished, so overload shows up as
+    latency and errors rather than as a slower client.
+    """
+    weights = [c['weight'] for c in classes]
+    results = []
+    probes = []
+
+    async def upload(upload_class, batch):
+        data = upload_class['data']
+        if unique:
+            # A trailer after the image/container data gives every upload its own content hash,
+            # so analysis reuse and blob dedup don't turn the run into cache hits
+            data = data + os.urandom(16)
+        start = time.monotonic()
+        status, error = None, None
+        try:
+            response = await client.post(
+                f"{url}/upload", params={"batch": "true"} if batch else None, timeout=timeout,
+                files={"file": (upload_class['filename'], data, upload_class['content_type'])},
+            )
+            status = response.status_code
+            if status >= 400:
+                error = response.text[:200]
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append({'class': upload_class['name'], 'batch': batch, 'status': status, 'error': error,
+                        'latency': time.monotonic() - start})
+
+    async def probe_loop(stop):
+        while not stop.is_set():
+            start = time.monotonic()
+            try:
+                await client.get(f"{url}{PROBE_PATH}", timeout=timeout)
+                probes.append(time.monotonic() - start)
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe_loop(stop))
+    tasks = []
+    started = time.monotonic()
+    next_arrival = started
+    while next_arrival < started + duration:
+        await asyncio.sleep(max(0.0, next_arrival - time.monotonic()))
+        upload_class = random.choices(classes, weights)[0]
+        tasks.append(asyncio.create_task(upload(upload_class, random.random() < batch_fraction)))
+        next_arrival += random.expovariate(rate)
+    sent_for = time.monotonic() - started
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    stop.set()
+    await probe_task
+    return summarize(results, probes, rate, sent_for, elapsed)
+
+
+def summarize(results, probes, rate, sent_for, elapsed):
+    ok = [r['latency'] for r in results if r['status'] is not None and r['status'] < 400]
+    statuses = {}
+    for r in results:
+        key = str(r['status']) if r['status'] is not None else 'transport'
+        statuses[key] = statuses.get(key, 0) + 1
+    by_class = {}
+    for r in results:
+        by_class.setdefault(r['class'], []).append(r)
+    errors = [r for r in results if r['status'] is None or r['status'] >= 400]
+    return {
+        'offered_rate': rate,
+        'sent': len(results),
+        'send_seconds': sent_for,
+        'elapsed_seconds': elapsed,
+        'throughput': len(ok) / elapsed if elapsed else 0.0,
+        'latency': _latency_summary(ok),
+        'error_rate': len(errors) / len(results) if results else 0.0,
+        'rejected_rate': statuses.get('429', 0) / len(results) if results else 0.0,
+        'statuses': statuses,
+        'sample_errors': sorted({r['error'] for r in errors if r['error']})[:5],
+        'classes': {
+            name: dict(_latency_summary([r['latency'] for r in rs if r['status'] and r['status'] < 400]),
+                       sent=len(rs), errors=sum(1 for r in rs if r['status'] is None or r['status'] >= 400))
+            for name, rs in sorted(by_class.items())
+        },
+        'loop_probe': dict(_latency_summary(probes), count=len(probes),
+                           stalls=sum(1 for p in probes if p > STALL_SECONDS)),
+    }
+
+
+def _latency_summary(values):
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+        'mean': statistics.fmean(values) if values else None,
+    }
+
+
+def print_step(step):
+    lat = step['latency']
+    probe = step['loop_probe']
+    print(f"\nrate {step['offered_rate']:g}/s: {step['sent']} sent, {step['throughput']:.2f} ok/s, "
+          f"errors {step['error_rate']:.1%} (429 {step['rejected_rate']:.1%}), statuses {step['statuses']}")
+    print(f"  latency p50 {_ms(lat['p50'])}  p95 {_ms(lat['p95'])}  p99 {_ms(lat['p99'])}  max {_ms(lat['max'])}")
+    for name, summary in step['classes'].items():
+        print(f"    {name:<20} n={summary['sent']:<5} err={summary['errors']:<4} "
+              f"p50 {_ms(summary['p50'])}  p95 {_ms(summary['p95'])}  p99 {_ms(summary['p99'])}")
+    print(f"  {PROBE_PATH} probe p50 {_ms(probe['p50'])}  p99 {_ms(probe['p99'])}  max {_ms(probe['max'])}  "
+          f"stalls >{STALL_SECONDS * 1000:.0f}ms: {probe['stalls']}/{probe['count']}")
+    for pid, proc in step.get('processes', {}).items():
+        print(f"  pid {pid:<8} cpu avg {proc['cpu_percent_avg']:6.1f}%  max {proc['cpu_percent_max']:6.1f}%  "
+              f"rss {proc['rss_bytes_max'] / 2**20:7.1f} MiB  {proc['role']}")
+    for error in step['sample_errors']:
+        print(f"  error: {error}")
+
+
+def _ms(value):
+    return f"{value * 1000:8.0f}ms" if value is not None else "       -"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stack(args, fakes, workdir):
+    """Launch the API (and broker workers) against the fakes; returns (url, processes, labels)."""
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = dict(
+        os.environ,
+        AIORNOT_BASE_URL=fakes.url,
+        AIORNOT_API_KEY="loadtest",
+        GEMINI_API_ENDPOINT=fakes.url,
+        GEMINI_API_KEY="loadtest",
+        EXPLAIN_MODE="auto",
+        BLOB_STORE_DIR=os.path.join(workdir, "blobs"),
+        ANALYSIS_STORE_PATH=os.path.join(workdir, "analyses.db"),
+        EXPLANATION_CACHE_PATH=os.path.join(workdir, "explanation_cache.db") if args.explanation_cache else "",
+        PROFILE_DIR=os.path.join(workdir, "profiles"),
+        PYTHONUNBUFFERED="1",
+    )
+    if args.analysis_workers:
+        env["BROKER_URL"] = "sqlite:///" + os.path.join(workdir, "broker.db")
+    if args.no_reuse:
+        env["REUSE_ANALYSES"] = "0"
+
+    log = open(os.path.join(workdir, "server.log"), "w")
+    port = args.port or _free_port()
+    processes, labels = [], {}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "save_file:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=backend, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+    )
+    processes.append(server)
+    labels[server.pid] = f"uvicorn ({args.workers} worker{'s' if args.workers > 1 else ''})"
+    for i in range(args.analysis_workers):
+        worker = subprocess.Popen(
+            [sys.executable, "worker.py", "--concurrency", str(args.worker_concurrency)],
+            cwd=backend, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+        processes.append(worker)
+        labels[worker.pid] = f"analysis worker {i + 1}"
+    return f"http://127.0.0.1:{port}", processes, labels
+
+
+async def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{url}{PROBE_PATH}", timeout=2)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"Server at {url} did not become ready within {timeout}s")
+
+
+async def run(args, classes, url, sampler):
+    await wait_ready(url)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    steps = []
+    async with httpx.AsyncClient(limits=limits) as client:
+        if args.warmup:
+            print(f"Warming up for {args.warmup:g}s")
+            await run_step(client, url, classes, min(args.rates), args.warmup, args.batch_fraction,
+                           not args.no_unique, args.timeout)
+        for rate in args.rates:
+            print(f"Offering {rate:g} uploads/s for {args.duration:g}s", flush=True)
+            window_start = time.monotonic()
+            step = await run_step(client, url, classes, rate, args.duration, args.batch_fraction,
+                                  not args.no_unique, args.timeout)
+            if sampler is not None:
+                step['processes'] = sampler.window(window_start, time.monotonic())
+            print_step(step)
+            steps.append(step)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrueView end-to-end load test")
+    parser.add_argument("--rates", default="1,2,4", help="Comma-separated arrival rates (uploads/s), one step each")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of arrivals per step")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of load before the first measured step")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted upload classes, e.g. image-1080p=3,video-480p-2s=1")
+    parser.add_argument("--batch-fraction", type=float, default=0.0, help="Share of uploads sent with batch=true")
+    parser.add_argument("--no-unique", action="store_true", help="Send identical bytes per class (exercises analysis reuse)")
+    parser.add_argument("--no-reuse", action="store_true", help="Start the server with REUSE_ANALYSES=0")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request in seconds")
+    parser.add_argument("--url", help="Target an already running server instead of starting one")
+    parser.add_argument("--pid", type=int, action="append", default=[], help="With --url: process (tree) to sample")
+    parser.add_argument("--port", type=int, help="Port for the started server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--analysis-workers", type=int, default=0, help="Broker worker processes (0: analyze in the API)")
+    parser.add_argument("--worker-concurrency", type=int, default=2, help="Threads per broker worker")
+    parser.add_argument("--explanation-cache", action="store_true", help="Keep the explanation cache on")
+    parser.add_argument("--detector-latency", type=float, default=0.3, help="Fake AIorNot image latency (s)")
+    parser.add_argument("--video-detector-latency", type=float, default=2.0, help="Fake AIorNot video latency (s)")
+    parser.add_argument("--gemini-latency", type=float, default=1.5, help="Fake Gemini latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Relative +/- jitter on fake latencies")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="Share of fake calls answered with a 503")
+    parser.add_argument("--fakes-only", action="store_true", help="Only serve the fakes (for a server started by hand)")
+    parser.add_argument("--fakes-port", type=int, default=0, help="Port for the fakes")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary data directory and server log")
+    parser.add_argument("--save", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        args.rates = [float(r) for r in args.rates.split(",") if r.strip()]
+        classes = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    fakes = FakeServices(args.detector_latency, args.video_detector_latency, args.gemini_latency,
+                         args.jitter, args.fault_rate, args.fakes_port).start()
+    if args.fakes_only:
+        print(f"Fakes listening on {fakes.url}; start the server with "
+              f"AIORNOT_BASE_URL={fakes.url} GEMINI_API_ENDPOINT={fakes.url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return
+
+    load_payloads(classes)
+    workdir = tempfile.mkdtemp(prefix="trueview-load-")
+    processes, labels = [], {}
+    if args.url:
+        url = args.url.rstrip("/")
+        roots = args.pid
+    else:
+        url, processes, labels = start_stack(args, fakes, workdir)
+        roots = [p.pid for p in processes]
+    sampler = ProcessSampler(roots, labels).start() if roots and os.path.isdir("/proc") else None
+
+    try:
+        steps = asyncio.run(run(args, classes, url, sampler))
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        for process in processes:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+        fakes.stop()
+        if args.keep:
+            print(f"\nServer data and log kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nFake calls: {fakes.calls} ({fakes.faults} injected faults)")
+    if args.save:
+        report = {
+            'created_at': time.time(),
+            'url': url,
+            'mix': [{k: v for k, v in c.items() if k != 'data'} for c in classes],
+            'config': {k: v for k, v in vars(args).items() if k not in ('save',)},
+            'fake_calls': fakes.calls,
+            'steps': steps,
+        }
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
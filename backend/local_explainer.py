@@ -0,0 +1,153 @@
+from typing import Dict, Any, List
+
+from metric_registry import metric_record, metric_verdict
+
+# Plain-language readings of each metric per status, written in the same voice as the Gemini prompts ask for
+METRIC_TEMPLATES = {
+    'video': {
+        'avg_motion': {
+            'suspicious_low': "There is very little change from one frame to the next, like a camera locked on a tripod filming a scene where nothing moves. Footage this smooth is typical of AI-generated or interpolated video rather than a handheld recording.",
+            'suspicious_high': "Frames change far more than normal movement would explain, like a video that skips or stutters. Sudden jumps like this can come from dropped frames or synthetic motion artifacts.",
+            'normal': "The amount of change between frames looks like ordinary movement, similar to the natural hand shake and subject motion of a real camera. This points toward authentic footage.",
+        },
+        'motion_std': {
+            'suspicious_low': "The motion is almost perfectly even throughout the clip, like a conveyor belt rather than people and cameras that speed up and slow down. Uniform motion like this is a common sign of AI smoothing.",
+            'suspicious_high': "The motion swings wildly between frames, like a video with glitchy cuts. Erratic changes like this can point to synthetic or badly stitched transitions.",
+            'normal': "The motion varies the way real footage does, with a mix of slow and fast moments. This is consistent with an authentic recording.",
+        },
+        'avg_edge_consistency': {
+            'suspicious_low': "Outlines of objects barely change between frames, like a cardboard cutout sliding across the screen. Real scenes shift with lighting and perspective, so edges this stable suggest generated video.",
+            'suspicious_high': "Edges flicker and shift a lot between frames, like a badly pasted sticker that shimmers. This kind of edge distortion often comes from over-generated or poorly composited footage.",
+            'normal': "Edges shift between frames about as much as lighting and camera movement would cause in real footage. This supports authenticity.",
+        },
+        'edge_std': {
+            'suspicious_low': "The edge changes are unusually steady across the whole clip, like every frame was drawn with the same stencil. That regularity is more typical of synthetic video.",
+            'suspicious_high': "Edge stability jumps around between parts of the clip, like some frames were sharpened and others blurred. Inconsistent edges can indicate manipulated sections.",
+            'normal': "Edge behaviour varies by a normal amount across the clip. Nothing here stands out as artificial.",
+        },
+        'avg_texture_variance': {
+            'suspicious_low': "Fine detail such as skin pores, fur or grass is unusually smooth, like a plastic model instead of a real surface. Overly clean texture is a typical trait of AI diffusion models.",
+            'suspicious_high': "There is an unusual amount of fine detail noise, like heavy film grain or compression speckle. This can come from noise injection or low-quality re-encoding.",
+            'normal': "The level of fine detail looks like a real camera capturing real surfaces. This is consistent with authentic footage.",
+        },
+        'texture_std': {
+            'suspicious_low': "The amount of detail stays almost identical from frame to frame, like the same texture was painted on every frame. Real lighting and focus changes normally vary it more.",
+            'suspicious_high': "Detail changes sharply between frames, like the video keeps going in and out of focus. Large swings like this can point to frame-level manipulation.",
+            'normal': "Texture detail varies across frames the way changing light and focus would cause. This looks natural.",
+        },
+    },
+    'image': {
+        'avg_texture_variance': {
+            'suspicious_low': "Fine detail is unusually smooth, like an overly retouched skin texture or a plastic surface. This kind of smoothness is typical of AI-generated images.",
+            'suspicious_high': "The image has more fine detail noise than usual, like strong photo grain or heavy sharpening. That can point to artificial enhancement or added noise.",
+            'normal': "The fine detail looks like natural photo grain and real surfaces. This supports the image being authentic.",
+        },
+        'texture_std': {
+            'suspicious_low': "Detail is spread very evenly, like the whole picture was rendered at one quality setting. Real photos usually vary more between sharp and soft areas.",
+            'suspicious_high': "Detail varies a lot across the picture, like parts from different photos were combined. That unevenness can suggest editing or compositing.",
+            'normal': "The spread of detail across the picture looks typical of a real photo.",
+        },
+        'edge_density': {
+            'suspicious_low': "There are very few sharp outlines, like a photo taken slightly out of focus or heavily smoothed. Very soft images can hide the fingerprints of generation or editing.",
+            'suspicious_high': "There are far more sharp outlines than usual, like an image run through an aggressive sharpening filter. Oversharpened detail is common in artificially enhanced images.",
+            'normal': "The amount of sharp detail is typical for a real photograph.",
+        },
+        'color_variance': {
+            'suspicious_low': "The colors are unusually uniform, like a picture painted from a small palette. Flat color distributions often show up in generated images.",
+            'suspicious_high': "Colors are unusually intense and varied, like a photo with saturation turned all the way up. Over-saturated colors can indicate heavy processing or generation.",
+            'normal': "The range of colors looks like what a real camera captures in ordinary light.",
+        },
+        'edge_continuity': {
+            'suspicious_low': "Outlines are broken into many tiny fragments, like a shattered mosaic. Fragmented edges can come from noise, compression or generation artifacts.",
+            'suspicious_high': "Outlines run unusually long and unbroken, like shapes that melt into each other. Overly connected edges are a common sign of AI-generated imagery.",
+            'normal': "Edges break and continue the way real objects, lighting and focus produce in a photo. This looks natural.",
+        },
+    },
+}
+
+
+class LocalExplainer:
+    """
+    Deterministic, template-based explanations built from the same metric registry
+    the Gemini prompts use. Needs no API key and answers in microseconds, so it
+    serves both as a standalone explainer and as the fallback when Gemini is slow
+    or unavailable. Mirrors the ExplainabilityEngine interface.
+    """
+
+    # Nothing to cache: templates are cheaper to render than to look up
+    cache = None
+
+    def explain_overall_analysis(self, results: Dict[str, Any]) -> str:
+        """
+        Args:
+            results (dict): Analysis results from MediaAnalyzer containing metadata, metrics, and raw_data
+
+        Returns:
+            str: Up to five bullet lines with the verdict, main reasons and confidence
+        """
+        media_type = results['metadata']['type']
+        records = [metric_record(media_type, results['metrics'], name) for name in results['metrics']]
+        records = [r for r in records if 'error' not in r]
+        suspicious = [r for r in records if r['status'] != 'normal']
+
+        overall = metric_verdict(media_type, results['metrics'])
+        if overall == 'ai':
+            verdict = f"This {media_type} shows several traits typical of AI generation."
+            confidence = "Confidence is moderate to high because most measurements point the same way."
+        elif overall == 'mixed':
+            verdict = f"This {media_type} shows mixed signals: mostly natural, with a few unusual traits."
+            confidence = "Confidence is low to moderate; the unusual readings alone are not conclusive."
+        else:
+            verdict = f"This {media_type} looks likely to be authentic."
+            confidence = "Confidence is moderate because every measurement falls within the normal range."
+
+        lines = [verdict]
+        for record in suspicious[:3]:
+            direction = 'unusually low' if record['status'] == 'suspicious_low' else 'unusually high'
+            lines.append(f"{record['display_name']} is {direction} ({self._format(media_type, record['actual_value'])}, expected {record['expected_range']}).")
+        if not suspicious:
+            lines.append("Motion, edges and texture all behave like a real camera capturing a real scene." if media_type == 'video'
+                         else "Texture, edges and color all behave like a real camera capturing a real scene.")
+        lines.append(confidence)
+        return "\n".join(f"- {line}" for line in lines[:5])
+
+    def explain_specific_metrics(self, results: Dict[str, Any]) -> str:
+        media_type = results['metadata']['type']
+        lines = []
+        for name in results['metrics']:
+            record = self.explain_individual_metric(results, name)
+            if 'error' in record:
+                continue
+            state = {'normal': 'within normal range', 'suspicious_low': 'suspiciously low', 'suspicious_high': 'suspiciously high'}[record['status']]
+            lines.append(f"- {record['display_name']}: {self._format(media_type, record['actual_value'])} is {state} (expected {record['expected_range']}).")
+        return "\n".join(lines)
+
+    def explain_individual_metric(self, results: Dict[str, Any], metric_name: str) -> Dict[str, Any]:
+        media_type = results['metadata']['type']
+        record = metric_record(media_type, results['metrics'], metric_name)
+        if 'error' not in record:
+            record['analysis'] = METRIC_TEMPLATES[media_type][metric_name][record['status']]
+            record['source'] = 'local'
+        return record
+
+    def explain_all_metrics(self, results: Dict[str, Any], include_overview: bool = True) -> Dict[str, Any]:
+        return {
+            'overview': self.explain_overall_analysis(results) if include_overview else None,
+            'metrics': [self.explain_individual_metric(results, name) for name in results['metrics']],
+            'source': 'local',
+        }
+
+    async def explain_overall_analysis_async(self, results: Dict[str, Any]) -> str:
+        return self.explain_overall_analysis(results)
+
+    async def explain_specific_metrics_async(self, results: Dict[str, Any]) -> str:
+        return self.explain_specific_metrics(results)
+
+    async def explain_individual_metric_async(self, results: Dict[str, Any], metric_name: str) -> Dict[str, Any]:
+        return self.explain_individual_metric(results, metric_name)
+
+    async def explain_all_metrics_async(self, results: Dict[str, Any], include_overview: bool = True, **kwargs) -> Dict[str, Any]:
+        return self.explain_all_metrics(results, include_overview)
+
+    def _format(self, media_type: str, value: float) -> str:
+        return f"{value:.2f}" if media_type == 'video' else f"{value:.4f}".rstrip('0').rstrip('.')
@@ -1,44 +1,351 @@
-from detector import scan_image, scan_video
-from attrClassifier import MediaAnalyzer
-import sys, mimetypes
-from explainability import ExplainabilityEngine
+"""
+Command-line scanner. Walks files and directories (or a list of paths), runs the
+detector, the local analysis and the explanations for each media file, and writes
+one JSON line per file.
+
+    python main.py photo.jpg
+    python main.py archive/ --output results.jsonl --workers 8
+    python main.py --list paths.txt --output results.jsonl --resume
+    python main.py archive/ --no-detector --no-explain
+    python main.py interviews/ --roi face
+    python main.py archive/ --max-dimension 720
+    python main.py --stream rtsp://localhost:8554/cam --realtime
+    python main.py --similar 4f1c9e... -k 20
+    python main.py --similar photo.jpg --reindex
+
+Analysis runs in a pool of worker processes; the detector and explanation stages
+run concurrently with it under their own limits. With --resume, files already
+recorded as "ok" in the output (same size and modification time) are skipped, so
+an interrupted run picks up where it stopped. cv2, requests and the Gemini SDK are
+only imported by the stages that use them.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from probe import probe_media, ProbeError
+from serialization import dumps_str
+
 
 def detect_file_type(path):
-    mime_type, _ = mimetypes.guess_type(path)
-    if mime_type:
-        if mime_type.startswith("image"):
-            return "image"
-        elif mime_type.startswith("video"):
-            return "video"
-    return "unknown"
-
-def main():
-    if len(sys.argv) < 2:
-        print("No file provided")
+    try:
+        return probe_media(path)["type"]
+    except (ProbeError, OSError):
+        return "unknown"
+
+
+def run_stream(argv):
+    from stream_analyzer import StreamAnalyzer, iter_capture_frames, iter_raw_frames
+
+    parser = argparse.ArgumentParser(prog="main.py --stream", description="Sliding-window analysis of a live or growing video stream")
+    parser.add_argument("source", help="File path, RTSP/HTTP URL, camera index, or '-' for raw bgr24 frames on stdin")
+    parser.add_argument("--size", help="WIDTHxHEIGHT of raw stdin frames")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--window", type=float, default=2.0, help="Window length in seconds")
+    parser.add_argument("--hop", type=float, default=1.0, help="Seconds between emitted events")
+    parser.add_argument("--sample-fps", type=float, default=10.0)
+    parser.add_argument("--follow", action="store_true", help="Keep reading a file that is still being written")
+    parser.add_argument("--realtime", action="store_true", help="Emit events at real-time rate when replaying files")
+    parser.add_argument("--metrics", help="Comma-separated video metric selection")
+    args = parser.parse_args(argv)
+    metric_names = [m.strip() for m in args.metrics.split(",") if m.strip()] if args.metrics else None
+
+    if args.source == "-":
+        if not args.size:
+            parser.error("--size is required when reading raw frames from stdin")
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        frames = iter_raw_frames(sys.stdin.buffer, width, height, args.fps)
+    else:
+        source = int(args.source) if args.source.isdigit() else args.source
+        frames = iter_capture_frames(source, follow=args.follow)
+
+    try:
+        analyzer = StreamAnalyzer(args.window, args.hop, args.sample_fps, realtime=args.realtime, metrics=metric_names)
+    except ValueError as e:
+        parser.error(str(e))
+    for event in analyzer.process(frames, fps=args.fps):
+        print(json.dumps(event), flush=True)
+
+
+def run_similar(argv):
+    from similarity_index import SimilarityIndex, feature_vector, verdict_votes
+
+    parser = argparse.ArgumentParser(prog="main.py --similar", description="Stored analyses with the nearest metric signatures")
+    parser.add_argument("target", nargs="?", help="Analysis id, or a media file to analyse locally and look up")
+    parser.add_argument("-k", type=int, default=10, help="Neighbours to return")
+    parser.add_argument("--reindex", action="store_true", help="First index every analysis in ANALYSIS_STORE_PATH")
+    args = parser.parse_args(argv)
+
+    index = SimilarityIndex.from_env()
+    if index is None:
+        parser.error("SIMILARITY_INDEX_PATH is empty, so there is no index")
+    if args.reindex:
+        from analysis_store import AnalysisStore
+        store = AnalysisStore.from_env()
+        if store is None:
+            parser.error("ANALYSIS_STORE_PATH is empty, so there is nothing to index")
+        print(f"Indexed {index.add_many(store.iter_features())} analyses", file=sys.stderr)
+    if not args.target:
+        print(json.dumps(index.stats()))
         return
 
-    file_path = sys.argv[1]
-    file_type = detect_file_type(file_path)
+    if os.path.isfile(args.target):
+        probe = probe_media(args.target)
+        analysis = analyze_file(args.target, probe, {})
+        neighbors = index.search(probe["type"], feature_vector(probe["type"], analysis["metrics"]), args.k)
+        result = {"path": args.target, "type": probe["type"], "neighbors": neighbors}
+    else:
+        found = index.neighbors(args.target, args.k)
+        if found is None:
+            sys.exit(f"{args.target} is neither a file nor an indexed analysis id")
+        result = {"id": args.target, "type": found["type"], "neighbors": found["neighbors"]}
+    result["neighbor_verdict"] = verdict_votes(result["neighbors"])
+    print(json.dumps(result, indent=2))
+
+
+def iter_paths(paths, list_file=None):
+    """
+    Yield (path, explicit) for every file named or found under a directory;
+    explicit is False for files found by walking, whose probe errors are skipped quietly.
+    """
+    if list_file:
+        stream = sys.stdin if list_file == "-" else open(list_file)
+        with stream:
+            for line in stream:
+                if line.strip():
+                    yield line.strip(), True
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, filenames in os.walk(path):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    yield os.path.join(directory, filename), False
+        else:
+            yield path, True
+
+
+def load_checkpoint(output_path):
+    """
+    Files recorded as ok in an earlier run's output, by path -> (size, mtime). A line
+    cut off by an interruption is truncated so appended lines stay well-formed.
+    """
+    done = {}
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "ok":
+            done[record["path"]] = (record.get("size"), record.get("mtime"))
+    return done
+
+
+def _init_worker(threads):
+    # Ctrl-C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Import the analyzer once per worker and keep OpenCV's own pool from oversubscribing the CPUs
+    import cv2
+    import attrClassifier  # noqa: F401
+    cv2.setNumThreads(threads)
 
-    if file_type == "unknown":
-        return ValueError("Unsupported file type")
-    
-    ai_scan_result = None
 
-    analyzer = MediaAnalyzer()
+def analyze_file(path, probe, options):
+    """Runs in a worker process: the local analysis of one file."""
+    from attrClassifier import MediaAnalyzer
+
+    analyzer = MediaAnalyzer(metrics=options.get("metrics"), max_dimension=options.get("max_dimension"),
+                             roi=options.get("roi"), sample_frames=options.get("sample_frames", 10))
+    if probe["type"] == "video":
+        return analyzer.analyze_video(path, probe)
+    return analyzer.analyze_image(path, probe)
+
+
+def scan_file(path, probe):
+    from detector import scan_image, scan_video
+
+    return scan_video(path) if probe["type"] == "video" else scan_image(path)
+
+
+class BatchScanner:
+    """Runs files through detector, analysis and explanation stages with a concurrency limit per stage."""
+
+    def __init__(self, args, out):
+        self.args = args
+        self.out = out
+        self.options = {"metrics": args.metrics, "max_dimension": args.max_dimension, "roi": args.roi,
+                        "sample_frames": args.sample_frames}
+        self.analysis = asyncio.Semaphore(args.workers)
+        self.detector = asyncio.Semaphore(args.detector_concurrency)
+        self.explain = asyncio.Semaphore(args.explain_concurrency)
+        self.explainer = None
+        if not args.no_explain:
+            from explainability import get_engine
+            self.explainer = get_engine()
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+        self.pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker, initargs=(threads,))
+        self.counts = {"ok": 0, "error": 0, "skipped": 0, "resumed": 0}
+        self.started = time.monotonic()
+
+    async def run(self, paths, done):
+        queue = asyncio.Queue(maxsize=self.args.workers * 4)
+        consumers = [asyncio.create_task(self._consume(queue))
+                     for _ in range(self.args.workers + self.args.detector_concurrency + self.args.explain_concurrency)]
+        try:
+            for path, explicit in paths:
+                await queue.put((path, explicit, done))
+            for _ in consumers:
+                await queue.put(None)
+            await asyncio.gather(*consumers)
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def _consume(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            path, explicit, done = item
+            record = await self.process(path, explicit, done)
+            if record is not None:
+                self.out.write(dumps_str(record) + "\n")
+                self.out.flush()
+                self.report_progress()
+
+    async def process(self, path, explicit, done):
+        """The output record for one file, or None when it is skipped."""
+        try:
+            stat = os.stat(path)
+            probe = await asyncio.to_thread(probe_media, path)
+        except (ProbeError, OSError) as e:
+            if not explicit:
+                self.counts["skipped"] += 1
+                return None
+            self.counts["error"] += 1
+            return {"path": path, "status": "error", "stage": "probe", "error": str(e)}
+        if done.get(path) == (stat.st_size, stat.st_mtime):
+            self.counts["resumed"] += 1
+            return None
+
+        record = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "type": probe["type"]}
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        detector_task = None
+        if not self.args.no_detector:
+            detector_task = asyncio.create_task(self._scan(path, probe))
+            # Retrieved here too, so a scan that fails while the analysis fails isn't reported as unhandled
+            detector_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            stage = "analysis"
+            async with self.analysis:
+                analysis = await loop.run_in_executor(self.pool, analyze_file, path, probe, self.options)
+            stage = "detector"
+            record["ai_scan_result"] = await detector_task if detector_task else None
+            stage = "explain"
+            record["analysis_result"] = analysis
+            record["explanations"] = await self._explain(analysis) if self.explainer else None
+        except Exception as e:
+            if detector_task and not detector_task.done():
+                detector_task.cancel()
+            self.counts["error"] += 1
+            return dict(record, status="error", stage=stage, error=f"{type(e).__name__}: {e}",
+                        seconds=time.perf_counter() - start)
+        self.counts["ok"] += 1
+        return dict(record, status="ok", seconds=time.perf_counter() - start)
+
+    async def _scan(self, path, probe):
+        async with self.detector:
+            return await asyncio.to_thread(scan_file, path, probe)
+
+    async def _explain(self, analysis):
+        async with self.explain:
+            # deadline=0: a batch run waits for Gemini rather than answering with local text
+            explanations = await self.explainer.explain_all_metrics_async(analysis, include_overview=True, deadline=0)
+        return {"overview": explanations["overview"], "metrics": explanations["metrics"],
+                "source": explanations.get("source")}
+
+    def report_progress(self, final=False):
+        finished = self.counts["ok"] + self.counts["error"]
+        if self.args.quiet or not (final or finished % 25 == 0):
+            return
+        elapsed = time.monotonic() - self.started
+        print(f"{finished} files ({self.counts['ok']} ok, {self.counts['error']} errors, "
+              f"{self.counts['skipped']} skipped, {self.counts['resumed']} already done) "
+              f"in {elapsed:.1f}s, {finished / elapsed if elapsed else 0:.2f} files/s", file=sys.stderr)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--stream"]:
+        run_stream(argv[1:])
+        return
+    if argv[:1] == ["--similar"]:
+        run_similar(argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(description="Scan media files and write one JSON line per file")
+    parser.add_argument("paths", nargs="*", help="Files or directories (walked recursively)")
+    parser.add_argument("--list", help="File with one path per line ('-' for stdin)")
+    parser.add_argument("--output", "-o", help="JSONL output (default: stdout)")
+    parser.add_argument("--resume", action="store_true", help="Skip files already recorded as ok in --output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Analysis worker processes")
+    parser.add_argument("--detector-concurrency", type=int, default=4, help="Detector requests in flight")
+    parser.add_argument("--explain-concurrency", type=int, default=4, help="Explanation requests in flight")
+    parser.add_argument("--no-detector", action="store_true", help="Skip the AIorNot scan")
+    parser.add_argument("--no-explain", action="store_true", help="Skip the explanations")
+    parser.add_argument("--metrics", help="Comma-separated metric selection")
+    parser.add_argument("--max-dimension", type=int,
+                        default=int(os.getenv("MAX_DIMENSION")) if os.getenv("MAX_DIMENSION") else None,
+                        help="Downscale frames so their longer side is at most this (default: MAX_DIMENSION, else full size)")
+    parser.add_argument("--sample-frames", type=int, default=10, help="Frames sampled per video")
+    parser.add_argument("--roi", choices=["face"], help="Compute the metrics inside the tracked face only")
+    parser.add_argument("--quiet", "-q", action="store_true", help="No progress on stderr")
+    args = parser.parse_args(argv)
 
-    explainer = ExplainabilityEngine()
+    if not args.paths and not args.list:
+        parser.error("Give at least one file or directory, or --list")
+    if args.resume and not args.output:
+        parser.error("--resume needs --output, which doubles as the checkpoint")
+    if args.metrics:
+        from metric_registry import validate_metric_names
+        args.metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+        try:
+            validate_metric_names(args.metrics)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.max_dimension is not None and args.max_dimension < 1:
+        parser.error("--max-dimension must be a positive number of pixels")
+    for name in ("workers", "detector_concurrency", "explain_concurrency"):
+        setattr(args, name, max(getattr(args, name), 1))
 
-    if file_type == "image":
-        ai_scan_result = scan_image(file_path)
-        analysis_result =  analyzer._analyze_image(file_path)
-        briefOverview =  explainer.explain_overall_analysis(analysis_result)
-    elif file_type == "video":
-        ai_scan_result = scan_video(file_path)
-        analysis_result =  analyzer._analyze_video(file_path)
-        briefOverview = explainer.explain_overall_analysis(analysis_result)
+    done = load_checkpoint(args.output) if args.resume else {}
+    out = open(args.output, "a" if args.resume else "w") if args.output else sys.stdout
+    scanner = BatchScanner(args, out)
+    try:
+        asyncio.run(scanner.run(iter_paths(args.paths, args.list), done))
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with --resume to continue", file=sys.stderr)
+    finally:
+        scanner.report_progress(final=True)
+        if out is not sys.stdout:
+            out.close()
+    if scanner.counts["error"]:
+        sys.exit(1)
 
-    print("Result:", ai_scan_result)
-    print("Analysis:", analysis_result)
 
-main()
+if __name__ == "__main__":
+    main()
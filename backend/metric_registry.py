@@ -0,0 +1,248 @@
+"""
+Single source of truth for the metrics MediaAnalyzer produces and the explainers describe.
+
+Each metric declares the per-frame primitives it is computed from, a compute function
+over those primitives, and the thresholds and display metadata the explainers use.
+MediaAnalyzer only computes the primitives the selected metrics require, so asking
+for a subset (e.g. no edge metrics) skips the Canny and contour passes entirely.
+"""
+
+import numpy as np
+
+# Primitives MediaAnalyzer can compute; 'series' ones are per-frame lists reported in raw_data
+PRIMITIVES = {
+    'video': {
+        'motion_scores': {'series': True, 'description': 'Mean absolute difference between consecutive sampled frames'},
+        'edge_consistency': {'series': True, 'description': 'Mean absolute difference between Canny edge maps of consecutive frames'},
+        'texture_variances': {'series': True, 'description': 'Variance of the Laplacian of each frame'},
+    },
+    'image': {
+        'texture_variances': {'series': True, 'description': 'Variance of the Laplacian of the image'},
+        'edge_density': {'series': False, 'description': 'Share of Canny edge pixels in the grayscale image'},
+        'color_variance': {'series': False, 'description': 'Mean per-channel variance of the color image'},
+        'edge_continuity': {'series': False, 'description': 'Mean external contour length of the color image Canny edges'},
+    },
+}
+
+
+def _mean(primitive):
+    return lambda p: np.mean(p[primitive]) if len(p[primitive]) else 0
+
+
+def _std(primitive):
+    return lambda p: np.std(p[primitive]) if len(p[primitive]) else 0
+
+
+def _value(primitive):
+    return lambda p: p[primitive]
+
+
+# Metrics in the order they appear in analysis results
+VIDEO_METRICS = {
+    'avg_motion': {
+        'requires': ('motion_scores',),
+        'compute': _mean('motion_scores'),
+        'display_name': 'Average Motion',
+        'expected_range': '10-50',
+        'low_threshold': 10,
+        'high_threshold': 50,
+        'format': '.2f',
+        'description': 'Measures overall pixel intensity change between consecutive frames'
+    },
+    'avg_edge_consistency': {
+        'requires': ('edge_consistency',),
+        'compute': _mean('edge_consistency'),
+        'display_name': 'Average Edge Consistency',
+        'expected_range': '5-30',
+        'low_threshold': 5,
+        'high_threshold': 30,
+        'format': '.2f',
+        'description': 'Measures how stable detected edges remain between frames'
+    },
+    'avg_texture_variance': {
+        'requires': ('texture_variances',),
+        'compute': _mean('texture_variances'),
+        'display_name': 'Average Texture Variance',
+        'expected_range': '100-10000',
+        'low_threshold': 100,
+        'high_threshold': 10000,
+        'format': '.2f',
+        'description': 'Measures frame-to-frame variation in fine detail'
+    },
+    'motion_std': {
+        'requires': ('motion_scores',),
+        'compute': _std('motion_scores'),
+        'display_name': 'Motion Standard Deviation',
+        'expected_range': '5-20',
+        'low_threshold': 5,
+        'high_threshold': 20,
+        'format': '.2f',
+        'description': 'Captures how varied the motion is across the video sequence'
+    },
+    'edge_std': {
+        'requires': ('edge_consistency',),
+        'compute': _std('edge_consistency'),
+        'display_name': 'Edge Standard Deviation',
+        'expected_range': '2-15',
+        'low_threshold': 2,
+        'high_threshold': 15,
+        'format': '.2f',
+        'description': 'Measures variation in edge consistency across frames'
+    },
+    'texture_std': {
+        'requires': ('texture_variances',),
+        'compute': _std('texture_variances'),
+        'display_name': 'Texture Standard Deviation',
+        'expected_range': '50-5000',
+        'low_threshold': 50,
+        'high_threshold': 5000,
+        'format': '.2f',
+        'description': 'Measures variation in texture across frames'
+    },
+}
+
+IMAGE_METRICS = {
+    'avg_texture_variance': {
+        'requires': ('texture_variances',),
+        'compute': _mean('texture_variances'),
+        'display_name': 'Texture Variance',
+        'expected_range': '250-600',
+        'low_threshold': 250,
+        'high_threshold': 600,
+        'format': '.2f',
+        'description': 'Measures local variance of fine details (fur, grass, skin)'
+    },
+    'texture_std': {
+        'requires': ('texture_variances',),
+        'compute': _std('texture_variances'),
+        'display_name': 'Texture Standard Deviation',
+        'expected_range': '100-10000',
+        'low_threshold': 100,
+        'high_threshold': 10000,
+        'format': '.2f',
+        'description': 'Measures variation in texture across the image'
+    },
+    'edge_density': {
+        'requires': ('edge_density',),
+        'compute': _value('edge_density'),
+        'display_name': 'Edge Density',
+        'expected_range': '0.03-0.10',
+        'low_threshold': 0.03,
+        'high_threshold': 0.10,
+        'format': '.4f',
+        'description': 'Ratio of detected edges to total pixels'
+    },
+    'color_variance': {
+        'requires': ('color_variance',),
+        'compute': _value('color_variance'),
+        'display_name': 'Color Variance',
+        'expected_range': '3000-8000',
+        'low_threshold': 3000,
+        'high_threshold': 8000,
+        'format': '.2f',
+        'description': 'Measures diversity in color saturation and hue distribution'
+    },
+    'edge_continuity': {
+        'requires': ('edge_continuity',),
+        'compute': _value('edge_continuity'),
+        'display_name': 'Edge Continuity',
+        'expected_range': '20-80',
+        'low_threshold': 20,
+        'high_threshold': 80,
+        'format': '.2f',
+        'description': 'Average contour length across all detected edges'
+    },
+}
+
+METRICS = {'video': VIDEO_METRICS, 'image': IMAGE_METRICS}
+
+
+def validate_metric_names(names):
+    """Raise ValueError for names that are not a metric of any media type."""
+    unknown = [name for name in names or () if name not in VIDEO_METRICS and name not in IMAGE_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric(s): {', '.join(unknown)}")
+
+
+def metric_specs(media_type, names=None):
+    """
+    Registry entries for a media type, in result order.
+
+    Args:
+        media_type (str): 'video' or 'image'
+        names (iterable, optional): Restrict to these metrics; names belonging only to
+            the other media type are ignored, so one selection can cover both
+
+    Returns:
+        dict: metric name -> spec
+    """
+    specs = METRICS[media_type]
+    if names is None:
+        return dict(specs)
+    return {name: spec for name, spec in specs.items() if name in names}
+
+
+def required_primitives(media_type, names=None):
+    """Set of primitives the selected metrics need."""
+    return {primitive for spec in metric_specs(media_type, names).values() for primitive in spec['requires']}
+
+
+def compute_metrics(media_type, primitives, names=None):
+    """Evaluate the selected metrics from already computed primitives."""
+    return {name: spec['compute'](primitives) for name, spec in metric_specs(media_type, names).items()}
+
+
+def metric_status(spec, actual_value):
+    """Classify a metric value against its spec as 'normal', 'suspicious_low' or 'suspicious_high'."""
+    if actual_value < spec['low_threshold']:
+        return 'suspicious_low'
+    elif actual_value > spec['high_threshold']:
+        return 'suspicious_high'
+    return 'normal'
+
+
+def metric_record(media_type, metrics, metric_name):
+    """
+    The structured record both explainers fill in with an analysis.
+
+    Returns:
+        dict: Display metadata, value and status, or {'error', 'metric_name'} for unknown metrics
+    """
+    spec = METRICS[media_type].get(metric_name)
+    if spec is None:
+        return {'error': f"Unknown metric: {metric_name}", 'metric_name': metric_name}
+
+    actual_value = metrics.get(metric_name, 0)
+    return {
+        'metric_name': metric_name,
+        'display_name': spec['display_name'],
+        'actual_value': actual_value,
+        'expected_range': spec['expected_range'],
+        'description': spec['description'],
+        'analysis': None,
+        'status': metric_status(spec, actual_value)
+    }
+
+
+def metric_verdict(media_type, metrics):
+    """
+    The verdict the metrics alone support, as the local explainer states it.
+
+    Returns:
+        str: 'ai' when at least half the metrics are outside their range, 'mixed' when
+            some are, 'authentic' when none are
+    """
+    statuses = [metric_status(METRICS[media_type][name], value)
+                for name, value in metrics.items() if name in METRICS[media_type]]
+    suspicious = sum(1 for status in statuses if status != 'normal')
+    if statuses and suspicious / len(statuses) >= 0.5:
+        return 'ai'
+    return 'mixed' if suspicious else 'authentic'
+
+
+def metric_lines(media_type, metrics):
+    """Bullet lines '- Display Name: value' for the metrics present, in registry order."""
+    return "\n".join(
+        f"- {spec['display_name']}: {metrics[name]:{spec['format']}}"
+        for name, spec in METRICS[media_type].items() if name in metrics
+    )
@@ -0,0 +1,199 @@
+"""
+The analysis pipeline shared by the API process (in-process mode) and worker.py
+(broker mode): detector scan, local analysis and dashboard previews.
+
+Deadlines are absolute times (epoch seconds, so they survive a trip through the
+broker to another host). The analyzer stops sampling video frames once
+DEADLINE_SAMPLING_SHARE of the time left is used, keeping the rest for the
+metrics, the explanations and the response; the detector, which cannot hand back half an answer, gets the time left plus
+DEADLINE_GRACE_SECONDS, so its result can still complete the stored analysis
+after the response has gone out.
+"""
+
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import detector
+from detector import scan_image, scan_video
+from probe import probe_media, ProbeError
+from instrumentation import stage
+from tracing import traced
+
+DETECTOR_VIDEO_TIMEOUT_SECONDS = 120
+DEADLINE_GRACE_SECONDS = float(os.getenv("DEADLINE_GRACE_SECONDS", 30))
+DEADLINE_SAMPLING_SHARE = float(os.getenv("DEADLINE_SAMPLING_SHARE", 0.6))
+
+
+def remaining(deadline, default=None):
+    """Seconds left until deadline (never negative), or default when there is none."""
+    if deadline is None:
+        return default
+    return max(deadline - time.time(), 0.0)
+
+
+def sampling_deadline(deadline):
+    """When the analyzer should stop decoding frames to answer by deadline, or None."""
+    if deadline is None:
+        return None
+    return time.time() + remaining(deadline) * DEADLINE_SAMPLING_SHARE
+
+
+def detector_timeout(file_type, deadline=None):
+    """HTTP timeout for a scan: the fixed video timeout, tightened to the deadline plus the grace period."""
+    default = DETECTOR_VIDEO_TIMEOUT_SECONDS if file_type == "video" else None
+    if deadline is None:
+        return default
+    bounded = remaining(deadline) + DEADLINE_GRACE_SECONDS
+    return bounded if default is None else min(default, bounded)
+
+
+def media_extension(probe):
+    """File extension for a probed format, kept on blobs so decoders and browsers can sniff by name."""
+    return ".jpg" if probe["format"] == "jpeg" else f".{probe['format']}"
+
+
+def store_previews(analyzer, blob_store, clip=True):
+    """Encode the analyzer's previews into the blob store; returns their /blobs paths."""
+    with stage('previews'):
+        encoded = analyzer.build_previews(clip=clip)
+    if not encoded:
+        return None
+    paths = {}
+    for name, data in encoded.items():
+        digest = blob_store.put_bytes(data, ".webp", ref=True)
+        paths[name] = f"/blobs/{digest}"
+    return paths
+
+
+@traced()
+def get_results(file_path, probe=None, data=None, metrics=None, analyzer=None, deadline=None):
+    """
+    Run the detector and the local analysis.
+
+    Args:
+        file_path (str): Path of the upload (only its name is used when data is given)
+        probe (dict, optional): Header info from probe_media; probed from disk if omitted
+        data (bytes, optional): The image already in memory, analysed without reading file_path
+        metrics (list, optional): Metric names to compute (see metric_registry); all by default
+        analyzer (MediaAnalyzer, optional): Analyzer to run, e.g. one keeping frames for previews
+        deadline (float, optional): Epoch seconds by which the caller needs an answer
+    """
+    if data is not None and probe is None:
+        try:
+            probe = probe_media(data)
+        except ProbeError as e:
+            return ValueError(str(e)), None
+    if probe is None:
+        try:
+            probe = probe_media(file_path)
+        except ProbeError as e:
+            return ValueError(str(e)), None
+
+    from attrClassifier import MediaAnalyzer
+
+    analyzer = analyzer or MediaAnalyzer(metrics=metrics, deadline=sampling_deadline(deadline))
+    # The detector waits on the network, so it runs alongside the analysis (in the caller's trace)
+    with ThreadPoolExecutor(1) as pool:
+        scanning = pool.submit(contextvars.copy_context().run, scan, file_path, probe, data, deadline)
+        analysis_result = analyze(analyzer, file_path, probe, data)
+        return scanning.result(), analysis_result
+
+
+@traced()
+def scan(file_path, probe, data=None, deadline=None):
+    """The detector's verdict on an upload (see get_results for the arguments)."""
+    timeout = detector_timeout(probe["type"], deadline)
+    if probe["type"] == "video":
+        with stage('detector', nbytes=probe.get("size")):
+            return scan_video(file_path, timeout)
+    if data is not None:
+        with stage('detector', nbytes=len(data)):
+            return scan_image(data, os.path.basename(file_path), timeout)
+    with stage('detector', nbytes=probe.get("size")):
+        return scan_image(file_path, timeout=timeout)
+
+
+@traced()
+def analyze(analyzer, file_path, probe, data=None):
+    """The local analysis of an upload (see get_results for the arguments)."""
+    with stage('analyze'):
+        if probe["type"] == "video":
+            return analyzer.analyze_video(file_path, probe)
+        if data is not None:
+            return analyzer.analyze_image_buffer(data, probe)
+        return analyzer.analyze_image(file_path, probe)
+
+
+@traced()
+def run_analysis_job(payload, blob_store):
+    """
+    Run one brokered analysis job against an upload already in the blob store.
+
+    Args:
+        payload (dict): {'path', 'probe', 'metrics', 'roi', 'max_dimension', 'previews', 'preview_clip', 'deadline'}
+            as enqueued by /upload
+        blob_store (BlobStore): Store the previews are written to (shared with the API)
+
+    Returns:
+        dict: {'ai_scan_result', 'analysis_result', 'previews'}
+
+    Raises:
+        ValueError: The file could not be analysed (reported to the client as a 400)
+    """
+    from attrClassifier import MediaAnalyzer
+
+    deadline = payload.get("deadline")
+    analyzer = MediaAnalyzer(metrics=payload.get("metrics"), roi=payload.get("roi"),
+                             max_dimension=payload.get("max_dimension"), keep_previews=payload.get("previews", False),
+                             deadline=sampling_deadline(deadline))
+    ai_scan_result, analysis_result = get_results(payload["path"], payload.get("probe"), None, payload.get("metrics"),
+                                                  analyzer, deadline)
+    if isinstance(ai_scan_result, ValueError):
+        raise ai_scan_result
+    previews = None
+    if payload.get("previews"):
+        previews = store_previews(analyzer, blob_store, payload.get("preview_clip", True))
+    return {"ai_scan_result": ai_scan_result, "analysis_result": analysis_result, "previews": previews}
+
+
+def warm_up(explainer=None, analysis=True, similarity_index=None):
+    """
+    Pay one-time costs before the first request: OpenCV's import and first decode,
+    the detector's connection, the explainer's handshake and loading the similarity
+    index. Each step is best effort.
+
+    Args:
+        explainer (optional): The shared explainer; warmed up if it has a warm_up method
+        analysis (bool): Warm the analyzer and detector (not needed when workers run them)
+        similarity_index (SimilarityIndex, optional): Index to load into memory
+
+    Returns:
+        dict: Seconds per step, or the error that stopped it
+    """
+    steps = [("analyzer", _warm_up_analyzer), ("detector", detector.warm_up)] if analysis else []
+    if hasattr(explainer, "warm_up"):
+        steps.append(("explainer", explainer.warm_up))
+    if similarity_index is not None:
+        steps.append(("similarity_index", similarity_index.stats))
+    report = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+            report[name] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            report[name] = f"failed: {str(e)[:200]}"
+    return report
+
+
+def _warm_up_analyzer():
+    import cv2
+    import numpy as np
+    from attrClassifier import MediaAnalyzer
+
+    image = np.zeros((96, 128, 3), dtype=np.uint8)
+    cv2.rectangle(image, (16, 16), (96, 72), (40, 160, 220), -1)
+    _, encoded = cv2.imencode(".jpg", image)
+    MediaAnalyzer().analyze_image_buffer(encoded.tobytes())
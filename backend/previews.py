@@ -0,0 +1,68 @@
+import cv2
+
+# Longest side, in pixels, of each derived image
+THUMBNAIL_SIZE = 320
+POSTER_SIZE = 960
+CLIP_SIZE = 320
+
+WEBP_QUALITY = 75
+CLIP_QUALITY = 50
+# Display time of each sampled frame in the preview clip
+CLIP_FRAME_MS = 400
+
+
+def fit(image, longest):
+    """Downscale so the longer side is at most `longest` (never upscales)."""
+    height, width = image.shape[:2]
+    scale = longest / max(width, height)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)), interpolation=cv2.INTER_AREA)
+
+
+def encode_webp(image, quality=WEBP_QUALITY):
+    ok, buffer = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode WebP preview")
+    return buffer.tobytes()
+
+
+def encode_clip(frames, frame_ms=CLIP_FRAME_MS, quality=CLIP_QUALITY):
+    """
+    Encode frames as a looping animated WebP, which browsers play in a plain <img>.
+
+    Returns:
+        bytes or None: None when there are fewer than two frames
+    """
+    if len(frames) < 2:
+        return None
+    # Sampled frames can differ by a pixel after rounding; the animation needs one size
+    height, width = frames[0].shape[:2]
+    animation = cv2.Animation()
+    animation.frames = [f if f.shape[:2] == (height, width) else cv2.resize(f, (width, height)) for f in frames]
+    animation.durations = [frame_ms] * len(frames)
+    ok, buffer = cv2.imencodeanimation('.webp', animation, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode preview clip")
+    return buffer.tobytes()
+
+
+def build_previews(poster, clip_frames=None):
+    """
+    Derive the dashboard previews from frames the analyzer already decoded.
+
+    Args:
+        poster (ndarray): BGR image (or representative video frame), at most POSTER_SIZE
+        clip_frames (list, optional): BGR sampled video frames, at most CLIP_SIZE, for the preview clip
+
+    Returns:
+        dict: Encoded WebP bytes under 'thumbnail', 'poster' and, when a clip was built, 'clip'
+    """
+    previews = {
+        'thumbnail': encode_webp(fit(poster, THUMBNAIL_SIZE)),
+        'poster': encode_webp(poster),
+    }
+    clip = encode_clip(clip_frames) if clip_frames else None
+    if clip is not None:
+        previews['clip'] = clip
+    return previews
@@ -0,0 +1,393 @@
+import io
+import os
+import struct
+
+# Reject anything past these before it is written, uploaded or decoded
+MAX_FILE_BYTES = 200 * 1024 * 1024
+MAX_PIXELS = 80_000_000
+MAX_DURATION = 15 * 60
+
+HEAD_BYTES = 64 * 1024
+MAX_MOOV_BYTES = 32 * 1024 * 1024
+
+
+class ProbeError(ValueError):
+    """Raised when a file is not valid media or exceeds the configured limits."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def probe_media(source, max_bytes=MAX_FILE_BYTES, max_pixels=MAX_PIXELS, max_duration=MAX_DURATION):
+    """
+    Identify an image or video from its container headers only, without decoding.
+
+    Args:
+        source (str, bytes-like or file-like): Path, in-memory buffer, or a seekable binary
+            file object (left at offset 0)
+        max_bytes (int, optional): Largest accepted file size
+        max_pixels (int, optional): Largest accepted width * height
+        max_duration (float, optional): Longest accepted video in seconds
+
+    Returns:
+        dict: {
+            'type': 'image' | 'video',
+            'format': str,        # 'png', 'jpeg', 'webp', 'gif', 'bmp', 'mp4', 'mov', 'webm', 'mkv', 'avi'
+            'size': int,
+            'width': int, 'height': int,
+            'codec': str | None,
+            'duration': float | None,
+            'frame_count': int | None,
+            'fps': float | None,
+            'has_exif': bool
+        }
+
+    Raises:
+        ProbeError: Unrecognised or malformed headers (400), or limits exceeded (413)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return probe_media(io.BytesIO(source), max_bytes, max_pixels, max_duration)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return probe_media(f, max_bytes, max_pixels, max_duration)
+
+    f = source
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    if size == 0:
+        raise ProbeError("Empty file")
+    if max_bytes and size > max_bytes:
+        raise ProbeError(f"File too large: {size} bytes (limit {max_bytes})", 413)
+
+    head = f.read(HEAD_BYTES)
+    try:
+        info = _probe_head(f, head, size)
+    except (struct.error, IndexError) as e:
+        raise ProbeError(f"Malformed media header: {e}")
+    finally:
+        f.seek(0)
+
+    if info is None:
+        raise ProbeError("Unsupported or unrecognised media format")
+
+    info = dict({
+        'size': size,
+        'codec': None,
+        'duration': None,
+        'frame_count': None,
+        'fps': None,
+        'has_exif': False,
+    }, **info)
+
+    if not info.get('width') or not info.get('height'):
+        raise ProbeError(f"Could not read dimensions from {info['format']} header")
+    if max_pixels and info['width'] * info['height'] > max_pixels:
+        raise ProbeError(f"Resolution too large: {info['width']}x{info['height']}", 413)
+    if max_duration and info['duration'] and info['duration'] > max_duration:
+        raise ProbeError(f"Video too long: {info['duration']:.0f}s (limit {max_duration}s)", 413)
+
+    return info
+
+
+def _probe_head(f, head, size):
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return _probe_png(f, head)
+    if head.startswith(b'\xff\xd8\xff'):
+        return _probe_jpeg(f)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return _probe_webp(head)
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return _probe_avi(head)
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        return {'type': 'image', 'format': 'gif', 'width': width, 'height': height}
+    if head[:2] == b'BM' and len(head) >= 26:
+        width, height = struct.unpack('<ii', head[18:26])
+        return {'type': 'image', 'format': 'bmp', 'width': width, 'height': abs(height)}
+    if head[4:8] == b'ftyp':
+        return _probe_isobmff(f, head, size)
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return _probe_matroska(head)
+    return None
+
+
+def _probe_png(f, head):
+    width, height = struct.unpack('>II', head[16:24])
+    info = {'type': 'image', 'format': 'png', 'width': width, 'height': height}
+
+    # eXIf must precede the image data, so only chunk headers up to IDAT are read
+    offset = 8
+    while True:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk = struct.unpack('>I4s', header)
+        if chunk == b'eXIf':
+            info['has_exif'] = True
+        if chunk in (b'IDAT', b'IEND'):
+            break
+        offset += 12 + length
+    return info
+
+
+_JPEG_SOF = {0xC0: 'baseline', 0xC1: 'extended', 0xC2: 'progressive', 0xC3: 'lossless',
+             0xC5: 'baseline', 0xC6: 'progressive', 0xC7: 'lossless',
+             0xC9: 'arithmetic', 0xCA: 'arithmetic', 0xCB: 'arithmetic',
+             0xCD: 'arithmetic', 0xCE: 'arithmetic', 0xCF: 'arithmetic'}
+
+
+def _probe_jpeg(f):
+    info = {'type': 'image', 'format': 'jpeg'}
+
+    # APP segments (ICC profiles, XMP, thumbnails) can push SOF well past the head, so
+    # follow segment lengths with seeks and read only each marker and the fields needed
+    offset = 2
+    while True:
+        f.seek(offset)
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        if header[0] != 0xFF:
+            offset += 1
+            continue
+        marker = header[1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            offset += 1 if marker == 0xFF else 2
+            continue
+        length = struct.unpack('>H', header[2:4])[0]
+        if marker == 0xE1:
+            if f.read(6) == b'Exif\x00\x00':
+                info['has_exif'] = True
+        elif marker in _JPEG_SOF:
+            height, width = struct.unpack('>HH', f.read(5)[1:5])
+            info.update(width=width, height=height, codec=_JPEG_SOF[marker])
+            return info
+        elif marker == 0xDA:
+            break
+        offset += 2 + length
+    return info
+
+
+def _probe_webp(head):
+    info = {'type': 'image', 'format': 'webp'}
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        info.update(width=width & 0x3FFF, height=height & 0x3FFF, codec='vp8')
+    elif chunk == b'VP8L':
+        bits = struct.unpack('<I', head[21:25])[0]
+        info.update(width=(bits & 0x3FFF) + 1, height=((bits >> 14) & 0x3FFF) + 1, codec='vp8l')
+    elif chunk == b'VP8X':
+        flags = head[20]
+        info.update(
+            width=int.from_bytes(head[24:27], 'little') + 1,
+            height=int.from_bytes(head[27:30], 'little') + 1,
+            codec='vp8x',
+            has_exif=bool(flags & 0x08),
+        )
+        if flags & 0x02:
+            info['animated'] = True
+    return info
+
+
+def _probe_avi(head):
+    info = {'type': 'video', 'format': 'avi'}
+    avih = head.find(b'avih')
+    if avih >= 0:
+        usec_per_frame, _, _, _, total_frames = struct.unpack('<5I', head[avih + 8:avih + 28])
+        width, height = struct.unpack('<II', head[avih + 40:avih + 48])
+        info.update(width=width, height=height, frame_count=total_frames)
+        if usec_per_frame:
+            info['fps'] = 1_000_000 / usec_per_frame
+            info['duration'] = total_frames * usec_per_frame / 1_000_000
+    strh = head.find(b'strh')
+    while strh >= 0:
+        if head[strh + 8:strh + 12] == b'vids':
+            info['codec'] = head[strh + 12:strh + 16].decode('latin-1').strip('\x00 ') or None
+            break
+        strh = head.find(b'strh', strh + 4)
+    return info
+
+
+def _iter_boxes(data, offset=0, end=None):
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield kind, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _probe_isobmff(f, head, size):
+    brand = head[8:12]
+    info = {'type': 'video', 'format': 'mov' if brand == b'qt  ' else 'mp4'}
+
+    # moov can sit after mdat, so walk top-level box headers with seeks instead of reading the file
+    offset, moov = 0, None
+    while offset + 8 <= size:
+        f.seek(offset)
+        header = f.read(16)
+        box_size, kind = struct.unpack('>I4s', header[:8])
+        if box_size == 1:
+            box_size = struct.unpack('>Q', header[8:16])[0]
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < 8:
+            break
+        if kind == b'moov':
+            if box_size > MAX_MOOV_BYTES:
+                raise ProbeError("moov box too large", 413)
+            f.seek(offset)
+            moov = f.read(box_size)
+            break
+        offset += box_size
+
+    if moov is None:
+        raise ProbeError("MP4/MOV file has no moov box (truncated or corrupt)")
+
+    for kind, start, end in _iter_boxes(moov, 8):
+        if kind == b'mvhd':
+            timescale, duration = _read_mvhd(moov, start)
+            if timescale and duration:
+                info['duration'] = duration / timescale
+        elif kind == b'trak':
+            track = _read_trak(moov, start, end)
+            if track.get('handler') == b'vide' and 'width' not in info:
+                info.update({k: v for k, v in track.items() if k != 'handler'})
+    return info
+
+
+def _read_mvhd(data, start):
+    version = data[start]
+    if version == 1:
+        return struct.unpack('>IQ', data[start + 20:start + 32])
+    return struct.unpack('>II', data[start + 12:start + 20])
+
+
+def _read_trak(data, start, end):
+    track = {}
+    for kind, s, e in _iter_boxes(data, start, end):
+        if kind == b'tkhd':
+            width, height = struct.unpack('>II', data[e - 8:e])
+            track['width'], track['height'] = width >> 16, height >> 16
+        elif kind == b'mdia':
+            for mkind, ms, me in _iter_boxes(data, s, e):
+                if mkind == b'hdlr':
+                    track['handler'] = data[ms + 8:ms + 12]
+                elif mkind == b'mdhd':
+                    timescale, duration = _read_mvhd(data, ms)
+                    track['_timescale'], track['_duration'] = timescale, duration
+                elif mkind == b'minf':
+                    _read_stbl(data, ms, me, track)
+
+    timescale = track.pop('_timescale', None)
+    duration = track.pop('_duration', None)
+    if timescale and duration and track.get('frame_count'):
+        track['fps'] = track['frame_count'] / (duration / timescale)
+    return track
+
+
+def _read_stbl(data, start, end, track):
+    for kind, s, e in _iter_boxes(data, start, end):
+        if kind == b'stbl':
+            for skind, ss, se in _iter_boxes(data, s, e):
+                if skind == b'stsd' and se - ss >= 16:
+                    track['codec'] = data[ss + 12:ss + 16].decode('latin-1')
+                elif skind == b'stts':
+                    count = struct.unpack('>I', data[ss + 4:ss + 8])[0]
+                    entries = struct.unpack(f'>{count * 2}I', data[ss + 8:ss + 8 + count * 8])
+                    if sum(entries[0::2]):
+                        track['frame_count'] = sum(entries[0::2])
+
+
+# Matroska / WebM element ids
+_EBML_DOCTYPE = 0x4282
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_CODEC_ID = 0x86
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_CLUSTER = 0x1F43B675
+
+
+def _read_vint(data, offset, keep_marker=False):
+    first = data[offset]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ProbeError("Malformed EBML header")
+    value = first if keep_marker else first & (0xFF >> length)
+    for b in data[offset + 1:offset + length]:
+        value = (value << 8) | b
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def _iter_ebml(data, offset, end):
+    while offset < end and offset < len(data):
+        element, id_len, _ = _read_vint(data, offset, keep_marker=True)
+        size, size_len, unknown = _read_vint(data, offset + id_len)
+        start = offset + id_len + size_len
+        stop = end if unknown else min(start + size, end)
+        yield element, start, stop
+        offset = stop
+
+
+def _probe_matroska(head):
+    info = {'type': 'video', 'format': 'mkv'}
+    timecode_scale, duration = 1_000_000, None
+
+    for element, start, stop in _iter_ebml(head, 0, len(head)):
+        if element == 0x1A45DFA3:
+            for child, s, e in _iter_ebml(head, start, stop):
+                if child == _EBML_DOCTYPE and head[s:e] == b'webm':
+                    info['format'] = 'webm'
+        elif element == _SEGMENT:
+            for child, s, e in _iter_ebml(head, start, stop):
+                if child == _INFO:
+                    for item, s2, e2 in _iter_ebml(head, s, e):
+                        if item == _TIMECODE_SCALE:
+                            timecode_scale = int.from_bytes(head[s2:e2], 'big')
+                        elif item == _DURATION:
+                            duration = struct.unpack('>f' if e2 - s2 == 4 else '>d', head[s2:e2])[0]
+                elif child == _TRACKS:
+                    for entry, s2, e2 in _iter_ebml(head, s, e):
+                        if entry == _TRACK_ENTRY and 'width' not in info:
+                            _read_track_entry(head, s2, e2, info)
+                elif child == _CLUSTER:
+                    break
+
+    if duration is not None:
+        info['duration'] = duration * timecode_scale / 1e9
+    return info
+
+
+def _read_track_entry(data, start, stop, info):
+    codec, video = None, {}
+    for item, s, e in _iter_ebml(data, start, stop):
+        if item == _CODEC_ID:
+            codec = data[s:e].decode('latin-1')
+        elif item == _VIDEO:
+            for field, s2, e2 in _iter_ebml(data, s, e):
+                if field == _PIXEL_WIDTH:
+                    video['width'] = int.from_bytes(data[s2:e2], 'big')
+                elif field == _PIXEL_HEIGHT:
+                    video['height'] = int.from_bytes(data[s2:e2], 'big')
+    if video:
+        info.update(video, codec=codec)
@@ -1,13 +1,56 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from detector import scan_image, scan_video
-from attrClassifier import MediaAnalyzer
-from explainability import ExplainabilityEngine
+from explainability import get_engine
+from probe import probe_media, ProbeError
+from analysis_store import AnalysisStore, verdict
+from similarity_index import SimilarityIndex, verdict_votes
+from serialization import encode_response, validate_raw_format
+from blob_store import BlobStore
+from broker import get_broker
+from pipeline import scan, analyze, remaining, sampling_deadline, store_previews, media_extension, warm_up
+from admission import StageScheduler, QueueFull
+from local_explainer import LocalExplainer
+from instrumentation import stage, timed, inc, observe, add_collector, render
+import tracing
 
-import shutil, os, subprocess, mimetypes
+from collections import OrderedDict
+from contextlib import asynccontextmanager, AsyncExitStack
+import os, asyncio, time, json, uuid, hashlib
 
-app = FastAPI()
+# OpenCV, the Gemini SDK and requests are imported on first use. At startup the shared
+# explainer is created and, unless WARMUP=0, the first decode, the detector/Gemini handshakes
+# and the similarity index load are paid before the server accepts requests (bounded by
+# WARMUP_TIMEOUT_SECONDS)
+WARMUP = os.getenv("WARMUP", "1") != "0"
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", 15))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    retention = None
+    if analysis_store is not None and (MEDIA_RETENTION_SECONDS is not None or MEDIA_RETENTION_COUNT is not None):
+        retention = asyncio.create_task(media_retention_loop())
+    elif analysis_store is not None and blob_store.quota_bytes:
+        print("BLOB_STORE_QUOTA_BYTES is set without MEDIA_RETENTION_SECONDS or MEDIA_RETENTION_COUNT; "
+              "stored analyses keep their media referenced, so only DELETE /results/{id} frees space")
+    if WARMUP:
+        started = time.perf_counter()
+        explainer = await asyncio.to_thread(get_engine)
+        try:
+            # Brokered analyses run in the workers, so only the explainer needs warming here
+            report = await asyncio.wait_for(asyncio.to_thread(warm_up, explainer, broker is None, similarity_index),
+                                            WARMUP_TIMEOUT_SECONDS)
+            print(f"Warm-up finished in {time.perf_counter() - started:.2f}s: {report}")
+        except asyncio.TimeoutError:
+            print(f"Warm-up still running after {WARMUP_TIMEOUT_SECONDS}s; accepting requests anyway")
+    yield
+    if retention is not None:
+        retention.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,105 +60,756 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Demo assets only; uploads go to the content-addressed blob store below
 UPLOAD_FOLDER = "../media"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+blob_store = BlobStore.from_env()
+
+# Frames are downscaled so their longer side is at most this many pixels unless ?max_dimension= says
+# otherwise (empty: full resolution); large images are then decoded at a reduced size directly
+MAX_DIMENSION = int(os.getenv("MAX_DIMENSION")) if os.getenv("MAX_DIMENSION") else None
+
+# Images up to this size are analysed straight from the received bytes
+IN_MEMORY_MAX_BYTES = int(os.getenv("IN_MEMORY_MAX_BYTES", 25 * 1024 * 1024))
+# Set PERSIST_UPLOADS=0 to skip writing in-memory uploads to the blob store at all
+PERSIST_UPLOADS = os.getenv("PERSIST_UPLOADS", "1") != "0"
+
+# Derive WebP thumbnail/poster (and an animated preview clip for videos) from the analysed frames
+GENERATE_PREVIEWS = os.getenv("GENERATE_PREVIEWS", "1") != "0"
+PREVIEW_CLIP = os.getenv("PREVIEW_CLIP", "1") != "0"
+
+# Gemini explanations that arrived after the local fallback was already returned,
+# keyed by explanationId (None while still pending); oldest entries are dropped first
+EXPLANATION_UPGRADES = OrderedDict()
+MAX_EXPLANATION_UPGRADES = int(os.getenv("MAX_EXPLANATION_UPGRADES", 1000))
+
+# Every /upload response is kept here and served again from /results/{id}
+analysis_store = AnalysisStore.from_env()
+# Set REUSE_ANALYSES=0 to re-run the full pipeline for content that was already analysed
+REUSE_ANALYSES = os.getenv("REUSE_ANALYSES", "1") != "0"
+# Most recent analyses of the same bytes checked for one complete and run with the same options
+REUSE_CANDIDATES = int(os.getenv("REUSE_CANDIDATES", 10))
+# Media retention: analyses older than MEDIA_RETENTION_SECONDS, or beyond the newest MEDIA_RETENTION_COUNT,
+# give up their upload and previews (the result is kept, with path and previews set to None) so the blob
+# store can evict them; checked every MEDIA_RETENTION_INTERVAL_SECONDS. Unset, media is kept until
+# DELETE /results/{id}, and a BLOB_STORE_QUOTA_BYTES can only be met by deleting results
+MEDIA_RETENTION_SECONDS = float(os.getenv("MEDIA_RETENTION_SECONDS")) if os.getenv("MEDIA_RETENTION_SECONDS") else None
+MEDIA_RETENTION_COUNT = int(os.getenv("MEDIA_RETENTION_COUNT")) if os.getenv("MEDIA_RETENTION_COUNT") else None
+MEDIA_RETENTION_INTERVAL_SECONDS = float(os.getenv("MEDIA_RETENTION_INTERVAL_SECONDS", 300))
+# Metric signatures of stored analyses, searched by /similar/{id} (SIMILARITY_INDEX_PATH, empty to disable)
+similarity_index = SimilarityIndex.from_env() if analysis_store is not None else None
+
+# With BROKER_URL set, analyses run in worker.py processes (on this host or others) and
+# this process only stores uploads, waits for the job and writes the explanations
+broker = get_broker()
+ANALYSIS_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_TIMEOUT_SECONDS", 300))
+
+# Kept back from a client's ?deadline= budget for explaining, storing and sending the response
+DEADLINE_MARGIN_SECONDS = float(os.getenv("DEADLINE_MARGIN_SECONDS", 0.2))
+# Stages still running when a deadline-bound response goes out, and the uploads they complete
+BACKGROUND_TASKS = set()
+
+# Admission control: each stage runs a bounded number of jobs and queues a bounded number
+# per lane (fast: images, bulk: videos and ?batch=true), sharing slots fairly across clients
+analysis_stage = StageScheduler.from_env("analysis", os.cpu_count() or 1)
+explain_stage = StageScheduler.from_env("explain", int(os.getenv("GEMINI_MAX_CONCURRENCY", 8)))
+# Fair-queuing cost of a video relative to an image
+VIDEO_JOB_COST = float(os.getenv("VIDEO_JOB_COST", 5))
+local_explainer = LocalExplainer()
+add_collector(analysis_stage.collect)
+add_collector(explain_stage.collect)
+
 app.mount("/media", StaticFiles(directory=UPLOAD_FOLDER), name="media")
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
+async def upload_file(request: Request, file: UploadFile = File(...), metrics: str = None, batch: bool = False,
+                      max_points: int = None, raw_format: str = None, deadline: float = None, roi: str = None,
+                      max_dimension: int = None):
+    from attrClassifier import MediaAnalyzer
 
-    file_type = detect_file_type(file.filename)
-    if file_type == "unknown":
-        raise HTTPException(status_code=400, detail="Unsupported file type")
+    # Optional comma-separated metric selection; unselected primitives are never computed
+    metric_names = [m.strip() for m in metrics.split(",") if m.strip()] if metrics else None
+    # Settings that change the analysis; a stored one is only reused for the same settings
+    options = {"metrics": sorted(metric_names) if metric_names else None, "roi": roi or None,
+               "max_dimension": max_dimension if max_dimension is not None else MAX_DIMENSION}
+    try:
+        if options["max_dimension"] is not None and options["max_dimension"] < 1:
+            raise ValueError("max_dimension must be a positive number of pixels")
+        # Validates the metric names and roi
+        analyzer = MediaAnalyzer(metrics=metric_names, roi=options["roi"], max_dimension=options["max_dimension"],
+                                 keep_previews=GENERATE_PREVIEWS)
+        validate_shape(max_points, raw_format)
+        # Seconds the client will wait (?deadline= or X-Deadline); every stage gets what is left of it
+        expires_at = parse_deadline(deadline if deadline is not None else request.headers.get("x-deadline"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Reject corrupt, renamed or oversized files from their headers before anything is written
+    try:
+        with stage("probe"):
+            probe = probe_media(file.file)
+    except ProbeError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    file_type = probe["type"]
+    ext = media_extension(probe)
+    analyzer.deadline = sampling_deadline(expires_at)
 
-    print(f"File saved to: {filepath}")
+    persisted = True
+    previews_task = None
+    # Bounded, per-client fair admission to the CPU/detector stage; a full lane answers 429.
+    # The slot is held until the stages finish, which can be after a deadline-bound response
+    client = client_id(request)
+    lane = "bulk" if batch or file_type == "video" else "fast"
+    slot = AsyncExitStack()
+    await slot.enter_async_context(analysis_stage.slot(client, lane, VIDEO_JOB_COST if file_type == "video" else 1.0))
+    try:
+        if file_type == "image" and probe["size"] <= IN_MEMORY_MAX_BYTES and broker is None:
+            # One buffer feeds the detector upload, the decoder and (off the critical path) the disk write
+            data, content_hash = await asyncio.to_thread(read_and_hash, file.file)
+            reused = await find_previous_analysis(content_hash, options)
+            if reused is not None:
+                await slot.aclose()
+                return json_response(reused, request, max_points, raw_format)
+            persist_task = None
+            if PERSIST_UPLOADS:
+                # The stored analysis holds the reference taken here; released by DELETE /results/{id}
+                persist_task = asyncio.create_task(asyncio.to_thread(
+                    timed, "ingest", blob_store.put_bytes, data, ext, content_hash, nbytes=len(data), ref=True
+                ))
+            else:
+                persisted = False
 
-    ai_scan_result, analysis_result = get_results(filepath)
+            detector_task = background(asyncio.to_thread(scan, file.filename, probe, data, expires_at))
+            analysis_task = background(asyncio.to_thread(analyze, analyzer, file.filename, probe, data))
 
-    if isinstance(ai_scan_result, ValueError):
-        raise HTTPException(status_code=400, detail=str(ai_scan_result))
-    
+            if persist_task is not None:
+                await persist_task
+                print(f"File saved to: {blob_store.path(content_hash, ext)}")
+        else:
+            content_hash = await asyncio.to_thread(timed, "ingest", blob_store.put_file, file.file, ext,
+                                                   nbytes=probe["size"], ref=True)
+            filepath = blob_store.path(content_hash, ext)
+            print(f"File saved to: {filepath}")
+
+            reused = await find_previous_analysis(content_hash, options)
+            if reused is not None:
+                await release_blobs(content_hash)
+                await slot.aclose()
+                return json_response(reused, request, max_points, raw_format)
+
+            if broker is not None:
+                job = background(run_brokered_analysis(filepath, probe, options, content_hash, expires_at))
+                detector_task = background(job_field(job, "ai_scan_result"))
+                analysis_task = background(job_field(job, "analysis_result"))
+                previews_task = background(job_field(job, "previews"))
+            else:
+                detector_task = background(asyncio.to_thread(scan, filepath, probe, None, expires_at))
+                analysis_task = background(asyncio.to_thread(analyze, analyzer, filepath, probe))
+    except BaseException:
+        await slot.aclose()
+        raise
+    background(release_when_done(slot, [detector_task, analysis_task]))
+
+    # Stages that failed, by section; recorded as complete_upload does for stages that fail after the deadline
+    errors = {}
+
+    async def finished(task, section):
+        """A stage's result, or None while it is still running or once it has failed."""
+        if not task.done():
+            return None
+        try:
+            return task.result()
+        except ValueError as e:
+            if persisted:
+                await release_blobs(content_hash)
+            raise HTTPException(status_code=400, detail=str(e))
+        except HTTPException:
+            # A brokered job that failed or timed out, already answered with its own status
+            raise
+        except Exception as e:
+            errors[section] = str(e)
+            return None
+
+    # Without a deadline each wait lasts until the stage is done; with one, whatever is finished
+    # by then is answered. The explanation starts as soon as the analysis is in, while the detector runs on.
+    await asyncio.wait([analysis_task], timeout=remaining(expires_at))
+    if detector_task.done():
+        await finished(detector_task, "ai_scan_result")
+    analysis_result = await finished(analysis_task, "analysis_result")
+
+    # One structured Gemini call covers the overview and every metric; the shared
+    # engine's limiter keeps concurrent uploads inside the Gemini quota. Past
+    # GEMINI_DEADLINE_SECONDS (or the client's deadline) the local explanation is
+    # returned instead and the Gemini answer is published under explanationId when it lands.
+    analysis_id = uuid.uuid4().hex
+    explanations = previews = None
+    if analysis_result is not None:
+        # Previews are encoded from frames already in memory, alongside the Gemini call
+        # (brokered jobs return them with the analysis)
+        if previews_task is None:
+            previews_task = background(asyncio.to_thread(store_previews, analyzer, blob_store, PREVIEW_CLIP))
+        explanations = await explain_upload(analysis_id, analysis_result, client, lane, expires_at)
+        print(explanations['overview'])
+    await asyncio.wait([detector_task], timeout=remaining(expires_at))
+    ai_scan_result = await finished(detector_task, "ai_scan_result")
     print(ai_scan_result)
-    ai_detected = ai_scan_result["ai_detected"]
-    ai_confidence = ai_scan_result["ai_confidence"]
-    is_deepfake = ai_scan_result["deepfake_detected"]
-    deepfake_confidence = ai_scan_result["deepfake_confidence"]
-
-    explainer = ExplainabilityEngine()
-    brief_overview = explainer.explain_overall_analysis(analysis_result)
-
-    print(brief_overview)
-
-    # Generate metric-specific explanations
-    metric_explanations = []
-    metrics = analysis_result['metrics']
-    
-    for metric_name in metrics.keys():
-        metric_data = explainer.explain_individual_metric(analysis_result, metric_name)
-        metric_explanations.append(metric_data)
-
-    ai_detected = ai_scan_result["ai_detected"]
-    ai_confidence = ai_scan_result["ai_confidence"]
-    is_deepfake = ai_scan_result["deepfake_detected"]
-    deepfake_confidence = ai_scan_result["deepfake_confidence"]
-
-    explainer = ExplainabilityEngine()
-    brief_overview = explainer.explain_overall_analysis(analysis_result)
-
-    print(brief_overview)
-
-    # Generate metric-specific explanations
-    metric_explanations = []
-    metrics = analysis_result['metrics']
-    
-    for metric_name in metrics.keys():
-        metric_data = explainer.explain_individual_metric(analysis_result, metric_name)
-        metric_explanations.append(metric_data)
+    if previews_task is not None:
+        await asyncio.wait([previews_task], timeout=remaining(expires_at))
+        previews = await finished(previews_task, "previews")
+
+    # Failed stages are reported under errors, not left pending
+    pending = [section for section, missing in (
+        ("ai_scan_result", ai_scan_result is None),
+        ("analysis_result", analysis_result is None),
+        ("explanations", explanations is None and "analysis_result" not in errors),
+        ("previews", GENERATE_PREVIEWS and (previews_task is None or not previews_task.done())
+         and "analysis_result" not in errors),
+    ) if missing and section not in errors]
+    response = upload_response(analysis_id, file.filename, probe, content_hash, persisted, ai_scan_result,
+                               analysis_result, explanations, previews, pending, options)
+    if errors:
+        response["errors"] = errors
+    if pending:
+        # Cut short by the deadline: the rest is filled in under the same id, for GET /results/{id}
+        print(f"Deadline reached with {', '.join(pending)} pending")
+        await save_response(response, content_hash, persisted, final=False)
+        background(complete_upload(response, detector_task, analysis_task, previews_task, analyzer,
+                                   client, lane, content_hash, persisted))
+    else:
+        await save_response(response, content_hash, persisted)
+    return json_response(response, request, max_points, raw_format)
+
+
+def media_digests(response):
+    """Blob store hashes an /upload response holds references to (its upload and previews)."""
+    paths = [response["path"]] + list((response.get("previews") or {}).values())
+    return [path.rsplit("/", 1)[-1] for path in paths if path]
+
+
+async def release_blobs(*digests):
+    """Drop one reference to each blob, off the event loop (the index write can wait on other puts)."""
+    if digests:
+        await asyncio.to_thread(blob_store.decref, *digests)
+
+
+def read_and_hash(f):
+    """The whole upload and its SHA-256 (run in a thread: both block for the size of the file)."""
+    data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
 
+
+def upload_response(analysis_id, filename, probe, content_hash, persisted, ai_scan_result, analysis_result,
+                    explanations, previews, pending, options=None):
+    """The /upload body; sections still being computed are None and listed in pending."""
+    scan_result = ai_scan_result or {}
+    explanations = explanations or {}
     return {
+        "id": analysis_id,
         "status": "success",
-        "filename": file.filename,
-        "path": f"/media/{file.filename}",
-        "size": os.path.getsize(filepath),
-        "type": file_type,
-        "ai_detected": ai_detected,
-        "ai_confidence": ai_confidence,
-        "is_deepfake": is_deepfake,
-        "deepfake_confidence": deepfake_confidence,
+        "filename": filename,
+        "path": f"/blobs/{content_hash}" if persisted else None,
+        "content_hash": content_hash,
+        "previews": previews,
+        "size": probe["size"],
+        "type": probe["type"],
+        "ai_detected": scan_result.get("ai_detected"),
+        "ai_confidence": scan_result.get("ai_confidence"),
+        "is_deepfake": scan_result.get("deepfake_detected"),
+        "deepfake_confidence": scan_result.get("deepfake_confidence"),
         "ai_scan_result": ai_scan_result,
         "analysis_result": analysis_result,
-        "briefOverview": brief_overview,
-        "metricExplanations": metric_explanations,
+        "briefOverview": explanations.get("overview"),
+        "metricExplanations": explanations.get("metrics"),
+        "explanationSource": explanations.get("source"),
+        "explanationId": analysis_id if explanations.get("upgrade_pending") else None,
+        "pending": pending,
+        "options": options,
+    }
+
+
+async def explain_upload(analysis_id, analysis_result, client, lane, expires_at=None):
+    """Explanations for an analysis, waiting for Gemini no longer than the engine's deadline or the client's."""
+    explainer = get_engine()
+    deadline = None
+    if expires_at is not None:
+        configured = getattr(explainer, "deadline", None)
+        # A zero deadline would mean "wait for Gemini", so an expired one still gets a token wait
+        deadline = max(remaining(expires_at), 0.001)
+        deadline = min(deadline, configured) if configured else deadline
+    try:
+        async with explain_stage.slot(client, lane):
+            explanations = await explainer.explain_all_metrics_async(
+                analysis_result, include_overview=True, deadline=deadline,
+                on_upgrade=lambda upgraded: store_explanation(analysis_id, upgraded)
+            )
+    except QueueFull:
+        # The analysis is already paid for, so answer with local text rather than a 429
+        explanations = local_explainer.explain_all_metrics(analysis_result, include_overview=True)
+    if explanations.get('upgrade_pending'):
+        store_explanation(analysis_id, None)
+    return explanations
+
+
+async def save_response(response, content_hash, persisted, final=True):
+    """Store an /upload response (and index its metrics), or release its blobs when history is off."""
+    analysis_id = response["id"]
+    if analysis_store is not None:
+        await asyncio.to_thread(timed, "store", analysis_store.save, response, content_hash, analysis_id)
+        # Only a complete result has a trustworthy verdict and undegraded metrics to index
+        if similarity_index is not None and final and is_complete(response):
+            await asyncio.to_thread(timed, "index", similarity_index.add, analysis_id, response["type"],
+                                    response["analysis_result"].get("metrics"), verdict(response))
+        if EXPLANATION_UPGRADES.get(analysis_id) is not None:
+            # Gemini finished while the row was being written
+            await asyncio.to_thread(analysis_store.update_explanations, analysis_id, EXPLANATION_UPGRADES[analysis_id])
+    elif final:
+        # Nothing keeps the upload or its previews alive, so let eviction reclaim them
+        await release_blobs(*media_digests(response))
+
+
+async def complete_upload(response, detector_task, analysis_task, previews_task, analyzer, client, lane,
+                          content_hash, persisted):
+    """Finish the sections a deadline cut off and store the complete response under the same id."""
+    errors = {}
+    ai_scan_result, analysis_result = response["ai_scan_result"], response["analysis_result"]
+    explanations = None
+    if response["briefOverview"] is not None:
+        explanations = {"overview": response["briefOverview"], "metrics": response["metricExplanations"],
+                        "source": response["explanationSource"], "upgrade_pending": response["explanationId"] is not None}
+    try:
+        ai_scan_result = await detector_task
+    except Exception as e:
+        errors["ai_scan_result"] = str(e)
+    try:
+        analysis_result = await analysis_task
+    except Exception as e:
+        errors["analysis_result"] = str(e)
+    if explanations is None and analysis_result is not None:
+        explanations = await explain_upload(response["id"], analysis_result, client, lane)
+    previews = response["previews"]
+    if previews is None and analysis_result is not None:
+        try:
+            if previews_task is None:
+                previews_task = asyncio.to_thread(store_previews, analyzer, blob_store, PREVIEW_CLIP)
+            previews = await previews_task
+        except Exception as e:
+            errors["previews"] = str(e)
+
+    completed = upload_response(response["id"], response["filename"], {"size": response["size"], "type": response["type"]},
+                                content_hash, persisted, ai_scan_result, analysis_result, explanations, previews, [],
+                                response.get("options"))
+    if errors:
+        completed["errors"] = errors
+    await save_response(completed, content_hash, persisted)
+    print(f"Completed {response['id']} after the deadline" + (f" ({errors})" if errors else ""))
+
+
+def is_complete(response):
+    """False for a response with sections still pending or failed, or a deadline-truncated analysis."""
+    analysis_result = response.get("analysis_result")
+    if response.get("pending") or response.get("errors") or analysis_result is None or response.get("ai_scan_result") is None:
+        return False
+    return not (analysis_result.get("metadata") or {}).get("partial")
+
+
+async def release_when_done(slot, tasks):
+    await asyncio.wait(tasks)
+    await slot.aclose()
+
+
+async def job_field(job, name):
+    return (await job)[name]
+
+
+def background(awaitable):
+    """Run as a task that outlives the request; its exception is read by whoever awaits it, or dropped."""
+    task = asyncio.ensure_future(awaitable)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+def parse_deadline(value):
+    """Epoch seconds by which to answer, from a budget in seconds (minus DEADLINE_MARGIN_SECONDS), or None."""
+    if value is None or value == "":
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid deadline: {value} (expected seconds)")
+    if not seconds > 0:
+        raise ValueError("deadline must be a positive number of seconds")
+    return time.time() + max(seconds - DEADLINE_MARGIN_SECONDS, 0.0)
+
+
+async def run_brokered_analysis(filepath, probe, options, content_hash, deadline=None):
+    """Hand the stored upload to a worker and wait for its analysis (options as built by /upload)."""
+    payload = {
+        "path": os.path.abspath(filepath),
+        "probe": probe,
+        "metrics": options["metrics"],
+        "roi": options["roi"],
+        "max_dimension": options["max_dimension"],
+        "previews": GENERATE_PREVIEWS,
+        "preview_clip": PREVIEW_CLIP,
+        "deadline": deadline,
+    }
+    job_id = await asyncio.to_thread(broker.enqueue, "analysis", payload)
+    with stage("broker_wait"):
+        status = await broker.wait(job_id, ANALYSIS_TIMEOUT_SECONDS)
+    if status is None:
+        await release_blobs(content_hash)
+        raise HTTPException(status_code=504, detail=f"Analysis did not finish in time; poll /jobs/{job_id}")
+    if status["state"] == "failed":
+        await release_blobs(content_hash)
+        raise HTTPException(status_code=status["status_code"] or 500, detail=status["error"])
+    return status["result"]
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """State of a brokered analysis job (queued, running, done or failed)."""
+    if broker is None:
+        raise HTTPException(status_code=404, detail="No broker configured")
+    status = await asyncio.to_thread(broker.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return status
+
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """Trace every request (id in X-Trace-Id), profile it when asked or sampled, and record its latency."""
+    profile, keep_profile = tracing.profile_decision(request.headers.get("x-debug-profile"))
+    trace, token = tracing.begin(f"{request.method} {request.url.path}", request.headers.get("x-trace-id"), profile)
+    start = time.perf_counter()
+    try:
+        with tracing.span(trace.name):
+            response = await call_next(request)
+    finally:
+        tracing.end(trace, token, keep_profile)
+    route = request.scope.get("route")
+    observe("trueview_http_request_seconds", time.perf_counter() - start,
+            route=route.path if route else "unmatched", method=request.method, status=str(response.status_code))
+    response.headers["X-Trace-Id"] = trace.id
+    return response
+
+
+@app.get("/traces")
+async def list_traces(limit: int = 50, min_duration: float = 0.0):
+    """Most recent traces first, without their spans."""
+    require_traces()
+    items = [
+        {k: v for k, v in t.items() if k not in ("spans", "memory", "profile_summary")}
+        for t in reversed(tracing.TRACES.values()) if (t["duration"] or 0) >= min_duration
+    ]
+    return {"items": items[:limit]}
+
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """Spans of one request, plus peak memory and a profile summary when it was profiled."""
+    require_traces()
+    trace = await asyncio.to_thread(tracing.get_trace, trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired trace id")
+    return trace
+
+
+@app.get("/traces/{trace_id}/profile")
+async def get_trace_profile(trace_id: str):
+    """The request's cProfile data (pstats format; open with snakeviz or python -m pstats)."""
+    require_traces()
+    path = tracing.profile_path(trace_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No profile for this trace")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{trace_id}.prof")
+
+
+def require_traces():
+    if not tracing.EXPOSE_TRACES:
+        raise HTTPException(status_code=404, detail="Trace endpoints are disabled (set EXPOSE_TRACES=1)")
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latencies, bytes, frames, cache lookups and queue state in the Prometheus text format."""
+    return Response(render(), media_type="text/plain; version=0.0.4")
+
+
+def json_response(content, request: Request = None, max_points: int = None, raw_format: str = None):
+    """
+    Serialize a response body as its own stage instead of inside FastAPI, where it can't be timed.
+    raw_data is decimated to max_points and encoded as raw_format; Accept: application/msgpack
+    gets a MessagePack body when msgpack is installed.
+    """
+    accept = request.headers.get("accept") if request is not None else None
+    with stage("serialize"):
+        body, media_type = encode_response(content, accept, max_points, raw_format)
+    inc("trueview_stage_bytes_total", len(body), stage="serialize")
+    return Response(body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def validate_shape(max_points, raw_format):
+    if max_points is not None and max_points < 2:
+        raise ValueError("max_points must be at least 2")
+    validate_raw_format(raw_format)
+
+
+@app.exception_handler(QueueFull)
+async def queue_full(request: Request, exc: QueueFull):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.get("/queues")
+async def queue_stats():
+    """Depth, running jobs, admissions, rejections and wait-time histograms per stage and lane."""
+    stats = {"analysis": analysis_stage.stats(), "explain": explain_stage.stats()}
+    if broker is not None:
+        stats["broker"] = {"analysis": await asyncio.to_thread(broker.depth, "analysis")}
+    return stats
+
+
+def client_id(request):
+    """Fair-queuing identity: X-Client-Id (set by the frontend or a proxy), else the peer address."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+
+async def apply_media_retention():
+    """Release the media of analyses outside the retention policy, then evict what is no longer referenced."""
+    older_than = time.time() - MEDIA_RETENTION_SECONDS if MEDIA_RETENTION_SECONDS is not None else None
+    released = 0
+    while True:
+        batch = await asyncio.to_thread(analysis_store.release_media, older_than, MEDIA_RETENTION_COUNT)
+        if not batch:
+            break
+        await release_blobs(*[digest for response in batch for digest in media_digests(response)])
+        released += len(batch)
+    if released:
+        evicted = await asyncio.to_thread(blob_store.evict)
+        print(f"Media retention released {released} analyses; {evicted} blobs evicted")
+    return released
+
+
+async def media_retention_loop():
+    while True:
+        try:
+            await apply_media_retention()
+        except Exception as e:
+            print(f"Media retention failed: {e}")
+        await asyncio.sleep(MEDIA_RETENTION_INTERVAL_SECONDS)
+
+
+async def find_previous_analysis(content_hash, options):
+    """The stored response for identical bytes analysed with the same options, so repeat uploads skip every paid call."""
+    if analysis_store is None or not REUSE_ANALYSES:
+        return None
+    for previous_id in await asyncio.to_thread(analysis_store.find_all_by_hash, content_hash, REUSE_CANDIDATES):
+        response = await asyncio.to_thread(analysis_store.get, previous_id)
+        # Skip analyses a deadline cut short (or still finishing), ones whose media retention released
+        # and ones run with other options; rows stored before options were recorded used the defaults,
+        # which get() reads as None
+        stored_options = (response or {}).get("options") or {}
+        if response is None or not is_complete(response) or response.get("media_released") or any(
+                stored_options.get(name) != value for name, value in options.items()):
+            continue
+        inc("trueview_cache_lookups_total", cache="analysis", result="hit")
+        response["reused"] = True
+        return response
+    inc("trueview_cache_lookups_total", cache="analysis", result="miss")
+    return None
+
+
+@app.get("/results")
+async def list_results(limit: int = 50, cursor: str = None, verdict: str = None, content_hash: str = None):
+    """Newest-first analysis history; pass next_cursor back as cursor for the next page."""
+    if analysis_store is None:
+        raise HTTPException(status_code=404, detail="Analysis history is disabled")
+    limit = min(max(limit, 1), 500)
+    try:
+        return await asyncio.to_thread(analysis_store.list_results, limit, cursor, verdict, content_hash)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/results/{analysis_id}")
+async def delete_result(analysis_id: str):
+    if analysis_store is None:
+        raise HTTPException(status_code=404, detail="Analysis history is disabled")
+    stored = await asyncio.to_thread(analysis_store.get, analysis_id)
+    content_hash = await asyncio.to_thread(analysis_store.delete, analysis_id)
+    if content_hash is None:
+        raise HTTPException(status_code=404, detail="Unknown analysis id")
+    if similarity_index is not None:
+        await asyncio.to_thread(similarity_index.remove, analysis_id)
+    await release_blobs(*media_digests(stored))
+    return {"status": "deleted", "id": analysis_id}
+
+
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str, request: Request):
+    """
+    Serve an upload by content hash. The hash doubles as a strong ETag, so
+    revalidation is a 304, and Range requests get 206 partial content.
+    """
+    blob = await asyncio.to_thread(blob_store.get, digest)
+    if blob is None or not os.path.exists(blob["path"]):
+        raise HTTPException(status_code=404, detail="Unknown or evicted blob")
+
+    etag = f'"{digest}"'
+    headers = {"etag": etag, "cache-control": "public, max-age=31536000, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(blob["path"], headers=headers)
+
+
+@app.get("/blobs")
+async def blob_stats():
+    return await asyncio.to_thread(blob_store.stats)
+
+
+@app.get("/results/{analysis_id}")
+async def get_result(request: Request, analysis_id: str, max_points: int = None, raw_format: str = None):
+    try:
+        validate_shape(max_points, raw_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if analysis_store is None:
+        raise HTTPException(status_code=404, detail="Analysis history is disabled")
+    response = await asyncio.to_thread(analysis_store.get, analysis_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Unknown analysis id")
+    return json_response(response, request, max_points, raw_format)
+
+
+@app.get("/similar/{analysis_id}")
+async def get_similar(analysis_id: str, k: int = 10):
+    """Stored analyses with the nearest metric signatures, and the verdicts they got."""
+    if similarity_index is None:
+        raise HTTPException(status_code=404, detail="Similarity search is disabled")
+    k = min(max(k, 1), 100)
+    with stage("similar"):
+        found = await asyncio.to_thread(similarity_index.neighbors, analysis_id, k)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Unknown analysis id, or one analysed with a metric selection")
+    return {"id": analysis_id, "type": found["type"], "neighbors": found["neighbors"],
+            "neighbor_verdict": verdict_votes(found["neighbors"])}
+
+
+@app.get("/explanations/{explanation_id}")
+async def get_explanation(explanation_id: str):
+    """Poll for the Gemini explanation that replaces a local fallback."""
+    if explanation_id not in EXPLANATION_UPGRADES:
+        # Another API process may have handled the upload; the shared store has its state
+        stored = await asyncio.to_thread(analysis_store.get, explanation_id) if analysis_store is not None else None
+        if stored is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+        if stored.get("explanationId") is not None and stored.get("explanationSource") == "local":
+            return {"status": "pending"}
+        return {
+            "status": "ready",
+            "briefOverview": stored["briefOverview"],
+            "metricExplanations": stored["metricExplanations"],
+            "explanationSource": stored["explanationSource"],
+        }
+    explanations = EXPLANATION_UPGRADES[explanation_id]
+    if explanations is None:
+        return {"status": "pending"}
+    return {
+        "status": "ready",
+        "briefOverview": explanations['overview'],
+        "metricExplanations": explanations['metrics'],
+        "explanationSource": explanations.get('source'),
     }
 
 
-def get_results(file_path):
-    file_type = detect_file_type(file_path)
+@app.get("/cache/stats")
+async def cache_stats():
+    cache = get_engine().cache
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@app.websocket("/stream")
+async def stream_analysis(websocket: WebSocket, window: float = 2.0, hop: float = 1.0, sample_fps: float = 10.0,
+                          metrics: str = None):
+    """
+    Live sliding-window analysis. The client sends encoded frames (JPEG/PNG/WebP)
+    as binary messages, optionally preceded by a JSON text message {"t": seconds}
+    carrying the frame timestamp, and {"end": true} to finish. Window events are
+    sent back as JSON as soon as each hop completes.
+    """
+    import cv2
+    import numpy as np
+    from stream_analyzer import StreamAnalyzer
+
+    await websocket.accept()
+    metric_names = [m.strip() for m in metrics.split(",") if m.strip()] if metrics else None
+    try:
+        analyzer = StreamAnalyzer(window, hop, sample_fps, metrics=metric_names)
+    except ValueError as e:
+        await websocket.send_json({"event": "error", "detail": str(e)})
+        await websocket.close(code=1008)
+        return
+    started = time.monotonic()
+    timestamp = None
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            if message.get("text") is not None:
+                try:
+                    control = json.loads(message["text"])
+                    if control.get("end"):
+                        break
+                    timestamp = control.get("t")
+                    if timestamp is not None:
+                        timestamp = float(timestamp)
+                except (json.JSONDecodeError, AttributeError, KeyError, TypeError, ValueError):
+                    timestamp = None
+                    await websocket.send_json({"event": "error",
+                                               "detail": 'Control messages must be JSON objects like {"t": 1.5} or {"end": true}'})
+                continue
+
+            frame = cv2.imdecode(np.frombuffer(message["bytes"], dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                await websocket.send_json({"event": "error", "detail": "Could not decode frame"})
+                continue
+
+            t = timestamp if timestamp is not None else time.monotonic() - started
+            timestamp = None
+            event = await asyncio.to_thread(analyzer.push, frame, t)
+            if event is not None:
+                await websocket.send_json(event)
+
+        event = analyzer.flush()
+        if event is not None:
+            await websocket.send_json(event)
+        await websocket.send_json({"event": "end", "frames_seen": analyzer.frames_seen})
+        await websocket.close()
+    except WebSocketDisconnect:
+        return
 
-    if file_type == "unknown":
-        return ValueError("Unsupported file type")
 
-    ai_scan_result = None
-    analyzer = MediaAnalyzer()
-    if file_type == "image":
-        ai_scan_result = scan_image(file_path)
-        analysis_result = analyzer.analyze_image(file_path)
-    elif file_type == "video":
-        ai_scan_result = scan_video(file_path)
-        analysis_result = analyzer.analyze_video(file_path)
+def store_explanation(explanation_id, explanations):
+    # A late upgrade can land before the pending marker is written; never overwrite it with None
+    if explanations is None and EXPLANATION_UPGRADES.get(explanation_id) is not None:
+        return
+    if explanations is not None and analysis_store is not None:
+        # Called from a done-callback on the event loop, so the SQLite write goes to a thread
+        background(asyncio.to_thread(analysis_store.update_explanations, explanation_id, explanations))
+    EXPLANATION_UPGRADES[explanation_id] = explanations
+    EXPLANATION_UPGRADES.move_to_end(explanation_id)
+    while len(EXPLANATION_UPGRADES) > MAX_EXPLANATION_UPGRADES:
+        EXPLANATION_UPGRADES.popitem(last=False)
 
-    return ai_scan_result, analysis_result
 
 def detect_file_type(path):
-    mime_type, _ = mimetypes.guess_type(path)
-    if mime_type:
-        if mime_type.startswith("image"):
-            return "image"
-        elif mime_type.startswith("video"):
-            return "video"
-    return "unknown"
+    try:
+        return probe_media(path)["type"]
+    except (ProbeError, OSError):
+        return "unknown"
@@ -0,0 +1,145 @@
+"""
+Response and storage encoding. NumPy scalars and arrays are converted natively by
+orjson (when installed) in the same pass that writes the JSON, instead of one
+Python callback per value.
+
+Analysis responses can also be shaped for the client: `raw_data` series longer
+than max_points are decimated to per-bucket minima and maxima (so spikes survive),
+and series can be sent as base64 float32 instead of number lists. With
+Accept: application/msgpack (and the msgpack package installed) the body is
+MessagePack and series are raw float32 bytes.
+"""
+
+import base64
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install msgpack
+    msgpack = None
+
+RAW_FORMATS = ('list', 'base64')
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """Compact UTF-8 JSON, with orjson when it is installed and the standard library otherwise."""
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def dumps_str(value) -> str:
+    """dumps() as text, for SQLite TEXT columns and Redis values."""
+    return dumps(value).decode()
+
+
+def validate_raw_format(raw_format):
+    """Raise ValueError for an unknown raw_format."""
+    if raw_format is not None and raw_format not in RAW_FORMATS:
+        raise ValueError(f"Unknown raw_format: {raw_format} (expected one of {', '.join(RAW_FORMATS)})")
+
+
+def wants_msgpack(accept: str) -> bool:
+    return msgpack is not None and any(t in (accept or '') for t in MSGPACK_TYPES)
+
+
+def encode_response(content, accept: str = None, max_points: int = None, raw_format: str = None):
+    """
+    Encode a response body.
+
+    Args:
+        content (dict): The response; a nested analysis_result has its raw_data shaped
+        accept (str, optional): The request's Accept header, for MessagePack negotiation
+        max_points (int, optional): Longest raw_data series to send; longer ones are decimated
+        raw_format (str, optional): 'list' (default) or 'base64' float32 series
+
+    Returns:
+        tuple: (body bytes, media type)
+    """
+    binary = wants_msgpack(accept)
+    if max_points or raw_format == 'base64' or binary:
+        content = shape_analysis(content, max_points, 'binary' if binary else raw_format or 'list')
+    if binary:
+        return msgpack.packb(content, default=_msgpack_default, use_bin_type=True), MSGPACK_TYPES[0]
+    return dumps(content), 'application/json'
+
+
+def shape_analysis(content, max_points=None, raw_format='list'):
+    """A copy of a response (or bare analysis result) with its raw_data decimated and encoded."""
+    if 'analysis_result' in content and isinstance(content['analysis_result'], dict):
+        return dict(content, analysis_result=shape_analysis(content['analysis_result'], max_points, raw_format))
+    if not content.get('raw_data'):
+        return content
+
+    raw_data, indices = {}, {}
+    for name, series in content['raw_data'].items():
+        values = np.asarray(series, dtype=np.float64)
+        index, values = decimate(values, max_points)
+        if index is not None:
+            indices[name] = index.tolist()
+        raw_data[name] = encode_series(values, raw_format)
+    shaped = dict(content, raw_data=raw_data)
+    if indices:
+        # Positions of the kept points in the original series, for plotting
+        shaped['raw_data_index'] = indices
+    if raw_format != 'list':
+        shaped['raw_data_format'] = raw_format
+    return shaped
+
+
+def decimate(values, max_points=None):
+    """
+    Reduce a series to at most max_points, keeping the minimum and maximum of each
+    of max_points // 2 equal buckets in their original order.
+
+    Returns:
+        tuple: (kept indices or None when nothing was dropped, kept values)
+    """
+    n = len(values)
+    if not max_points or n <= max_points:
+        return None, values
+    buckets = max(max_points // 2, 1)
+    bucket = np.arange(n) * buckets // n
+    # Sorted by (bucket, value), each bucket's first entry is its minimum and its last its maximum
+    order = np.lexsort((values, bucket))
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    ends = np.append(starts[1:], n) - 1
+    index = np.unique(np.concatenate((order[starts], order[ends])))
+    return index, values[index]
+
+
+def encode_series(values, raw_format='list'):
+    """A series as a number list, or as {'dtype', 'length', 'data'} float32 (base64 text or raw bytes)."""
+    if raw_format == 'list':
+        return values
+    data = np.asarray(values, dtype='<f4').tobytes()
+    return {
+        'dtype': 'float32',
+        'length': len(values),
+        'data': base64.b64encode(data).decode('ascii') if raw_format == 'base64' else data,
+    }
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
@@ -0,0 +1,301 @@
+"""
+Nearest-neighbour search over analysis feature vectors, to find earlier media with
+a similar metric signature (campaigns of generated content tend to cluster) and to
+see which verdicts those neighbours got.
+
+Each analysis with the full metric set of its media type becomes one vector: every
+metric log-scaled against its registry thresholds, so 0 and the low threshold land
+near 0 and the high threshold at 1 whatever the metric's units. Vectors are kept
+in memory as one float32 matrix per media type and searched with a single
+matrix-vector product (squared distance = |x|^2 - 2 x.q + |q|^2). Past
+ivf_threshold vectors, the matrix is partitioned by k-means (IVF) and a query only
+scans the nprobe partitions nearest to it, plus anything added since the last
+partitioning. Vectors are persisted in SQLite (WAL mode) and loaded on first use;
+rows written by other processes are picked up before every search.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from metric_registry import METRICS
+
+
+def feature_vector(media_type: str, metrics: Dict[str, Any]) -> Optional[np.ndarray]:
+    """The metrics as a scaled float32 vector in registry order, or None if any metric is missing."""
+    specs = METRICS.get(media_type)
+    if specs is None or not metrics or any(name not in metrics for name in specs):
+        return None
+    values = np.array([max(float(metrics[name]), 0.0) for name in specs])
+    low = np.array([spec['low_threshold'] for spec in specs.values()], dtype=np.float64)
+    high = np.array([spec['high_threshold'] for spec in specs.values()], dtype=np.float64)
+    return (np.log1p(values / low) / np.log1p(high / low)).astype(np.float32)
+
+
+class _Space:
+    """The vectors of one media type, with an optional IVF partitioning of the first `partitioned` rows."""
+
+    def __init__(self, dim: int):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.sqnorms = np.empty(0, dtype=np.float32)
+        self.alive = np.empty(0, dtype=bool)
+        self.ids: List[str] = []
+        self.verdicts: List[Optional[str]] = []
+        self.created: List[float] = []
+        self.size = 0
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+        self.partitioned = 0
+
+    def extend(self, ids, vectors, verdicts, created):
+        needed = self.size + len(ids)
+        if needed > len(self.vectors):
+            # Grow geometrically so bulk loads and single adds are both amortized O(1)
+            capacity = max(needed, 2 * len(self.vectors), 1024)
+            self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+            self.sqnorms = np.resize(self.sqnorms, capacity)
+            self.alive = np.resize(self.alive, capacity)
+        rows = slice(self.size, needed)
+        self.vectors[rows] = vectors
+        self.sqnorms[rows] = np.einsum('ij,ij->i', vectors, vectors)
+        self.alive[rows] = True
+        self.ids.extend(ids)
+        self.verdicts.extend(verdicts)
+        self.created.extend(created)
+        self.size = needed
+
+    def partition(self, seed=0, iterations=8):
+        """k-means over a sample, then every row assigned to its nearest centroid and grouped by list."""
+        n = self.size
+        nlist = max(int(np.sqrt(n)), 1)
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[rng.choice(n, min(n, 32 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        assignment = np.concatenate([_nearest(self.vectors[start:min(start + 8192, n)], centroids)
+                                     for start in range(0, n, 8192)])
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.searchsorted(assignment[self.order], np.arange(nlist + 1))
+        self.centroids = centroids
+        self.partitioned = n
+
+    def candidates(self, query, nprobe):
+        """Rows worth scoring: the nprobe nearest partitions and the unpartitioned tail, or everything."""
+        if self.centroids is None:
+            return None
+        distances = np.einsum('ij,ij->i', self.centroids, self.centroids) - 2 * self.centroids @ query
+        lists = np.argpartition(distances, nprobe - 1)[:nprobe] if nprobe < len(distances) else range(len(distances))
+        parts = [self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists]
+        parts.append(np.arange(self.partitioned, self.size))
+        return np.concatenate(parts)
+
+
+def _nearest(vectors, centroids):
+    distances = np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2 * vectors @ centroids.T
+    return np.argmin(distances, axis=1)
+
+
+class SimilarityIndex:
+    """
+    Persistent k-nearest-neighbour index over analysis feature vectors (see the module
+    docstring). Exact up to ivf_threshold vectors per media type, IVF-approximate beyond.
+    """
+
+    def __init__(self, path: str = ':memory:', ivf_threshold: int = 100_000, nprobe: int = 16):
+        """
+        Args:
+            path (str): SQLite file to persist to (':memory:' for a process-local index)
+            ivf_threshold (int): Vectors per media type before searches switch to IVF partitions
+            nprobe (int): Partitions scanned per IVF query (more is slower and more exact)
+        """
+        self.path = path
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                media_type TEXT NOT NULL,
+                verdict TEXT,
+                created_at REAL NOT NULL,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self._spaces = {media_type: _Space(len(specs)) for media_type, specs in METRICS.items()}
+        self._positions = {}
+        # Loaded on first use, so a large index doesn't hold up start-up
+        self._last_seq = 0
+
+    @classmethod
+    def from_env(cls) -> Optional['SimilarityIndex']:
+        """
+        Build an index from SIMILARITY_INDEX_PATH, SIMILARITY_IVF_THRESHOLD and
+        SIMILARITY_NPROBE. Returns None when SIMILARITY_INDEX_PATH is set to an empty string.
+        """
+        path = os.getenv('SIMILARITY_INDEX_PATH', 'similarity.db')
+        if not path:
+            return None
+        return cls(path, int(os.getenv('SIMILARITY_IVF_THRESHOLD', 100_000)), int(os.getenv('SIMILARITY_NPROBE', 16)))
+
+    def add(self, analysis_id: str, media_type: str, metrics: Dict[str, Any], verdict: str = None,
+            created_at: float = None) -> bool:
+        """
+        Index one analysis.
+
+        Returns:
+            bool: False when the analysis lacks some of its media type's metrics and was not indexed
+        """
+        return self.add_many([(analysis_id, media_type, metrics, verdict, created_at)]) == 1
+
+    def add_many(self, rows) -> int:
+        """Index (id, media_type, metrics, verdict, created_at) tuples in one transaction; returns how many were indexed."""
+        records = []
+        for analysis_id, media_type, metrics, verdict, created_at in rows:
+            vector = feature_vector(media_type, metrics)
+            if vector is not None:
+                records.append((analysis_id, media_type, verdict, created_at or time.time(), vector.tobytes()))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (id, media_type, verdict, created_at, vector) VALUES (?, ?, ?, ?, ?)",
+                records
+            )
+            self._conn.commit()
+            self._sync()
+        return len(records)
+
+    def remove(self, analysis_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM vectors WHERE id = ?", (analysis_id,))
+            self._conn.commit()
+            self._forget(analysis_id)
+
+    def neighbors(self, analysis_id: str, k: int = 10) -> Optional[Dict[str, Any]]:
+        """
+        The k analyses nearest to an indexed one (itself excluded).
+
+        Returns:
+            dict: {'type', 'neighbors'}, or None when the id is not indexed
+        """
+        with self._lock:
+            self._sync()
+            position = self._positions.get(analysis_id)
+            if position is None:
+                return None
+            media_type, row = position
+            query = self._spaces[media_type].vectors[row].copy()
+        return {'type': media_type, 'neighbors': self.search(media_type, query, k, exclude=analysis_id)}
+
+    def search(self, media_type: str, query: np.ndarray, k: int = 10, exclude: str = None) -> List[Dict[str, Any]]:
+        """
+        The k indexed vectors of a media type nearest to query (a feature_vector),
+        closest first, as {'id', 'distance', 'verdict', 'created_at'}.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            self._sync()
+            space = self._spaces[media_type]
+            if space.size == 0:
+                return []
+            rows = space.candidates(query, self.nprobe)
+            vectors, sqnorms, alive = (space.vectors[:space.size], space.sqnorms[:space.size], space.alive[:space.size])
+            if rows is not None:
+                vectors, sqnorms, alive = vectors[rows], sqnorms[rows], alive[rows]
+            distances = sqnorms - 2 * (vectors @ query) + float(query @ query)
+            distances[~alive] = np.inf
+            # One spare slot, for the excluded query itself
+            top = min(k + 1, len(distances))
+            nearest = np.argpartition(distances, top - 1)[:top]
+            nearest = nearest[np.argsort(distances[nearest])]
+            results = []
+            for i in nearest:
+                row = int(rows[i]) if rows is not None else int(i)
+                if not np.isfinite(distances[i]) or space.ids[row] == exclude:
+                    continue
+                results.append({
+                    'id': space.ids[row],
+                    'distance': float(np.sqrt(max(distances[i], 0.0))),
+                    'verdict': space.verdicts[row],
+                    'created_at': space.created[row],
+                })
+        return results[:k]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            return {
+                media_type: {
+                    'entries': int(space.alive[:space.size].sum()),
+                    'partitions': len(space.centroids) if space.centroids is not None else 0,
+                    'unpartitioned': int(space.alive[space.partitioned:space.size].sum()),
+                }
+                for media_type, space in self._spaces.items()
+            }
+
+    def _sync(self):
+        """Load rows added since the last sync (by this or any other process). Call with the lock held."""
+        rows = self._conn.execute(
+            "SELECT seq, id, media_type, verdict, created_at, vector FROM vectors WHERE seq > ? ORDER BY seq",
+            (self._last_seq,)
+        ).fetchall()
+        if not rows:
+            return
+        self._last_seq = rows[-1][0]
+        by_type = {}
+        for _, analysis_id, media_type, verdict, created_at, vector in rows:
+            if media_type not in self._spaces:
+                continue
+            # A re-indexed id replaces its earlier vector
+            self._forget(analysis_id)
+            batch = by_type.setdefault(media_type, ([], [], [], []))
+            batch[0].append(analysis_id)
+            batch[1].append(vector)
+            batch[2].append(verdict)
+            batch[3].append(created_at)
+        for media_type, (ids, vectors, verdicts, created) in by_type.items():
+            space = self._spaces[media_type]
+            start = space.size
+            space.extend(ids, np.frombuffer(b''.join(vectors), dtype=np.float32).reshape(len(ids), -1), verdicts, created)
+            self._positions.update((analysis_id, (media_type, start + i)) for i, analysis_id in enumerate(ids))
+            # Repartition once the index is big enough, and again whenever the unpartitioned tail reaches a quarter of it
+            if space.size >= self.ivf_threshold and space.size - space.partitioned >= max(space.partitioned // 4, 1):
+                space.partition()
+
+    def _forget(self, analysis_id):
+        position = self._positions.pop(analysis_id, None)
+        if position is not None:
+            media_type, row = position
+            self._spaces[media_type].alive[row] = False
+
+
+def verdict_votes(neighbors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Distance-weighted verdict vote over neighbours (weight 1 / (1 + distance)).
+
+    Returns:
+        dict: {'verdict': the heaviest verdict or None, 'weights': verdict -> share of the vote}
+    """
+    weights = {}
+    for neighbor in neighbors:
+        if neighbor['verdict'] is not None:
+            weights[neighbor['verdict']] = weights.get(neighbor['verdict'], 0.0) + 1.0 / (1.0 + neighbor['distance'])
+    total = sum(weights.values())
+    return {
+        'verdict': max(weights, key=weights.get) if weights else None,
+        'weights': {name: round(weight / total, 3) for name, weight in weights.items()},
+    }
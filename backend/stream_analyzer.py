@@ -0,0 +1,220 @@
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from metric_registry import PRIMITIVES, compute_metrics, metric_record, metric_verdict, required_primitives, validate_metric_names
+
+
+class StreamAnalyzer:
+    """
+    Sliding-window analysis for live or growing video streams.
+    Only the previous sampled frame and the per-frame statistics of the current
+    window are kept, so memory stays bounded however long the stream runs. Window
+    metrics, statuses and verdicts come from metric_registry, as for uploads.
+    """
+
+    def __init__(self, window_seconds=2.0, hop_seconds=1.0, sample_fps=10.0, realtime=False, metrics=None):
+        """
+        Args:
+            window_seconds (float): Length of the window each event summarises
+            hop_seconds (float): Stream time between two emitted events
+            sample_fps (float): Maximum number of frames analysed per second of stream time
+            realtime (bool): Pace event emission to wall-clock time (for replaying files)
+            metrics (iterable, optional): Only compute these video metrics; primitives none of
+                them needs are skipped. Defaults to every video metric.
+        """
+        validate_metric_names(metrics)
+        self.metric_names = set(metrics) if metrics is not None else None
+        self.needed = required_primitives('video', self.metric_names)
+        self.window_seconds = window_seconds
+        self.hop_seconds = hop_seconds
+        self.min_frame_gap = 1.0 / sample_fps if sample_fps else 0
+        self.realtime = realtime
+        self.reset()
+
+    def reset(self):
+        self.window = deque()
+        self.prev_gray = None
+        self.prev_edges = None
+        self.last_sample_time = None
+        self.next_emit_time = None
+        self.last_emit_time = None
+        self.wall_start = None
+        self.stream_start = None
+        self.frames_seen = 0
+        self.frames_analyzed = 0
+
+    def process(self, frames, fps=None):
+        """
+        Consume frames from any iterator and yield window events as they complete.
+
+        Args:
+            frames (iterable): ndarray frames or (timestamp_seconds, ndarray) tuples
+            fps (float, optional): Used to derive timestamps when frames carry none
+
+        Yields:
+            dict: Window metric events
+        """
+        fps = fps or 30.0
+        for index, item in enumerate(frames):
+            if isinstance(item, tuple):
+                timestamp, frame = item
+            else:
+                timestamp, frame = index / fps, item
+
+            event = self.push(frame, timestamp)
+            if event is not None:
+                yield event
+
+        event = self.flush()
+        if event is not None:
+            yield event
+
+    def push(self, frame, timestamp):
+        """
+        Feed a single frame.
+
+        Args:
+            frame (ndarray): BGR or grayscale frame
+            timestamp (float): Stream time of the frame in seconds
+
+        Returns:
+            dict or None: A window event if this frame closed a hop, else None
+        """
+        self.frames_seen += 1
+        if self.stream_start is None:
+            self.stream_start = timestamp
+            self.next_emit_time = timestamp + self.window_seconds
+
+        if self.last_sample_time is not None and timestamp - self.last_sample_time < self.min_frame_gap:
+            return None
+        self.last_sample_time = timestamp
+
+        # The same per-frame primitives MediaAnalyzer computes, limited to what the metrics need
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        edges = cv2.Canny(gray, 100, 200) if 'edge_consistency' in self.needed else None
+        sample = {}
+        if 'texture_variances' in self.needed:
+            sample['texture_variances'] = float(np.var(cv2.Laplacian(gray, cv2.CV_64F)))
+        if self.prev_gray is not None and self.prev_gray.shape == gray.shape:
+            if 'motion_scores' in self.needed:
+                sample['motion_scores'] = float(np.mean(cv2.absdiff(gray, self.prev_gray)))
+            if edges is not None:
+                sample['edge_consistency'] = float(np.mean(cv2.absdiff(edges, self.prev_edges)))
+
+        self.prev_gray = gray
+        self.prev_edges = edges
+        self.frames_analyzed += 1
+
+        self.window.append((timestamp, sample))
+        while self.window and self.window[0][0] < timestamp - self.window_seconds:
+            self.window.popleft()
+
+        if timestamp < self.next_emit_time:
+            return None
+
+        self.next_emit_time += self.hop_seconds
+        while self.next_emit_time <= timestamp:
+            self.next_emit_time += self.hop_seconds
+        return self._emit(timestamp)
+
+    def flush(self):
+        """
+        Emit an event for whatever is left in the window at the end of the stream.
+
+        Returns:
+            dict or None: The final window event, or None if nothing new was seen
+        """
+        if not self.window or self.window[-1][0] == self.last_emit_time:
+            return None
+        return self._emit(self.window[-1][0])
+
+    def _emit(self, timestamp):
+        self.last_emit_time = timestamp
+        if self.realtime:
+            if self.wall_start is None:
+                self.wall_start = time.monotonic() - (timestamp - self.stream_start)
+            delay = self.wall_start + (timestamp - self.stream_start) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        series = {name: [sample[name] for _, sample in self.window if name in sample] for name in PRIMITIVES['video']}
+        metrics = {name: float(value) for name, value in compute_metrics('video', series, self.metric_names).items()}
+        return {
+            'event': 'window',
+            'start': self.window[0][0],
+            'end': timestamp,
+            'frames': len(self.window),
+            'frames_seen': self.frames_seen,
+            'metrics': metrics,
+            'statuses': {name: metric_record('video', metrics, name)['status'] for name in metrics},
+            'verdict': metric_verdict('video', metrics),
+        }
+
+
+def iter_capture_frames(source, follow=False, poll_interval=0.5, idle_timeout=10.0):
+    """
+    Yield (timestamp, frame) pairs from anything cv2.VideoCapture can open:
+    a file path, an RTSP/HTTP URL or a camera index.
+
+    Args:
+        source (str or int): Capture source
+        follow (bool): Keep polling a file that is still being written to
+        poll_interval (float): Seconds to wait before re-checking a growing file
+        idle_timeout (float): Stop following after this many seconds without new frames
+    """
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    index = 0
+    idle_since = None
+
+    try:
+        while True:
+            ret, frame = cap.read()
+            if ret:
+                idle_since = None
+                pos_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+                timestamp = pos_msec / 1000 if pos_msec > 0 else index / fps
+                index += 1
+                yield timestamp, frame
+                continue
+
+            if not follow:
+                break
+
+            # A growing file looks finished to the demuxer; reopen and seek past what we've read
+            idle_since = idle_since or time.monotonic()
+            if time.monotonic() - idle_since > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            cap.release()
+            cap = cv2.VideoCapture(source)
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+    finally:
+        cap.release()
+
+
+def iter_raw_frames(stream, width, height, fps=30.0):
+    """
+    Yield (timestamp, frame) pairs from a raw bgr24 byte stream, e.g. the stdout of
+    `ffmpeg -i <input> -f rawvideo -pix_fmt bgr24 -`.
+
+    Args:
+        stream: Binary file-like object (sys.stdin.buffer, a pipe, a socket file)
+        width (int): Frame width in pixels
+        height (int): Frame height in pixels
+        fps (float): Frame rate used to timestamp frames
+    """
+    frame_size = width * height * 3
+    index = 0
+    while True:
+        data = stream.read(frame_size)
+        if len(data) < frame_size:
+            break
+        yield index / fps, np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+        index += 1
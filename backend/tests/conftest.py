@@ -0,0 +1,117 @@
+"""
+Shared fixtures. The backend modules read their configuration from the
+environment at import time, so every store is pointed at a throwaway directory
+before any test module imports them.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+STATE_DIR = tempfile.mkdtemp(prefix='trueview-tests-')
+os.environ.update({
+    'WARMUP': '0',
+    'BLOB_STORE_DIR': os.path.join(STATE_DIR, 'blobs'),
+    'ANALYSIS_STORE_PATH': os.path.join(STATE_DIR, 'analyses.db'),
+    'SIMILARITY_INDEX_PATH': os.path.join(STATE_DIR, 'similarity.db'),
+    'EXPLANATION_CACHE_PATH': '',
+    'PROFILE_DIR': os.path.join(STATE_DIR, 'profiles'),
+    'GEMINI_API_KEY': 'test',
+    'AIORNOT_API_KEY': 'test',
+})
+os.environ.pop('BROKER_URL', None)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+def write_video(path, frames=40, size=(160, 120), fps=10):
+    """A short MP4 of a moving gradient, so motion and edge metrics have something to measure."""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    x = np.arange(width, dtype=np.uint8)
+    for i in range(frames):
+        frame = np.zeros((height, width, 3), np.uint8)
+        frame[:, :, 1] = np.roll(x * 2, i * 3)[None, :]
+        cv2.rectangle(frame, (10 + i, 20), (50 + i, 70), (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def encode_image(ext='.jpg', size=(120, 160), seed=0):
+    image = np.random.default_rng(seed).integers(0, 255, (*size, 3), dtype=np.uint8)
+    ok, encoded = cv2.imencode(ext, image)
+    assert ok
+    return encoded.tobytes()
+
+
+def upload(api, data, filename, **params):
+    response = api.post('/upload', params=params, files={'file': (filename, data)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def wait_until_complete(api, analysis_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stored = api.get(f'/results/{analysis_id}').json()
+        if not stored.get('pending'):
+            return stored
+        time.sleep(0.05)
+    raise AssertionError(f'{analysis_id} still pending after {timeout}s')
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    return write_video(str(tmp_path / 'clip.mp4'))
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Point every redis.Redis.from_url at one in-process fakeredis server (skips without fakeredis)."""
+    fakeredis = pytest.importorskip('fakeredis')
+    redis = pytest.importorskip('redis')
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url',
+                        classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)))
+    return server
+
+
+@pytest.fixture(scope='session')
+def fakes():
+    """Detector and Gemini stand-ins from the load-test harness."""
+    from loadtest import FakeServices
+    services = FakeServices(detector_latency=0.05, video_detector_latency=0.05, gemini_latency=0.05, jitter=0).start()
+    yield services
+    services.stop()
+
+
+@pytest.fixture(scope='session')
+def api(fakes):
+    """The FastAPI app wired to the fakes, with its background tasks kept running between requests."""
+    import detector
+    from fastapi.testclient import TestClient
+
+    os.environ['GEMINI_API_ENDPOINT'] = fakes.url
+    detector.IMAGE_ENDPOINT = f"{fakes.url}/v2/image/sync"
+    detector.VIDEO_ENDPOINT = f"{fakes.url}/v2/video/sync"
+    cwd = os.getcwd()
+    # The demo media mount is relative to the backend directory
+    os.chdir(BACKEND_DIR)
+    try:
+        import save_file
+    finally:
+        os.chdir(cwd)
+    with TestClient(save_file.app) as client:
+        yield client
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from admission import StageScheduler, QueueFull, parse_weights
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def hold(scheduler, client, lane, order, release, cost=1.0):
+    async with scheduler.slot(client, lane, cost):
+        order.append(client)
+        await release.wait()
+
+
+async def drain(scheduler, jobs, lane='fast'):
+    """Queue jobs behind one running blocker, then let them through one at a time; returns service order."""
+    order, blocker = [], asyncio.Event()
+    first = asyncio.create_task(hold(scheduler, 'blocker', lane, order, blocker))
+    await asyncio.sleep(0)
+    release = asyncio.Event()
+    release.set()
+    tasks = []
+    for client in jobs:
+        tasks.append(asyncio.create_task(hold(scheduler, client, lane, order, release)))
+        await asyncio.sleep(0)
+    blocker.set()
+    await asyncio.gather(first, *tasks)
+    return order[1:]
+
+
+def test_burst_from_one_client_does_not_starve_another():
+    scheduler = StageScheduler('test', concurrency=1)
+    order = run(drain(scheduler, ['a', 'a', 'a', 'a', 'b']))
+    # b's first job finishes (virtually) before a's second, so it is served second
+    assert order.index('b') == 1
+
+
+def test_weights_give_a_client_a_larger_share():
+    scheduler = StageScheduler('test', concurrency=1, client_weights={'heavy': 3.0})
+    order = run(drain(scheduler, ['light'] * 3 + ['heavy'] * 3))
+    assert order[:4].count('heavy') == 3
+
+
+def test_fast_lane_is_served_before_bulk():
+    async def scenario():
+        scheduler = StageScheduler('test', concurrency=1, bulk_concurrency=1)
+        order, blocker, release = [], asyncio.Event(), asyncio.Event()
+        release.set()
+        first = asyncio.create_task(hold(scheduler, 'blocker', 'fast', order, blocker))
+        await asyncio.sleep(0)
+        bulk = asyncio.create_task(hold(scheduler, 'video', 'bulk', order, release))
+        await asyncio.sleep(0)
+        fast = asyncio.create_task(hold(scheduler, 'image', 'fast', order, release))
+        await asyncio.sleep(0)
+        blocker.set()
+        await asyncio.gather(first, bulk, fast)
+        return order[1:]
+
+    assert run(scenario()) == ['image', 'video']
+
+
+def test_full_lane_raises_queue_full_with_retry_after():
+    async def scenario():
+        scheduler = StageScheduler('test', concurrency=1, max_queued=1)
+        order, blocker = [], asyncio.Event()
+        running = asyncio.create_task(hold(scheduler, 'a', 'fast', order, blocker))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold(scheduler, 'b', 'fast', order, blocker))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull) as raised:
+            async with scheduler.slot('c', 'fast'):
+                pass
+        blocker.set()
+        await asyncio.gather(running, queued)
+        return scheduler, raised.value
+
+    scheduler, error = run(scenario())
+    assert error.retry_after >= 1
+    assert scheduler.stats()['lanes']['fast']['rejected'] == 1
+    assert scheduler.stats()['lanes']['fast']['admitted'] == 2
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        scheduler = StageScheduler('test', concurrency=1)
+        order, blocker, release = [], asyncio.Event(), asyncio.Event()
+        release.set()
+        running = asyncio.create_task(hold(scheduler, 'a', 'fast', order, blocker))
+        await asyncio.sleep(0)
+        abandoned = asyncio.create_task(hold(scheduler, 'b', 'fast', order, release))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(scheduler, 'c', 'fast', order, release))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        blocker.set()
+        await asyncio.gather(running, waiting)
+        return scheduler, order
+
+    scheduler, order = run(scenario())
+    assert order == ['a', 'c']
+    lanes = scheduler.stats()['lanes']['fast']
+    assert lanes['queued'] == 0 and lanes['running'] == 0
+
+
+def test_parse_weights():
+    assert parse_weights('a=2, b=0.5,,c=') == {'a': 2.0, 'b': 0.5}
@@ -0,0 +1,123 @@
+import json
+import sqlite3
+
+import pytest
+
+from analysis_store import AnalysisStore, verdict
+
+
+def response(n, ai=False, raw=None):
+    return {
+        'filename': f'{n}.jpg', 'type': 'image', 'ai_detected': ai, 'ai_confidence': 0.9 if ai else 0.1,
+        'is_deepfake': False, 'deepfake_confidence': 0.0,
+        'analysis_result': {'metadata': {'type': 'image'}, 'metrics': {'edge_density': 0.1}, 'raw_data': raw or {}},
+    }
+
+
+@pytest.fixture
+def store():
+    return AnalysisStore(':memory:')
+
+
+def test_round_trip_restores_raw_data(store):
+    analysis_id = store.save(response(1, raw={'series': [1.0, 2.5, 3.0]}), 'hash1')
+    stored = store.get(analysis_id)
+    assert stored['id'] == analysis_id
+    assert list(stored['analysis_result']['raw_data']['series']) == [1.0, 2.5, 3.0]
+    assert verdict(stored) == 'authentic'
+
+
+def test_find_by_hash_returns_the_newest(store):
+    store.save(response(1), 'same', 'older')
+    store.save(response(2), 'same', 'newer')
+    assert store.find_by_hash('same') == 'newer'
+    assert store.find_all_by_hash('same') == ['newer', 'older']
+    assert store.find_by_hash('other') is None
+    assert store.find_by_hash('other') is None
+
+
+def test_cursor_pagination_visits_every_row_once(store):
+    ids = [store.save(response(n, ai=n % 2 == 0), f'h{n}') for n in range(25)]
+    seen, cursor = [], None
+    while True:
+        page = store.list_results(limit=7, cursor=cursor)
+        seen += [item['id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(ids) and len(seen) == len(set(seen))
+    assert seen == [item['id'] for item in store.list_results(limit=100)['items']]
+
+
+def test_listing_filters_by_verdict(store):
+    for n in range(6):
+        store.save(response(n, ai=n < 2), f'h{n}')
+    items = store.list_results(verdict='ai')['items']
+    assert len(items) == 2 and all(item['verdict'] == 'ai' for item in items)
+
+
+@pytest.mark.parametrize('cursor', ['garbage', '12.5', 'abc:def', 'nan:x', ':id'])
+def test_malformed_cursor_is_rejected(store, cursor):
+    with pytest.raises(ValueError):
+        store.list_results(cursor=cursor)
+
+
+def test_update_explanations_clears_the_pending_upgrade(store):
+    analysis_id = store.save(dict(response(1), explanationId='x', explanationSource='local'), 'h')
+    store.update_explanations(analysis_id, {'overview': 'text', 'metrics': [], 'source': 'gemini'})
+    stored = store.get(analysis_id)
+    assert stored['briefOverview'] == 'text'
+    assert stored['explanationSource'] == 'gemini' and stored['explanationId'] is None
+
+
+def test_malformed_cursor_is_a_client_error(api):
+    assert api.get('/results', params={'cursor': 'not-a-cursor'}).status_code == 400
+    assert api.get('/results', params={'limit': 2}).status_code == 200
+
+
+def with_media(n, pending=()):
+    return dict(response(n), path=f'/blobs/upload{n}', previews={'thumbnail': f'/blobs/thumb{n}'}, pending=list(pending))
+
+
+def test_release_media_keeps_the_newest_and_skips_pending(store):
+    store.save(with_media(1), 'h1', 'oldest')
+    store.save(with_media(2, pending=['ai_scan_result']), 'h2', 'pending')
+    store.save(with_media(3), 'h3', 'newest')
+
+    released = store.release_media(keep_latest=1)
+    assert [r['id'] for r in released] == ['oldest']
+    assert released[0]['path'] == '/blobs/upload1'
+    stored = store.get('oldest')
+    assert stored['path'] is None and stored['previews'] is None and stored['media_released'] is True
+    assert store.get('pending')['path'] == '/blobs/upload2'
+    assert store.release_media(keep_latest=1) == []
+    assert [r['id'] for r in store.release_media(older_than=float('inf'))] == ['newest']
+
+
+def test_stores_from_before_retention_are_migrated(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE analyses (id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, created_at REAL NOT NULL, "
+                 "filename TEXT, media_type TEXT, verdict TEXT, ai_confidence REAL, deepfake_confidence REAL, "
+                 "result TEXT NOT NULL, raw_data BLOB)")
+    conn.execute("INSERT INTO analyses (id, content_hash, created_at, result) VALUES ('old', 'h', 1.0, ?)",
+                 (json.dumps(with_media(1)),))
+    conn.commit()
+    conn.close()
+    assert [r['id'] for r in AnalysisStore(path).release_media(older_than=2.0)] == ['old']
+
+
+def test_saving_again_keeps_created_at_and_updates_the_verdict(store):
+    pending = dict(response(1), ai_scan_result=None, pending=['ai_scan_result'])
+    store.save(pending, 'h', 'later')
+    created_at = store.get('later')['created_at']
+    assert store.list_results(verdict='pending')['items'][0]['id'] == 'later'
+
+    store.save(dict(response(1, ai=True), ai_scan_result={'ai_detected': True}, pending=[]), 'h', 'later')
+    assert store.get('later')['created_at'] == created_at
+    assert store.list_results(verdict='pending')['items'] == []
+    assert store.list_results(verdict='ai')['items'][0]['id'] == 'later'
+
+
+def test_a_failed_detector_has_no_verdict():
+    assert verdict(dict(response(1), ai_scan_result=None, pending=[], errors={'ai_scan_result': 'timeout'})) is None
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import time
+
+from analysis_store import AnalysisStore, verdict
+from blob_store import BlobStore
+from tests.conftest import encode_image, upload, wait_until_complete, write_video
+
+DEFAULT_OPTIONS = {'metrics': None, 'roi': None, 'max_dimension': None}
+
+
+def test_image_upload_and_reuse(api):
+    data = encode_image('.jpg', seed=1)
+    first = upload(api, data, 'a.jpg')
+    assert first['pending'] == [] and first['ai_scan_result'] is not None
+    assert first['explanationSource'] == 'gemini'
+    assert api.get(first['path']).content == data
+    assert upload(api, data, 'again.jpg').get('reused') is True
+
+
+def test_media_retention_lets_old_uploads_be_evicted(api, tmp_path, monkeypatch):
+    import save_file
+
+    blobs = BlobStore(str(tmp_path / 'blobs'), quota_bytes=1)
+    store = AnalysisStore(str(tmp_path / 'analyses.db'))
+    monkeypatch.setattr(save_file, 'blob_store', blobs)
+    monkeypatch.setattr(save_file, 'analysis_store', store)
+    monkeypatch.setattr(save_file, 'MEDIA_RETENTION_COUNT', 1)
+    old = blobs.put_bytes(b'old upload', '.jpg', ref=True)
+    thumbnail = blobs.put_bytes(b'old thumbnail', '.webp', ref=True)
+    new = blobs.put_bytes(b'new upload', '.jpg', ref=True)
+    store.save({'path': f'/blobs/{old}', 'previews': {'thumbnail': f'/blobs/{thumbnail}'}, 'pending': []}, old, 'old')
+    time.sleep(0.01)
+    store.save({'path': f'/blobs/{new}', 'previews': None, 'pending': []}, new, 'new')
+
+    assert asyncio.run(save_file.apply_media_retention()) == 1
+    assert blobs.get(old) is None and blobs.get(thumbnail) is None
+    assert blobs.get(new)['refcount'] == 1
+    assert store.get('old')['media_released'] is True
+    assert asyncio.run(save_file.apply_media_retention()) == 0
+
+
+def test_trace_endpoints_are_off_by_default(api):
+    response = api.get('/queues', headers={'X-Debug-Profile': '1'})
+    trace_id = response.headers['X-Trace-Id']
+    assert api.get('/traces').status_code == 404
+    assert api.get(f'/traces/{trace_id}').status_code == 404
+    assert api.get(f'/traces/{trace_id}/profile').status_code == 404
+
+
+def test_exposed_traces_record_the_upload_stages(api, monkeypatch):
+    import tracing
+
+    monkeypatch.setattr(tracing, 'EXPOSE_TRACES', True)
+    response = api.post('/upload', files={'file': ('t.jpg', encode_image('.jpg', seed=8))})
+    trace = api.get(f"/traces/{response.headers['X-Trace-Id']}").json()
+    assert trace['name'] == 'POST /upload'
+    names = {span['name'] for span in trace['spans']}
+    assert {'probe', 'ingest'} <= names
+
+
+def test_deadline_answers_with_pending_sections_completed_later(api, fakes, tmp_path):
+    data = open(write_video(str(tmp_path / 'slow.mp4')), 'rb').read()
+    fakes.latency['video'] = 1.0
+    try:
+        first = upload(api, data, 'slow.mp4', deadline=0.5)
+    finally:
+        fakes.latency['video'] = 0.05
+    assert 'ai_scan_result' in first['pending'] and first['ai_scan_result'] is None
+    created_at = api.get(f"/results/{first['id']}").json()['created_at']
+    completed = wait_until_complete(api, first['id'])
+    assert completed['id'] == first['id']
+    assert completed['ai_scan_result'] is not None and 'errors' not in completed
+    # The pending row had no verdict yet; the completed one is listed under the detector's
+    listed = api.get('/results', params={'content_hash': first['content_hash']}).json()['items'][0]
+    assert listed['verdict'] == verdict(completed) != 'pending'
+    assert listed['created_at'] == completed['created_at'] == created_at
+
+
+def with_partial_analysis(response, analysis_id):
+    analysis = response['analysis_result']
+    metadata = dict(analysis['metadata'], partial={'reason': 'deadline', 'frames_sampled': 2, 'frames_planned': 10})
+    return dict(response, id=analysis_id, reused=None, analysis_result=dict(analysis, metadata=metadata))
+
+
+def test_pending_response_is_not_reused(api):
+    import save_file
+
+    data = encode_image('.jpg', seed=6)
+    content_hash = hashlib.sha256(data).hexdigest()
+    complete = upload(api, data, 'full.jpg')
+    pending = dict(complete, id='pending-analysis', reused=None, ai_scan_result=None, pending=['ai_scan_result'])
+    asyncio.run(save_file.save_response(pending, content_hash, persisted=False, final=False))
+
+    # The newer pending row is passed over for the complete one
+    assert asyncio.run(save_file.find_previous_analysis(content_hash, DEFAULT_OPTIONS))['id'] == complete['id']
+    assert save_file.similarity_index.neighbors('pending-analysis') is None
+
+
+def test_partial_analysis_is_neither_reused_nor_indexed(api):
+    import save_file
+
+    data = encode_image('.jpg', seed=2)
+    content_hash = hashlib.sha256(data).hexdigest()
+    complete = upload(api, data, 'full.jpg')
+    asyncio.run(save_file.save_response(with_partial_analysis(complete, 'partial-analysis'), content_hash, persisted=False))
+
+    assert asyncio.run(save_file.find_previous_analysis(content_hash, DEFAULT_OPTIONS))['id'] == complete['id']
+    assert save_file.similarity_index.neighbors('partial-analysis') is None
+    assert save_file.similarity_index.neighbors(complete['id']) is not None
+    again = upload(api, data, 'again.jpg')
+    assert again['reused'] is True and again['id'] == complete['id']
+    assert 'partial' not in again['analysis_result']['metadata']
+
+
+def test_invalid_deadline_is_rejected(api):
+    data = encode_image('.jpg', seed=3)
+    assert api.post('/upload', params={'deadline': -1}, files={'file': ('a.jpg', data)}).status_code == 400
+    assert api.post('/upload', headers={'X-Deadline': 'soon'}, files={'file': ('a.jpg', data)}).status_code == 400
+
+
+def test_failed_detector_is_reported_under_errors(api, monkeypatch):
+    import save_file
+
+    def unreachable(*args):
+        raise ConnectionError('detector unreachable')
+
+    monkeypatch.setattr(save_file, 'scan', unreachable)
+    response = upload(api, encode_image('.jpg', seed=9), 'e.jpg')
+    assert response['errors'] == {'ai_scan_result': 'detector unreachable'}
+    assert response['pending'] == [] and response['analysis_result'] is not None
+    stored = api.get(f"/results/{response['id']}").json()
+    assert stored['errors'] == response['errors']
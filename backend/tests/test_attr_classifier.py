@@ -0,0 +1,35 @@
+import time
+
+from attrClassifier import MediaAnalyzer, coarse_to_fine
+
+
+def test_coarse_to_fine_visits_every_position_once():
+    positions = list(range(100, 111))
+    order = coarse_to_fine(positions)
+    assert sorted(order) == positions
+    assert order[:3] == [100, 110, 105]
+    assert coarse_to_fine([4, 7]) == [4, 7]
+
+
+def test_every_prefix_spans_the_range():
+    order = coarse_to_fine(range(33))
+    for n in range(3, len(order) + 1):
+        prefix = sorted(order[:n])
+        # No gap in a prefix is much wider than an even spread would leave
+        assert max(b - a for a, b in zip(prefix, prefix[1:])) <= 2 * 32 / (n - 1) + 1
+
+
+def test_video_without_deadline_samples_every_planned_frame(video_path):
+    result = MediaAnalyzer(sample_frames=8).analyze_video(video_path)
+    assert 'partial' not in result['metadata']
+    assert len(result['raw_data']['motion_scores']) == 7
+
+
+def test_expired_deadline_returns_a_partial_analysis(video_path):
+    analyzer = MediaAnalyzer(sample_frames=8, deadline=time.time() - 1)
+    result = analyzer.analyze_video(video_path)
+    partial = result['metadata']['partial']
+    assert partial == {'reason': 'deadline', 'frames_sampled': 2, 'frames_planned': 8}
+    # The two frames are the ends of the clip, kept in time order
+    assert analyzer.frame_indices == sorted(analyzer.frame_indices)
+    assert analyzer.frame_indices[0] == 0 and analyzer.frame_indices[-1] > 30
@@ -0,0 +1,105 @@
+import io
+import os
+import threading
+import time
+
+from blob_store import BlobStore
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    first = store.put_bytes(b'same bytes', '.jpg')
+    second = store.put_file(io.BytesIO(b'same bytes'), '.jpg')
+    assert first == second
+    assert store.stats()['blobs'] == 1
+    with open(store.path(first, '.jpg'), 'rb') as f:
+        assert f.read() == b'same bytes'
+
+
+def test_refcount_never_goes_negative(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest = store.put_bytes(b'data')
+    store.incref(digest)
+    store.decref(digest)
+    store.decref(digest)
+    assert store.get(digest)['refcount'] == 0
+
+
+def test_quota_evicts_unreferenced_blobs_least_recently_used_first(tmp_path):
+    store = BlobStore(str(tmp_path), quota_bytes=250)
+    old = store.put_bytes(b'a' * 100)
+    time.sleep(0.01)
+    recent = store.put_bytes(b'b' * 100)
+    time.sleep(0.01)
+    newest = store.put_bytes(b'c' * 100)
+    assert store.get(old) is None
+    assert not os.path.exists(store.path(old))
+    assert store.get(recent) is not None and store.get(newest) is not None
+
+
+def test_quota_never_evicts_referenced_blobs(tmp_path):
+    store = BlobStore(str(tmp_path), quota_bytes=150)
+    held = store.put_bytes(b'a' * 100)
+    store.incref(held)
+    other = store.put_bytes(b'b' * 100)
+    store.incref(other)
+    store.put_bytes(b'c' * 100)
+
+    assert store.get(held) is not None and store.get(other) is not None
+    assert os.path.exists(store.path(held))
+    stats = store.stats()
+    assert stats['over_quota_bytes'] == stats['bytes'] - 150 > 0
+
+    store.decref(held)
+    store.evict()
+    assert store.get(held) is None
+    assert store.get(other) is not None
+
+
+def test_max_age_only_removes_unreferenced_blobs(tmp_path):
+    store = BlobStore(str(tmp_path), max_age_seconds=0.01)
+    held = store.put_bytes(b'held')
+    store.incref(held)
+    loose = store.put_bytes(b'loose')
+    time.sleep(0.05)
+    assert store.evict() == 1
+    assert store.get(held) is not None
+    assert store.get(loose) is None
+
+
+def test_put_with_ref_takes_the_reference_with_the_write(tmp_path):
+    store = BlobStore(str(tmp_path), quota_bytes=1)
+    digest = store.put_bytes(b'shared', '.jpg')
+    assert store.get(digest)['refcount'] == 0
+    assert store.put_file(io.BytesIO(b'shared'), '.jpg', ref=True) == digest
+    store.put_bytes(b'other')
+    assert store.get(digest)['refcount'] == 1
+    assert os.path.exists(store.path(digest, '.jpg'))
+
+
+def test_concurrent_puts_with_ref_survive_eviction(tmp_path):
+    store = BlobStore(str(tmp_path), quota_bytes=1)
+    stop = threading.Event()
+
+    def evict_continuously():
+        while not stop.is_set():
+            store.evict()
+
+    evictor = threading.Thread(target=evict_continuously)
+    evictor.start()
+    try:
+        digests = [store.put_bytes(b'upload %d' % (i % 4), '.jpg', ref=True) for i in range(40)]
+    finally:
+        stop.set()
+        evictor.join()
+    for digest in set(digests):
+        assert store.get(digest)['refcount'] == 10
+        assert os.path.exists(store.path(digest, '.jpg'))
+
+
+def test_decref_releases_several_blobs_at_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    first = store.put_bytes(b'first', ref=True)
+    second = store.put_bytes(b'second', ref=True)
+    store.decref(first, second)
+    assert store.get(first)['refcount'] == store.get(second)['refcount'] == 0
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from broker import Broker, SQLiteBroker, RedisBroker
+import worker
+
+
+def test_broker_is_abstract():
+    with pytest.raises(TypeError):
+        Broker()
+
+
+@pytest.fixture
+def sqlite_broker(tmp_path):
+    return SQLiteBroker(str(tmp_path / 'broker.db'), lease_seconds=0.05, max_attempts=2)
+
+
+@pytest.fixture
+def redis_broker(fake_redis):
+    return RedisBroker('redis://test', lease_seconds=0.05, max_attempts=2)
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def broker(request):
+    return request.getfixturevalue(f'{request.param}_broker')
+
+
+def test_jobs_are_claimed_oldest_first_and_once(broker):
+    first = broker.enqueue('analysis', {'n': 1})
+    second = broker.enqueue('analysis', {'n': 2})
+    assert broker.depth('analysis') == 2
+    assert broker.claim('analysis', 'w1') == (first, {'n': 1})
+    assert broker.claim('analysis', 'w2') == (second, {'n': 2})
+    assert broker.claim('analysis', 'w3') is None
+    assert broker.status(first)['state'] == 'running'
+
+
+def test_complete_and_fail_are_reported(broker):
+    done = broker.enqueue('analysis', {})
+    failed = broker.enqueue('analysis', {})
+    broker.claim('analysis', 'w')
+    broker.claim('analysis', 'w')
+    broker.complete(done, {'ok': True})
+    broker.fail(failed, 'bad input', 400)
+    assert broker.status(done)['state'] == 'done' and broker.status(done)['result'] == {'ok': True}
+    assert broker.status(failed)['state'] == 'failed' and broker.status(failed)['status_code'] == 400
+    assert broker.status('unknown') is None
+
+
+def test_expired_lease_is_requeued_then_failed(broker):
+    job = broker.enqueue('analysis', {'n': 1})
+    assert broker.claim('analysis', 'dead-worker')[0] == job
+    time.sleep(0.1)
+    assert broker.claim('analysis', 'w2')[0] == job
+    assert broker.status(job)['attempts'] == 2
+    # Requeued, not failed: no failure status yet
+    assert broker.status(job)['status_code'] is None
+    time.sleep(0.1)
+    assert broker.claim('analysis', 'w3') is None
+    status = broker.status(job)
+    assert status['state'] == 'failed' and status['error'] == 'Worker lease expired'
+
+
+def test_requeued_job_goes_before_newer_ones(broker):
+    old = broker.enqueue('analysis', {'n': 1})
+    broker.claim('analysis', 'dead-worker')
+    newer = broker.enqueue('analysis', {'n': 2})
+    time.sleep(0.1)
+    assert broker.claim('analysis', 'w2')[0] == old
+    assert broker.claim('analysis', 'w3')[0] == newer
+
+
+def test_wait_returns_final_status(sqlite_broker):
+    job = sqlite_broker.enqueue('analysis', {})
+    sqlite_broker.claim('analysis', 'w')
+    assert asyncio.run(sqlite_broker.wait(job, timeout=0.05)) is None
+    sqlite_broker.complete(job, {'ok': True})
+    assert asyncio.run(sqlite_broker.wait(job, timeout=1))['state'] == 'done'
+
+
+def test_renewed_lease_is_not_handed_out_again(broker):
+    job = broker.enqueue('analysis', {})
+    broker.claim('analysis', 'w1')
+    for _ in range(4):
+        time.sleep(0.03)
+        assert broker.renew(job, 'w1')
+    assert broker.claim('analysis', 'w2') is None
+    assert not broker.renew(job, 'w2')
+    time.sleep(0.1)
+    assert broker.claim('analysis', 'w2')[0] == job
+    assert not broker.renew(job, 'w1')
+
+
+def test_worker_keeps_the_lease_of_a_long_job(broker, monkeypatch):
+    def slow_job(payload, blob_store):
+        time.sleep(0.3)
+        return {'ok': True}
+
+    monkeypatch.setattr(worker, 'run_analysis_job', slow_job)
+    job = broker.enqueue('analysis', {})
+    stop = threading.Event()
+    thread = threading.Thread(target=worker.run_worker, args=(broker, None), kwargs={'stop': stop, 'worker_id': 'w1'})
+    thread.start()
+    try:
+        time.sleep(0.1)
+        assert broker.status(job)['state'] == 'running'
+        time.sleep(0.1)
+        # Past two lease periods, but renewed, so nobody else gets it
+        assert broker.claim('analysis', 'w2') is None
+        status = asyncio.run(broker.wait(job, timeout=2))
+    finally:
+        stop.set()
+        thread.join()
+    assert status['state'] == 'done' and status['attempts'] == 1
@@ -0,0 +1,29 @@
+import hashlib
+import io
+
+from detector import MultipartFile
+from tests.conftest import encode_image
+
+
+def test_multipart_body_streams_in_chunks():
+    content = bytes(range(256)) * 40
+    body = MultipartFile('video', 'clip.mp4', io.BytesIO(content))
+    chunks = []
+    while True:
+        chunk = body.read(1000)
+        if not chunk:
+            break
+        assert len(chunk) <= 1000
+        chunks.append(chunk)
+    data = b''.join(chunks)
+    assert len(data) == len(body)
+    boundary = body.content_type.split('boundary=')[1]
+    assert data.startswith(f'--{boundary}\r\n'.encode()) and data.endswith(f'\r\n--{boundary}--\r\n'.encode())
+    assert b'filename="clip.mp4"' in data and content in data
+
+
+def test_in_memory_upload_hash_matches_the_bytes(api):
+    import save_file
+
+    data = encode_image('.png', seed=9)
+    assert save_file.read_and_hash(io.BytesIO(data)) == (data, hashlib.sha256(data).hexdigest())
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pytest
+
+from explainability import ExplainabilityEngine
+
+RESULTS = {
+    'metadata': {'type': 'image', 'width': 640, 'height': 480},
+    'metrics': {'avg_texture_variance': 120.0, 'edge_density': 0.05, 'color_variance': 5000.0},
+}
+
+
+class ScriptedEngine(ExplainabilityEngine):
+    """An engine whose Gemini calls return scripted texts: the batch reply first, then per-metric replies."""
+
+    def __init__(self, batch_reply):
+        super().__init__(api_key='test', deadline=0)
+        self.prompts = []
+        self.batch_reply = batch_reply
+
+    def _generate(self, prompt, generation_config=None):
+        self.prompts.append(prompt)
+        if generation_config is not None:
+            return self.batch_reply
+        return f'single answer {len(self.prompts)}'
+
+    async def _generate_async(self, prompt, generation_config=None):
+        return self._generate(prompt, generation_config)
+
+
+def batch(metrics, overview='Overall text.'):
+    return json.dumps({'overview': overview, 'metrics': [{'metric_name': n, 'analysis': f'{n} text'} for n in metrics]})
+
+
+def explain(engine, use_async):
+    if use_async:
+        return asyncio.run(engine.explain_all_metrics_async(RESULTS))
+    return engine.explain_all_metrics(RESULTS)
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_one_call_explains_every_metric_and_the_overview(use_async):
+    engine = ScriptedEngine(batch(RESULTS['metrics']))
+    explanations = explain(engine, use_async)
+    assert len(engine.prompts) == 1
+    assert explanations['overview'] == 'Overall text.' and explanations['source'] == 'gemini'
+    assert [r['analysis'] for r in explanations['metrics']] == [f'{n} text' for n in RESULTS['metrics']]
+    assert [r['status'] for r in explanations['metrics']] == ['suspicious_low', 'normal', 'normal']
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_missing_or_malformed_entries_fall_back_per_metric(use_async):
+    reply = json.loads(batch(['edge_density']))
+    reply['metrics'] += [{'metric_name': 'color_variance', 'analysis': '   '}, 'not an entry']
+    engine = ScriptedEngine(json.dumps(reply))
+    explanations = explain(engine, use_async)
+    # The batch, then one call each for the two metrics it did not answer
+    assert len(engine.prompts) == 3
+    analyses = {r['metric_name']: r['analysis'] for r in explanations['metrics']}
+    assert analyses['edge_density'] == 'edge_density text'
+    assert analyses['avg_texture_variance'].startswith('single answer')
+    assert analyses['color_variance'].startswith('single answer')
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+@pytest.mark.parametrize('reply', ['["a", "list"]', '"text"', '42', 'null', '{"metrics": "none"}', 'not json'])
+def test_a_reply_that_is_not_a_batch_falls_back(reply, use_async):
+    engine = ScriptedEngine(reply)
+    explanations = explain(engine, use_async)
+    assert all(r['analysis'].startswith('single answer') for r in explanations['metrics'])
+    assert explanations['overview'].startswith('single answer')
+    assert explanations['source'] == 'gemini'
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from explanation_cache import ExplanationCache, RedisExplanationCache
+
+
+@pytest.fixture
+def sqlite_cache():
+    return ExplanationCache(':memory:', granularity=0.1, max_entries=2, prune_interval=1)
+
+
+@pytest.fixture
+def redis_cache(fake_redis):
+    return RedisExplanationCache('redis://test', granularity=0.1)
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def cache(request):
+    return request.getfixturevalue(f'{request.param}_cache')
+
+
+def test_close_values_share_a_bucket(sqlite_cache):
+    assert sqlite_cache.bucket(100.0) == sqlite_cache.bucket(101.0)
+    assert sqlite_cache.bucket(100.0) != sqlite_cache.bucket(130.0)
+    assert sqlite_cache.bucket(-100.0) != sqlite_cache.bucket(100.0)
+    assert sqlite_cache.bucket(0) == '0.0'
+
+
+def test_keys_include_status_and_ignore_metric_order(sqlite_cache):
+    key = sqlite_cache.metric_key('image', 'edge_density', 'normal', 0.05)
+    assert key == sqlite_cache.metric_key('image', 'edge_density', 'normal', 0.0502)
+    assert key != sqlite_cache.metric_key('image', 'edge_density', 'suspicious_low', 0.05)
+    assert key != sqlite_cache.metric_key('video', 'edge_density', 'normal', 0.05)
+    assert (sqlite_cache.overall_key('image', {'a': 1.0, 'b': 2.0}, {'a': 'normal'})
+            == sqlite_cache.overall_key('image', {'b': 2.0, 'a': 1.0}, {'a': 'normal'}))
+
+
+def test_round_trip_and_stats(cache):
+    assert cache.get('k') is None
+    cache.set('k', 'text')
+    assert cache.get('k') == 'text'
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 1, 0.5)
+    assert stats['granularity'] == 0.1
+
+
+def test_expired_entries_are_misses():
+    cache = ExplanationCache(':memory:', ttl_seconds=0.05)
+    cache.set('k', 'text')
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_pruned(sqlite_cache):
+    sqlite_cache.set('a', '1')
+    sqlite_cache.set('b', '2')
+    sqlite_cache.get('a')
+    sqlite_cache.set('c', '3')
+    assert sqlite_cache.get('b') is None
+    assert (sqlite_cache.get('a'), sqlite_cache.get('c')) == ('1', '3')
+
+
+def test_redis_cache_sets_a_ttl(redis_cache):
+    import redis
+
+    redis_cache.set('k', 'text')
+    client = redis.Redis.from_url('redis://test')
+    assert 0 < client.ttl(redis_cache.prefix + 'k') <= 30 * 24 * 3600
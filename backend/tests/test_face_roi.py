@@ -0,0 +1,70 @@
+import numpy as np
+
+from face_roi import FaceTracker, _iou
+from tests.conftest import encode_image, upload
+
+
+class ScriptedTracker(FaceTracker):
+    """A tracker whose detector returns scripted boxes, one list per detection round."""
+
+    def __init__(self, rounds, **kwargs):
+        super().__init__(**kwargs)
+        self.rounds = list(rounds)
+
+    def _detect(self, frame):
+        return self.rounds.pop(0)
+
+
+FRAME = np.zeros((240, 320), np.uint8)
+
+
+def test_iou():
+    assert _iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1
+    assert _iou((0, 0, 10, 10), (20, 20, 10, 10)) == 0
+    assert _iou((0, 0, 10, 10), (5, 0, 10, 10)) == 50 / 150
+
+
+def test_first_detection_takes_the_largest_face():
+    tracker = ScriptedTracker([[(0, 0, 20, 20), (100, 100, 60, 60)]])
+    assert tracker.update(FRAME) == (100, 100, 60, 60)
+
+
+def test_overlapping_detection_is_smoothed_and_a_jump_is_followed():
+    tracker = ScriptedTracker([[(100, 100, 60, 60)], [(110, 100, 60, 60), (0, 0, 10, 10)], [(10, 10, 80, 80)]],
+                              detect_every=1)
+    tracker.update(FRAME)
+    # The box moves halfway toward the overlapping detection, not onto it
+    assert tracker.update(FRAME) == (105, 100, 60, 60)
+    # No overlap left: start over from the largest face
+    assert tracker.update(FRAME) == (10, 10, 80, 80)
+
+
+def test_box_is_reused_between_detections_and_dropped_after_misses():
+    tracker = ScriptedTracker([[(100, 100, 60, 60)], [], [], []], detect_every=2, max_misses=1)
+    boxes = [tracker.update(FRAME) for _ in range(6)]
+    assert boxes[:4] == [(100, 100, 60, 60)] * 4
+    assert boxes[4:] == [None, None]
+    assert tracker.stats() == {'type': 'face', 'frames': 6, 'frames_with_face': 4, 'detections_run': 4}
+
+
+def test_crop_is_padded_clipped_and_resized():
+    image = np.arange(240 * 320, dtype=np.uint32).reshape(240, 320).astype(np.uint8)
+    tracker = FaceTracker(crop_size=64)
+    assert tracker.crop(image, (0, 0, 100, 100)).shape == (64, 64)
+
+
+def test_face_roi_upload_is_not_reused_for_the_whole_frame(api):
+    data = encode_image('.jpg', seed=7)
+    face = upload(api, data, 'face.jpg', roi='face')
+    assert face['options'] == {'metrics': None, 'roi': 'face', 'max_dimension': None}
+    assert face['analysis_result']['metadata']['roi']['type'] == 'face'
+    whole = upload(api, data, 'whole.jpg')
+    assert whole.get('reused') is not True and 'roi' not in whole['analysis_result']['metadata']
+    # Each finds the stored analysis made with its own options
+    assert upload(api, data, 'again.jpg', roi='face')['id'] == face['id']
+    assert upload(api, data, 'again.jpg')['id'] == whole['id']
+
+
+def test_unknown_roi_is_rejected(api):
+    response = api.post('/upload', params={'roi': 'body'}, files={'file': ('a.jpg', encode_image('.jpg'))})
+    assert response.status_code == 400
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from explainability import combined_source
+from local_explainer import LocalExplainer, METRIC_TEMPLATES
+from metric_registry import METRICS
+
+NORMAL_IMAGE = {'avg_texture_variance': 400.0, 'texture_std': 500.0, 'edge_density': 0.05,
+                'color_variance': 5000.0, 'edge_continuity': 40.0}
+
+
+def image(**metrics):
+    return {'metadata': {'type': 'image', 'width': 640, 'height': 480}, 'metrics': dict(NORMAL_IMAGE, **metrics)}
+
+
+@pytest.mark.parametrize('media_type', ['video', 'image'])
+def test_every_metric_has_a_template_per_status(media_type):
+    assert set(METRIC_TEMPLATES[media_type]) == set(METRICS[media_type])
+    for templates in METRIC_TEMPLATES[media_type].values():
+        assert set(templates) == {'normal', 'suspicious_low', 'suspicious_high'}
+
+
+def test_metric_text_follows_its_status():
+    record = LocalExplainer().explain_individual_metric(image(edge_density=0.5), 'edge_density')
+    assert record['status'] == 'suspicious_high' and record['source'] == 'local'
+    assert record['analysis'] == METRIC_TEMPLATES['image']['edge_density']['suspicious_high']
+    assert 'error' in LocalExplainer().explain_individual_metric(image(), 'avg_motion')
+
+
+@pytest.mark.parametrize('metrics, opening', [
+    ({}, 'looks likely to be authentic'),
+    ({'edge_density': 0.5}, 'shows mixed signals'),
+    ({'edge_density': 0.5, 'color_variance': 10.0, 'edge_continuity': 500.0}, 'traits typical of AI generation'),
+])
+def test_overview_states_the_verdict_and_the_reasons(metrics, opening):
+    lines = LocalExplainer().explain_overall_analysis(image(**metrics)).splitlines()
+    assert opening in lines[0]
+    assert 2 <= len(lines) <= 5 and all(line.startswith('- ') for line in lines)
+    if 'edge_density' in metrics:
+        assert any('Edge Density is unusually high (0.5, expected 0.03-0.10)' in line for line in lines)
+
+
+def test_all_metrics_sync_and_async_agree():
+    explainer = LocalExplainer()
+    explanations = explainer.explain_all_metrics(image(), include_overview=False)
+    assert explanations['overview'] is None and explanations['source'] == 'local'
+    assert [r['metric_name'] for r in explanations['metrics']] == list(NORMAL_IMAGE)
+    assert asyncio.run(explainer.explain_all_metrics_async(image(), include_overview=False, deadline=1)) == explanations
+
+
+def test_combined_source():
+    assert combined_source([{'source': 'gemini'}, {'source': 'gemini'}], 'gemini') == 'gemini'
+    assert combined_source([{'source': 'gemini'}], 'local') == 'mixed'
+    assert combined_source([{'error': 'unknown'}]) == 'local'
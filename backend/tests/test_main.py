@@ -0,0 +1,38 @@
+import json
+
+import main
+from tests.conftest import encode_image
+
+
+def test_checkpoint_keeps_ok_records_and_truncates_a_cut_off_line(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    output.write_text(
+        json.dumps({'path': 'a.jpg', 'status': 'ok', 'size': 10, 'mtime': 1.5}) + '\n'
+        + json.dumps({'path': 'b.jpg', 'status': 'error', 'stage': 'probe'}) + '\n'
+        + '{"path": "c.jpg", "sta'
+    )
+    assert main.load_checkpoint(str(output)) == {'a.jpg': (10, 1.5)}
+    assert output.read_text().endswith('"probe"}\n')
+    assert main.load_checkpoint(str(tmp_path / 'missing.jsonl')) == {}
+
+
+def test_resume_skips_files_already_done(tmp_path, capsys):
+    media = tmp_path / 'media'
+    media.mkdir()
+    (media / 'one.png').write_bytes(encode_image('.png', seed=1))
+    (media / 'notes.txt').write_text('not media')
+    output = tmp_path / 'results.jsonl'
+    args = [str(media), '--output', str(output), '--no-detector', '--no-explain', '--workers', '1', '--quiet']
+
+    main.main(args)
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [(r['path'], r['status']) for r in records] == [(str(media / 'one.png'), 'ok')]
+    assert records[0]['analysis_result']['metrics']
+
+    # An interrupted run left half a line; the resumed run cuts it off and only adds the new file
+    with open(output, 'a') as f:
+        f.write('{"path": "cut')
+    (media / 'two.png').write_bytes(encode_image('.png', seed=2))
+    main.main(args + ['--resume'])
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r['path'] for r in records] == [str(media / 'one.png'), str(media / 'two.png')]
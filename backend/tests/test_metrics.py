@@ -0,0 +1,8 @@
+from tests.conftest import encode_image, upload
+
+
+def test_metrics_endpoint_reports_stage_latencies(api):
+    upload(api, encode_image('.jpg', seed=5), 'm.jpg')
+    text = api.get('/metrics').text
+    assert 'trueview_http_request_seconds_bucket' in text
+    assert 'trueview_queue_admitted_total' in text
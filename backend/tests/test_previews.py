@@ -0,0 +1,64 @@
+from collections import Counter
+
+import cv2
+import numpy as np
+
+import previews
+from attrClassifier import MediaAnalyzer
+from blob_store import BlobStore
+from pipeline import store_previews
+from tests.conftest import encode_image, upload
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_fit_bounds_the_longer_side_and_never_upscales():
+    image = np.zeros((600, 1200, 3), np.uint8)
+    assert previews.fit(image, 300).shape[:2] == (150, 300)
+    assert previews.fit(image, 2000) is image
+
+
+def test_clip_needs_two_frames_and_one_size():
+    frames = [np.full((90, 160, 3), i * 40, np.uint8) for i in range(3)]
+    frames[1] = np.zeros((91, 160, 3), np.uint8)
+    assert previews.encode_clip(frames[:1]) is None
+    clip = previews.encode_clip(frames)
+    assert clip[:4] == b'RIFF' and clip[8:12] == b'WEBP'
+
+
+def test_image_previews_are_bounded_webp():
+    analyzer = MediaAnalyzer(keep_previews=True)
+    analyzer.analyze_image_buffer(encode_image('.png', size=(1200, 1600)))
+    encoded = analyzer.build_previews()
+    assert set(encoded) == {'thumbnail', 'poster'}
+    assert max(decode(encoded['thumbnail']).shape[:2]) == previews.THUMBNAIL_SIZE
+    assert max(decode(encoded['poster']).shape[:2]) == previews.POSTER_SIZE
+
+
+def test_video_previews_include_a_clip_unless_disabled(video_path):
+    analyzer = MediaAnalyzer(keep_previews=True, sample_frames=4)
+    analyzer.analyze_video(video_path)
+    assert set(analyzer.build_previews()) == {'thumbnail', 'poster', 'clip'}
+    assert 'clip' not in analyzer.build_previews(clip=False)
+    assert MediaAnalyzer(sample_frames=4).build_previews() is None
+
+
+def test_stored_previews_are_referenced(video_path, tmp_path):
+    store = BlobStore(str(tmp_path))
+    analyzer = MediaAnalyzer(keep_previews=True, sample_frames=4)
+    analyzer.analyze_video(video_path)
+    paths = store_previews(analyzer, store)
+    assert set(paths) == {'thumbnail', 'poster', 'clip'}
+    # A small clip's thumbnail and poster are the same bytes, stored once with a reference each
+    digests = Counter(path.rsplit('/', 1)[-1] for path in paths.values())
+    for digest, count in digests.items():
+        assert store.get(digest)['refcount'] == count
+
+
+def test_upload_serves_its_previews(api):
+    response = upload(api, encode_image('.jpg', seed=7), 'p.jpg')
+    thumbnail = api.get(response['previews']['thumbnail'])
+    assert thumbnail.status_code == 200
+    assert decode(thumbnail.content) is not None
@@ -0,0 +1,93 @@
+import struct
+import zlib
+
+import pytest
+
+from probe import probe_media, ProbeError, HEAD_BYTES
+from tests.conftest import encode_image, upload, write_video
+
+
+def app_segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def test_jpeg_dimensions():
+    info = probe_media(encode_image('.jpg', size=(120, 160)))
+    assert (info['type'], info['format'], info['width'], info['height']) == ('image', 'jpeg', 160, 120)
+    assert info['codec'] == 'baseline' and not info['has_exif']
+
+
+def test_jpeg_with_app_segments_past_the_head_buffer(tmp_path):
+    import cv2
+
+    jpeg = encode_image('.jpg', size=(120, 160))
+    icc = app_segment(0xE2, b'ICC_PROFILE\x00' + bytes(60_000))
+    exif = app_segment(0xE1, b'Exif\x00\x00' + bytes(100))
+    data = jpeg[:2] + icc + icc + exif + jpeg[2:]
+    assert data.find(b'\xff\xc0') > HEAD_BYTES
+
+    info = probe_media(data)
+    assert (info['width'], info['height']) == (160, 120)
+    assert info['has_exif']
+    path = tmp_path / 'big.jpg'
+    path.write_bytes(data)
+    assert cv2.imread(str(path)).shape == (120, 160, 3)
+
+
+def test_jpeg_without_frame_header_is_rejected():
+    with pytest.raises(ProbeError, match='dimensions'):
+        probe_media(b'\xff\xd8' + app_segment(0xE0, b'JFIF\x00' + bytes(9)) + b'\xff\xd9')
+
+
+def test_png_dimensions_and_exif_after_large_chunks():
+    png = encode_image('.png', size=(30, 40))
+    # Large text chunks before eXIf and IDAT, well beyond the head buffer
+    extra = png_chunk(b'tEXt', b'comment\x00' + bytes(HEAD_BYTES)) + png_chunk(b'eXIf', b'MM\x00*')
+    data = png[:33] + extra + png[33:]
+    info = probe_media(data)
+    assert (info['format'], info['width'], info['height'], info['has_exif']) == ('png', 40, 30, True)
+
+
+def test_mp4_header(tmp_path):
+    info = probe_media(write_video(str(tmp_path / 'clip.mp4'), frames=20, fps=10))
+    assert info['type'] == 'video' and info['format'] == 'mp4'
+    assert (info['width'], info['height']) == (160, 120)
+    assert info['frame_count'] == 20
+    assert info['duration'] == pytest.approx(2.0, rel=0.1)
+
+
+def test_limits_are_enforced():
+    data = encode_image('.png', size=(100, 100))
+    with pytest.raises(ProbeError) as too_big:
+        probe_media(data, max_pixels=5_000)
+    assert too_big.value.status_code == 413
+    with pytest.raises(ProbeError) as too_large:
+        probe_media(data, max_bytes=10)
+    assert too_large.value.status_code == 413
+
+
+@pytest.mark.parametrize('data', [b'', b'not media at all', b'\x89PNG\r\n\x1a\n\x00'])
+def test_unrecognised_or_truncated_input_is_rejected(data):
+    with pytest.raises(ProbeError) as error:
+        probe_media(data)
+    assert error.value.status_code == 400
+
+
+def test_max_dimension_reduces_the_decode(api):
+    data = encode_image('.jpg', size=(480, 640), seed=8)
+    result = upload(api, data, 'big.jpg', max_dimension=160)
+    metadata = result['analysis_result']['metadata']
+    assert (metadata['width'], metadata['height']) == (640, 480)
+    assert metadata['analysis_scale'] == 0.25
+    assert result['options']['max_dimension'] == 160
+    # A full-size request does not reuse the downscaled analysis
+    assert 'analysis_scale' not in upload(api, data, 'big.jpg')['analysis_result']['metadata']
+
+
+def test_max_dimension_must_be_positive(api):
+    response = api.post('/upload', params={'max_dimension': 0}, files={'file': ('a.jpg', encode_image('.jpg'))})
+    assert response.status_code == 400
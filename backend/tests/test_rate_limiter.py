@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from explainability import GeminiRateLimiter
+
+
+def run(limiter, count, tokens=1, hold=0.0):
+    """Push count calls through the limiter; returns (start order, peak in flight, seconds taken)."""
+    order, running, peak = [], [0], [0]
+
+    async def call(n):
+        async with limiter.limit(tokens):
+            order.append(n)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(hold)
+            running[0] -= 1
+
+    async def main():
+        started = time.monotonic()
+        await asyncio.gather(*(call(n) for n in range(count)))
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(main())
+    return order, peak[0], elapsed
+
+
+def test_concurrency_is_capped_and_waiters_go_in_order():
+    order, peak, _ = run(GeminiRateLimiter(max_concurrency=2), 6, hold=0.01)
+    assert peak == 2
+    assert order == list(range(6))
+
+
+def test_requests_per_minute_bucket():
+    # 1200 rpm holds 1200 requests and refills one every 50 ms
+    limiter = GeminiRateLimiter(max_concurrency=10, rpm=1200)
+    limiter._requests = 2.0
+    _, _, elapsed = run(limiter, 4)
+    assert 0.09 <= elapsed < 1.0
+
+
+def test_tokens_per_minute_bucket():
+    limiter = GeminiRateLimiter(max_concurrency=10, rpm=1000, tpm=60_000)
+    limiter._tokens = 1_000.0
+    # The second call needs 1000 more tokens, refilled at 1000 per second
+    _, _, elapsed = run(limiter, 2, tokens=1_000)
+    assert 0.9 <= elapsed < 2.0
+
+
+def test_a_request_larger_than_the_quota_still_runs():
+    _, _, elapsed = run(GeminiRateLimiter(tpm=100), 1, tokens=10_000)
+    assert elapsed < 0.5
@@ -0,0 +1,52 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+from serialization import decimate, dumps, encode_response, shape_analysis, validate_raw_format
+
+
+def test_decimate_keeps_each_bucket_extremes_in_order():
+    values = np.sin(np.linspace(0, 20, 1000))
+    values[537] = 5.0
+    values[811] = -5.0
+    index, kept = decimate(values, 100)
+    assert len(kept) <= 100
+    assert np.all(np.diff(index) > 0)
+    assert 537 in index and 811 in index
+    np.testing.assert_array_equal(kept, values[index])
+
+
+def test_decimate_leaves_short_series_alone():
+    values = np.arange(10.0)
+    index, kept = decimate(values, 10)
+    assert index is None and kept is values
+    assert decimate(values, None)[0] is None
+
+
+def test_shape_analysis_decimates_and_records_positions():
+    content = {'analysis_result': {'metrics': {}, 'raw_data': {'motion': list(range(500))}}}
+    shaped = shape_analysis(content, max_points=50)['analysis_result']
+    assert len(shaped['raw_data']['motion']) <= 50
+    assert shaped['raw_data_index']['motion'][0] == 0 and shaped['raw_data_index']['motion'][-1] == 499
+    assert 'raw_data_index' not in content['analysis_result']
+
+
+def test_base64_series_round_trip():
+    content = {'analysis_result': {'raw_data': {'edge': [0.5, 1.25, -3.0]}}}
+    body, media_type = encode_response(content, raw_format='base64')
+    series = json.loads(body)['analysis_result']['raw_data']['edge']
+    assert media_type == 'application/json'
+    assert series['dtype'] == 'float32' and series['length'] == 3
+    np.testing.assert_array_equal(np.frombuffer(base64.b64decode(series['data']), '<f4'), [0.5, 1.25, -3.0])
+
+
+def test_dumps_handles_numpy_values():
+    assert json.loads(dumps({'a': np.float32(1.5), 'b': np.arange(3), 'c': np.int64(7)})) == {'a': 1.5, 'b': [0, 1, 2], 'c': 7}
+
+
+def test_unknown_raw_format_is_rejected():
+    validate_raw_format('list')
+    with pytest.raises(ValueError):
+        validate_raw_format('csv')
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from metric_registry import METRICS
+from similarity_index import SimilarityIndex, feature_vector, verdict_votes
+from tests.conftest import upload, encode_image
+
+IMAGE = METRICS['image']
+
+
+def metrics_at(scale):
+    """Image metrics at `scale` of the way from 0 to each high threshold."""
+    return {name: scale * spec['high_threshold'] for name, spec in IMAGE.items()}
+
+
+def metrics_from(rng, center, spread=0.05):
+    return metrics_at(1.0) | {name: max(value * (1 + rng.normal(0, spread)), 0.0)
+                              for name, value in metrics_at(center).items()}
+
+
+def test_feature_vector_scales_against_the_thresholds():
+    assert np.allclose(feature_vector('image', metrics_at(0.0)), 0.0)
+    assert np.allclose(feature_vector('image', metrics_at(1.0)), 1.0)
+    assert feature_vector('image', {'edge_density': 0.1}) is None
+    assert feature_vector('audio', metrics_at(1.0)) is None
+
+
+def test_neighbors_are_nearest_first_and_exclude_the_query():
+    index = SimilarityIndex()
+    for i, scale in enumerate([0.5, 0.52, 0.6, 2.0]):
+        assert index.add(f'a{i}', 'image', metrics_at(scale), 'ai' if i < 2 else 'authentic')
+    assert not index.add('partial', 'image', {'edge_density': 0.1})
+    found = index.neighbors('a0', k=2)
+    assert found['type'] == 'image'
+    assert [n['id'] for n in found['neighbors']] == ['a1', 'a2']
+    assert index.neighbors('partial') is None
+
+
+def test_removed_and_reindexed_ids(tmp_path):
+    index = SimilarityIndex(str(tmp_path / 'index.db'))
+    index.add('near', 'image', metrics_at(0.5))
+    index.add('far', 'image', metrics_at(3.0))
+    index.add('query', 'image', metrics_at(0.51))
+    index.remove('near')
+    assert [n['id'] for n in index.neighbors('query')['neighbors']] == ['far']
+    index.add('far', 'image', metrics_at(0.5))
+    assert [n['id'] for n in index.neighbors('query')['neighbors']] == ['far']
+    assert index.stats()['image']['entries'] == 2
+
+
+def test_rows_from_another_process_are_picked_up(tmp_path):
+    path = str(tmp_path / 'index.db')
+    reader, writer = SimilarityIndex(path), SimilarityIndex(path)
+    reader.add('mine', 'image', metrics_at(0.5))
+    writer.add('theirs', 'image', metrics_at(0.6), 'deepfake')
+    assert reader.neighbors('mine')['neighbors'][0]['id'] == 'theirs'
+
+
+def ids_and_distances(index, query):
+    return [(n['id'], round(n['distance'], 5)) for n in index.neighbors(query, k=5)['neighbors']]
+
+
+@pytest.fixture
+def clustered():
+    """500 analyses in five tight clusters, plus the id of one query per cluster."""
+    rng = np.random.default_rng(0)
+    centers = [0.2, 0.6, 1.0, 1.6, 2.5]
+    rows = [(f'c{c}-{i}', 'image', metrics_from(rng, center), f'v{c}', None)
+            for c, center in enumerate(centers) for i in range(100)]
+    return rows, [f'c{c}-0' for c in range(len(centers))]
+
+
+def test_ivf_search_matches_exact_search_when_every_partition_is_probed(clustered):
+    rows, queries = clustered
+    exact = SimilarityIndex(ivf_threshold=10_000)
+    ivf = SimilarityIndex(ivf_threshold=100, nprobe=1000)
+    assert exact.add_many(rows) == ivf.add_many(rows) == len(rows)
+    assert ivf.stats()['image']['partitions'] > 1 and exact.stats()['image']['partitions'] == 0
+    for query in queries:
+        assert ids_and_distances(ivf, query) == ids_and_distances(exact, query)
+
+
+def test_ivf_with_few_probes_stays_in_the_query_cluster_and_sees_new_rows(clustered):
+    rows, queries = clustered
+    index = SimilarityIndex(ivf_threshold=100, nprobe=2)
+    index.add_many(rows)
+    for c, query in enumerate(queries):
+        neighbors = index.neighbors(query, k=5)['neighbors']
+        assert len(neighbors) == 5 and all(n['verdict'] == f'v{c}' for n in neighbors)
+    # Added after partitioning: found through the unpartitioned tail
+    index.add('late', 'image', metrics_from(np.random.default_rng(1), 2.5, spread=0.0), 'late')
+    assert index.stats()['image']['unpartitioned'] == 1
+    assert 'late' in [n['id'] for n in index.neighbors(queries[-1], k=100)['neighbors']]
+
+
+def test_verdict_votes_are_weighted_by_distance():
+    votes = verdict_votes([{'verdict': 'ai', 'distance': 0.0}, {'verdict': 'authentic', 'distance': 3.0},
+                           {'verdict': 'authentic', 'distance': 3.0}, {'verdict': None, 'distance': 0.0}])
+    assert votes == {'verdict': 'ai', 'weights': {'ai': 0.667, 'authentic': 0.333}}
+    assert verdict_votes([]) == {'verdict': None, 'weights': {}}
+
+
+def test_similar_endpoint(api):
+    first = upload(api, encode_image('.jpg', seed=20), 'one.jpg')
+    upload(api, encode_image('.jpg', seed=21), 'two.jpg')
+    found = api.get(f"/similar/{first['id']}", params={'k': 1}).json()
+    assert len(found['neighbors']) == 1 and found['neighbors'][0]['id'] != first['id']
+    assert found['neighbor_verdict']['verdict'] is not None
+    assert api.get('/similar/unknown').status_code == 404
@@ -0,0 +1,49 @@
+import pytest
+
+from attrClassifier import MediaAnalyzer
+from metric_registry import metric_record, metric_verdict
+from stream_analyzer import StreamAnalyzer, iter_capture_frames
+from tests.conftest import encode_image
+
+
+def test_stream_survives_malformed_control_messages(api):
+    frame = encode_image('.jpg', seed=4)
+    with api.websocket_connect('/stream?window=0.2&hop=0.1') as ws:
+        ws.send_text('not json')
+        assert ws.receive_json()['event'] == 'error'
+        ws.send_text('{"t": "later"}')
+        assert ws.receive_json()['event'] == 'error'
+        for i in range(4):
+            ws.send_text(f'{{"t": {i * 0.1}}}')
+            ws.send_bytes(frame)
+        ws.send_text('{"end": true}')
+        events = []
+        while not events or events[-1]['event'] != 'end':
+            events.append(ws.receive_json())
+    assert events[-1]['frames_seen'] == 4
+    assert any(event['event'] == 'window' for event in events)
+
+
+def test_window_metrics_match_the_batch_analysis(video_path):
+    batch = MediaAnalyzer(sample_frames=40, timeline_seconds=None).analyze_video(video_path)['metrics']
+    # One window and no sampling gap: the stream sees exactly the frames the batch analysis does
+    events = list(StreamAnalyzer(window_seconds=60, hop_seconds=60, sample_fps=0).process(iter_capture_frames(video_path)))
+    assert len(events) == 1 and events[0]['frames'] == 40
+    assert events[0]['metrics'] == pytest.approx(batch)
+    assert events[0]['statuses'] == {name: metric_record('video', batch, name)['status'] for name in batch}
+    assert events[0]['verdict'] == metric_verdict('video', batch)
+
+
+def test_metric_selection_skips_unneeded_primitives(video_path):
+    analyzer = StreamAnalyzer(window_seconds=1, hop_seconds=1, metrics=['avg_texture_variance'])
+    events = list(analyzer.process(iter_capture_frames(video_path)))
+    assert len(events) >= 3
+    assert all(set(event['metrics']) == {'avg_texture_variance'} for event in events)
+    assert analyzer.prev_edges is None
+    with pytest.raises(ValueError):
+        StreamAnalyzer(metrics=['not_a_metric'])
+
+
+def test_stream_rejects_unknown_metrics(api):
+    with api.websocket_connect('/stream?metrics=not_a_metric') as ws:
+        assert ws.receive_json()['event'] == 'error'
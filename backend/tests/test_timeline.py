@@ -0,0 +1,43 @@
+from attrClassifier import MediaAnalyzer
+from tests.conftest import write_video
+
+
+def test_timeline_averages_each_bucket():
+    analyzer = MediaAnalyzer()
+    analyzer.metadata = {'fps': 10}
+    analyzer.frame_indices = [0, 5, 10, 25]
+    analyzer.texture_variances = [1.0, 3.0, 5.0, 7.0]
+    # Motion and edge scores belong to the later frame of each pair
+    analyzer.motion_scores = [2.0, 4.0, 6.0]
+    analyzer.edge_consistency = []
+    timeline = analyzer.build_timeline()
+    assert timeline['interval'] == {'seconds': 1.0}
+    assert timeline['time'] == [0.0, 1.0, 2.0]
+    assert timeline['samples'] == [2, 1, 1]
+    assert timeline['motion'] == [2.0, 4.0, 6.0]
+    assert timeline['texture_variance'] == [2.0, 5.0, 7.0]
+    assert timeline['edge_consistency'] == [None, None, None]
+
+
+def test_long_clip_fills_every_second(tmp_path):
+    # 12 s at 10 fps: two evenly spaced samples alone would leave most seconds empty
+    path = write_video(str(tmp_path / 'long.mp4'), frames=120)
+    timeline = MediaAnalyzer(sample_frames=2).analyze_video(path)['timeline']
+    assert timeline['time'] == [float(second) for second in range(12)]
+    assert all(count >= 1 for count in timeline['samples'])
+    assert None not in timeline['motion'][1:]
+
+
+def test_frame_buckets(video_path):
+    timeline = MediaAnalyzer(sample_frames=2, timeline_frames=10).analyze_video(video_path)['timeline']
+    assert timeline['interval'] == {'frames': 10}
+    assert timeline['time'] == [0.0, 1.0, 2.0, 3.0]
+    assert timeline['samples'] == [1, 1, 1, 1]
+
+
+def test_without_a_timeline_only_sample_frames_are_decoded(tmp_path):
+    path = write_video(str(tmp_path / 'long.mp4'), frames=120)
+    analyzer = MediaAnalyzer(sample_frames=4, timeline_seconds=None)
+    result = analyzer.analyze_video(path)
+    assert 'timeline' not in result
+    assert len(analyzer.frames) == 4
@@ -0,0 +1,294 @@
+"""
+Per-request tracing with opt-in profiling.
+
+Every HTTP request gets a Trace (its id is returned in the X-Trace-Id header).
+Spans opened with `span()` or `instrumentation.stage()` anywhere in the request
+are recorded with their parent, thread and timing, including work handed to
+asyncio.to_thread, which copies the request's context. Recent traces are kept in
+memory and served from GET /traces/{id}.
+
+Profiled traces also run cProfile in every worker thread that opens a span and
+trace tracemalloc allocations for the duration of the request. The event-loop
+thread is never profiled: it interleaves every concurrent request, so its
+samples could not be attributed to this one. tracemalloc is process-wide, so the
+memory figures include whatever else ran at the same time. A request is profiled
+when it is sampled (PROFILE_SAMPLE_RATE) and then takes longer than
+PROFILE_SLOW_SECONDS, or, with ALLOW_DEBUG_PROFILE=1, when it sends
+X-Debug-Profile: 1. The profile is written to PROFILE_DIR as <trace id>.prof,
+for pstats or snakeviz.
+
+Both switches default to off because they are meant for operators: EXPOSE_TRACES=1
+serves /traces, and ALLOW_DEBUG_PROFILE=1 lets clients turn profiling on.
+"""
+
+import asyncio
+import cProfile
+import functools
+import inspect
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "../profiles")
+# Requests slower than this keep their sampled profile (unset: only X-Debug-Profile requests are profiled)
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", 0)) or None
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.05 if PROFILE_SLOW_SECONDS else 0))
+MAX_TRACES = int(os.getenv("TRACE_BUFFER_SIZE", 500))
+# Set ALLOW_DEBUG_PROFILE=1 to honour X-Debug-Profile from clients (profiling slows the whole process)
+ALLOW_DEBUG_PROFILE = os.getenv("ALLOW_DEBUG_PROFILE", "0") == "1"
+# Set EXPOSE_TRACES=1 to serve /traces and the stored profiles (they reveal internals and take no auth)
+EXPOSE_TRACES = os.getenv("EXPOSE_TRACES", "0") == "1"
+
+# Incoming trace ids are reused (so a proxy's id carries through) only if they are safe as file names
+_TRACE_ID = re.compile(r"^[0-9A-Za-z-]{8,64}$")
+
+_current = ContextVar("trace", default=None)
+_parent = ContextVar("span_parent", default=None)
+_thread = threading.local()
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+# Finished traces by id, oldest dropped first
+TRACES = OrderedDict()
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: str = None, profile: bool = False):
+        self.id = trace_id if trace_id and _TRACE_ID.match(trace_id) else uuid.uuid4().hex
+        self.name = name
+        self.profile = profile
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = []
+        self.profiles = []
+        self.memory = None
+        self._start = time.perf_counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "profiled": bool(self.profiles),
+            "memory": self.memory,
+            "spans": sorted(self.spans, key=lambda s: s["start"]),
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def profile_decision(debug_header: str = None):
+    """
+    Whether to profile a request.
+
+    Returns:
+        tuple: (profile, keep) where keep is True when the profile must be stored
+            regardless of latency, and None to keep it only if the request is slow
+    """
+    if ALLOW_DEBUG_PROFILE and debug_header == "1":
+        return True, True
+    if PROFILE_SLOW_SECONDS is not None and random.random() < PROFILE_SAMPLE_RATE:
+        return True, None
+    return False, None
+
+
+def begin(name: str, trace_id: str = None, profile: bool = False):
+    """Start a trace in the current context; pass the returned token to end()."""
+    trace = Trace(name, trace_id, profile)
+    if profile:
+        _start_tracemalloc()
+    return trace, _current.set(trace)
+
+
+def end(trace: Trace, token, keep_profile: bool = None) -> Trace:
+    """
+    Finish a trace and store it.
+
+    Args:
+        keep_profile (bool, optional): Write the profile to PROFILE_DIR; by default
+            only when the trace was slower than PROFILE_SLOW_SECONDS
+    """
+    _current.reset(token)
+    trace.duration = time.perf_counter() - trace._start
+    data = None
+    if trace.profile:
+        if keep_profile is None:
+            keep_profile = PROFILE_SLOW_SECONDS is not None and trace.duration >= PROFILE_SLOW_SECONDS
+        trace.memory = _stop_tracemalloc(snapshot=keep_profile)
+        if keep_profile:
+            data = _save_profile(trace)
+        else:
+            trace.profiles = []
+            trace.memory = None
+
+    TRACES[trace.id] = data or trace.to_dict()
+    TRACES.move_to_end(trace.id)
+    while len(TRACES) > MAX_TRACES:
+        TRACES.popitem(last=False)
+    return trace
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a span in the current trace (a no-op outside one)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    span_id = next(trace._ids)
+    token = _parent.set(span_id)
+    profiler = _start_profiler(trace)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _stop_profiler(trace, profiler)
+        parent = _parent_of(token)
+        _parent.reset(token)
+        record = {
+            "id": span_id, "parent": parent, "name": name,
+            "start": start - trace._start, "duration": duration,
+            "thread": threading.current_thread().name,
+        }
+        if attributes:
+            record["attributes"] = attributes
+        if error:
+            record["error"] = error
+        trace.spans.append(record)
+
+
+def traced(name: str = None):
+    """Decorator recording each call of a function (sync or async) as a span."""
+    def decorate(fn):
+        span_name = name or fn.__qualname__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with span(span_name):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    """A recent trace from memory, or a profiled one from PROFILE_DIR."""
+    if trace_id in TRACES:
+        return TRACES[trace_id]
+    path = profile_path(trace_id, ".json")
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def profile_path(trace_id: str, ext: str = ".prof") -> Optional[str]:
+    if not _TRACE_ID.match(trace_id):
+        return None
+    return os.path.join(PROFILE_DIR, trace_id + ext)
+
+
+def _parent_of(token):
+    return token.old_value if token.old_value is not token.MISSING else None
+
+
+def _start_profiler(trace: Trace):
+    # One profiler per thread; nested spans in that thread are covered by the outer one
+    if not trace.profile or getattr(_thread, "profiling", False) or _on_event_loop():
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler owns this interpreter (e.g. a concurrent profiled request on 3.12+)
+        return None
+    _thread.profiling = True
+    return profiler
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _stop_profiler(trace: Trace, profiler):
+    if profiler is None:
+        return
+    profiler.disable()
+    _thread.profiling = False
+    with trace._lock:
+        trace.profiles.append(profiler)
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        else:
+            tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc(snapshot: bool = True) -> Dict[str, Any]:
+    """Peak traced memory (process-wide while this request ran) and the largest allocation sites."""
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:15] if snapshot else []
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top_allocations": [{"site": str(stat.traceback), "bytes": stat.size, "count": stat.count} for stat in top],
+    }
+
+
+def _save_profile(trace: Trace) -> Dict[str, Any]:
+    """Merge the per-thread profiles into <id>.prof and write the trace beside it as <id>.json."""
+    data = trace.to_dict()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if trace.profiles:
+        stats = pstats.Stats(trace.profiles[0])
+        for profiler in trace.profiles[1:]:
+            stats.add(profiler)
+        stats.dump_stats(profile_path(trace.id))
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(30)
+        data["profile_summary"] = summary.getvalue()
+    with open(profile_path(trace.id, ".json"), "w") as f:
+        json.dump(data, f)
+    return data
@@ -0,0 +1,110 @@
+"""
+Analysis worker. Claims jobs from the broker named by BROKER_URL and runs the
+detector, the local analysis and the previews, so the API process only receives
+uploads and writes explanations. Start as many as the host (or hosts) can take:
+
+    BROKER_URL=sqlite:///broker.db python worker.py --concurrency 4
+"""
+
+import argparse
+import os
+import socket
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from blob_store import BlobStore
+from broker import get_broker
+from pipeline import run_analysis_job, warm_up
+from instrumentation import render
+
+
+def run_worker(broker, blob_store, queue="analysis", worker_id=None, stop=None):
+    """Claim and run jobs until `stop` is set."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        job = broker.claim_blocking(queue, worker_id, timeout=1.0)
+        if job is None:
+            continue
+        job_id, payload = job
+        done = threading.Event()
+        heartbeat = threading.Thread(target=keep_lease, args=(broker, job_id, worker_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = run_analysis_job(payload, blob_store)
+        except ValueError as e:
+            broker.fail(job_id, str(e), 400)
+        except Exception as e:
+            traceback.print_exc()
+            broker.fail(job_id, f"Analysis failed: {e}", 500)
+        else:
+            broker.complete(job_id, result)
+        finally:
+            done.set()
+            heartbeat.join()
+
+
+def keep_lease(broker, job_id, worker_id, done):
+    """Renew a job's lease a few times per lease period until `done` is set, however long the job runs."""
+    while not done.wait(broker.lease_seconds / 3):
+        if not broker.renew(job_id, worker_id):
+            print(f"Lost the lease on job {job_id}; another worker may run it again")
+            return
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the worker's stage metrics at /metrics for Prometheus."""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrueView analysis worker")
+    parser.add_argument("--queue", default="analysis")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1, help="Jobs run in parallel by this process")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics for this worker on this port")
+    args = parser.parse_args()
+
+    broker = get_broker()
+    if broker is None:
+        parser.error("Set BROKER_URL (e.g. sqlite:///broker.db or redis://localhost:6379/0)")
+    blob_store = BlobStore.from_env()
+
+    if args.metrics_port:
+        server = ThreadingHTTPServer(("", args.metrics_port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    if os.getenv("WARMUP", "1") != "0":
+        # First decode and detector connection before the first job, not during it
+        print(f"Warm-up: {warm_up()}")
+
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=run_worker, args=(broker, blob_store, args.queue), kwargs={"stop": stop}, daemon=True)
+        for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Worker consuming '{args.queue}' with {args.concurrency} thread(s)")
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
-import { useLocation, useNavigate } from "react-router-dom";
+import { useLocation, useNavigate, useSearchParams } from "react-router-dom";
 import { AnalysisReasoning } from "@/components/AnalysisReasoning";
-import { useState } from "react";
+import { useEffect, useState } from "react";
 
 interface VerdictProps {
   label: string;
@@ -90,9 +90,11 @@ const MetricBox = ({ metric }: { metric: MetricData }) => {
 const Dashboard = () => {
   const navigate = useNavigate();
   const location = useLocation();
+  const [searchParams] = useSearchParams();
+  const resultId = searchParams.get("id");
 
   // ✅ Safe destructure from navigation state
-  const state = location.state as
+  const navigationState = location.state as
     | {
         file: {
           path: string;
@@ -105,12 +107,26 @@ const Dashboard = () => {
           metricExplanations?: MetricData[];
           deepfake_confidence: number;
           is_deepfake: boolean;
+          previews?: { thumbnail?: string; poster?: string; clip?: string } | null;
         };
       }
     | undefined;
 
+  // Reloaded or shared links have no navigation state: load the stored result by id
+  const [storedState, setStoredState] = useState<typeof navigationState>(undefined);
+  useEffect(() => {
+    if (navigationState || !resultId) return;
+    fetch(`http://localhost:8000/results/${resultId}`)
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => data && setStoredState({ file: data }))
+      .catch((err) => console.error("Failed to load result:", err));
+  }, [navigationState, resultId]);
+  const state = navigationState ?? storedState;
+
   const fileUrl = state?.file?.path ? `http://localhost:8000${state.file.path}` : "";
   const isVideo = state?.file?.type === "video";
+  // Small WebP poster instead of the original; videos only fetch the original (by range) once played
+  const posterUrl = state?.file?.previews?.poster ? `http://localhost:8000${state.file.previews.poster}` : "";
 
   const aiDetected = state?.file?.ai_detected ?? false;
   const aiConfidence = (state?.file?.ai_confidence ?? 0) * 100;
@@ -166,7 +182,7 @@ const Dashboard = () => {
         <div className="grid grid-cols-1 lg:grid-cols-2 gap-6 items-start">
           {/* LEFT SIDE */}
           <div className="space-y-4">
-            <div className="rounded-xl overflow-hidden backdrop-blur-lg bg-white/5 border border-white/10 shadow-lg">{isVideo ? <video src={fileUrl} controls className="w-full rounded-xl" /> : <img src={fileUrl} alt="Uploaded Media" className="w-full rounded-xl" />}</div>
+            <div className="rounded-xl overflow-hidden backdrop-blur-lg bg-white/5 border border-white/10 shadow-lg">{isVideo ? <video src={fileUrl} poster={posterUrl || undefined} preload="none" controls className="w-full rounded-xl" /> : <img src={posterUrl || fileUrl} alt="Uploaded Media" className="w-full rounded-xl" />}</div>
 
             {/* Two side-by-side verdicts */}
             <div className="flex flex-col sm:flex-row gap-4">
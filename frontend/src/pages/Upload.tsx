@@ -43,7 +43,7 @@ export default function Upload() {
       console.log("Response data:", data);
 
       if (data && !data.error && data.status !== "Unsupported or invalid file type") {
-        navigate("/dashboard", { state: { file: data } });
+        navigate(data.id ? `/dashboard?id=${data.id}` : "/dashboard", { state: { file: data } });
       } else {
         setError("Unsupported or invalid file type");
       }